@@ -0,0 +1,62 @@
+"""
+WuPhysarumのベンチマークを実行する
+
+使い方:
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 200 1000 --densities 0.5 --engines mesa vector --steps 10
+    python benchmark.py --sizes 2000 --precisions float64 float32
+    python benchmark.py --sizes 200 --engines mesa vector jit --phases   # 処理ごとの内訳も求める
+    python benchmark.py --compare old.json new.json   # 2つの結果を比較する
+"""
+
+import json
+import argparse
+
+from wu_physarum.lib.benchmark import build_cases, compare_results, run_benchmark
+
+
+DATAPOINT_FILENAMES = ["demo.json", "twelve_ring.json", "knapsack6_R5_center8.json"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WuPhysarum benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 500, 1000, 2000])
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.1, 0.5])
+    parser.add_argument("--datapoints", nargs="+", default=DATAPOINT_FILENAMES)
+    parser.add_argument("--engines", nargs="+", default=["vector"])
+    parser.add_argument("--diffusions", nargs="+", default=["box"])
+    parser.add_argument("--precisions", nargs="+", default=["float64"], choices=["float64", "float32"])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--phases", action="store_true",
+                        help="処理ごとの内訳を、profilerを付けた別の実行で求める")
+    parser.add_argument("--timeout", type=float, default=None, help="1ケースあたりの制限時間（秒）")
+    parser.add_argument("--output", default=None, help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="2つの結果ファイルを比較する")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            rows = compare_results(json.load(f), json.load(g))
+        for row in rows:
+            print(row.pop("case"))
+            for key, (old, new, ratio) in row.items():
+                print("    {:<14} {} -> {} ({})".format(
+                    key, old, new, "-" if ratio is None else "x{:.3f}".format(ratio)))
+        return
+
+    cases = build_cases(
+        sizes=args.sizes,
+        densities=args.densities,
+        datapoint_filenames=args.datapoints,
+        engines=args.engines,
+        diffusions=args.diffusions,
+        steps=args.steps,
+        seed=args.seed,
+        precisions=args.precisions,
+    )
+    run_benchmark(cases, output=args.output, timeout=args.timeout, phases=args.phases)
+
+
+if __name__ == "__main__":
+    main()
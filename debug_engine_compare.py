@@ -0,0 +1,113 @@
+"""
+エンジン比較デバッグ用モジュール
+
+engine="mesa" (agent.py) と engine="vector" (vector_agent.py) を
+同じ条件で複数のseedについて実行し、後半ステップの統計量（エージェント数, trailの平均）が
+seed間のばらつきの範囲で一致するかを Welch の t 検定で確認する。
+mesa の代わりに、numbaがあれば mesa と完全に同じ結果になる engine="jit" を使う（debug_jit_compare.py を参照）。
+
+vector は全エージェントが同時に判断するため、RandomActivationの逐次処理とは
+- センシングが同じステップ内で先に動いたエージェントの付着したtrailを見ない
+- 同じステップ内で消滅したエージェントのセルに、後のエージェントが移動できない
+点が異なり、mesa よりエージェント数・trailが約3%小さくなる（既知の偏り、seed間の標準偏差の1倍強）。
+空きセルの奪い合いの打ち切り (vector_agent.MAX_MOVE_ROUNDS) によるものではないことを確かめるため、
+MAX_MOVE_ROUNDS を UNBOUNDED_MOVE_ROUNDS にした vector も実行して並べて表示する（demo.json では結果が変わらない）。
+使い方: python debug_engine_compare.py [datapoint_filename] [steps] [seeds]
+"""
+
+import sys
+import time
+
+import numpy as np
+from scipy.stats import ttest_ind
+
+from wu_physarum import vector_agent
+from wu_physarum.lib.jit import kernel_available
+from wu_physarum.model import WuPhysarum
+
+
+METRICS = ["agent count", "mean trail"]
+ALPHA = 0.01                # これより p 値が小さければ差があるとみなす
+KNOWN_BIAS = 0.05           # 同時更新による既知の偏りとして許す相対誤差
+UNBOUNDED_MOVE_ROUNDS = 1000
+
+
+def run(engine, datapoint_filename, seed, steps):
+    """
+    モデルをsteps回進め、後半ステップの統計量の平均を返す
+
+    出力：shape (2,) の配列 [エージェント数, trailの平均]
+    """
+    model = WuPhysarum(datapoint_filename=datapoint_filename, seed=seed, engine=engine)
+    stats = []
+    start = time.time()
+    for step in range(steps):
+        model.step()
+        if step >= steps // 2:
+            stats.append((model.agent_count, model.trail_map.mean()))
+    print("{:>6} seed={} {:.2f} sec".format(engine, seed, time.time() - start))
+    return np.mean(stats, axis=0)
+
+
+def run_seeds(engine, datapoint_filename, seeds, steps, move_rounds=None):
+    """
+    各seedの後半ステップの平均 (shape (len(seeds), 2)) を返す
+    move_rounds を与えると、その間だけ vector_agent.MAX_MOVE_ROUNDS を置き換える
+    """
+    default_rounds = vector_agent.MAX_MOVE_ROUNDS
+    if move_rounds is not None:
+        vector_agent.MAX_MOVE_ROUNDS = move_rounds
+    try:
+        return np.array([run(engine, datapoint_filename, seed, steps) for seed in seeds])
+    finally:
+        vector_agent.MAX_MOVE_ROUNDS = default_rounds
+
+
+def summarize(reference, values):
+    """
+    referenceに対するvaluesの相対誤差, seed間の標準偏差を単位とした差, Welch の t 検定の p 値を返す
+    """
+    m, v = reference.mean(), values.mean()
+    sd = np.sqrt((reference.var(ddof=1) + values.var(ddof=1)) / 2)
+    pvalue = ttest_ind(values, reference, equal_var=False).pvalue
+    return (v - m) / max(abs(m), 1e-12), (v - m) / max(sd, 1e-12), pvalue
+
+
+def compare(datapoint_filename="demo.json", steps=300, n_seeds=16):
+    """
+    各統計量についてseedごとの後半ステップの平均を標本とし、mesa と vector の差を検定する
+    p 値が ALPHA 以上なら OK、差があっても相対誤差が KNOWN_BIAS 以内なら既知の偏り (BIAS)、それ以外は NG
+    """
+    seeds = list(range(n_seeds))
+    reference_engine = "jit" if kernel_available() else "mesa"
+    reference = run_seeds(reference_engine, datapoint_filename, seeds, steps)
+    vector = run_seeds("vector", datapoint_filename, seeds, steps)
+    unbounded = run_seeds("vector", datapoint_filename, seeds, steps, UNBOUNDED_MOVE_ROUNDS)
+
+    print("{} seeds, mean of steps {}-{} (mean ± sd over seeds)".format(n_seeds, steps // 2 + 1, steps))
+    is_equivalent = True
+    for i, name in enumerate(METRICS):
+        print("{:<12} {:<6} {:.4f} ± {:.4f}".format(
+            name, reference_engine, reference[:, i].mean(), reference[:, i].std(ddof=1)))
+        for label, values in (("vector", vector), ("vector (MAX_MOVE_ROUNDS={})".format(UNBOUNDED_MOVE_ROUNDS),
+                                                    unbounded)):
+            bias, bias_sd, pvalue = summarize(reference[:, i], values[:, i])
+            print("{:<12} {} {:.4f} ± {:.4f}  bias={:+.2%} ({:+.2f} sd) p={:.3g}".format(
+                "", label, values[:, i].mean(), values[:, i].std(ddof=1), bias, bias_sd, pvalue))
+        bias, _, pvalue = summarize(reference[:, i], vector[:, i])
+        if pvalue >= ALPHA:
+            result = "OK"
+        elif abs(bias) <= KNOWN_BIAS:
+            result = "BIAS (known, synchronous update)"
+        else:
+            result = "NG"
+            is_equivalent = False
+        print("{:<12} {}".format("", result))
+    return is_equivalent
+
+
+if __name__ == "__main__":
+    datapoint_filename = sys.argv[1] if len(sys.argv) > 1 else "demo.json"
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    n_seeds = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    sys.exit(0 if compare(datapoint_filename, steps, n_seeds) else 1)
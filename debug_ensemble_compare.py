@@ -0,0 +1,52 @@
+"""
+アンサンブル比較デバッグ用モジュール
+
+WuPhysarumEnsemble (ensemble.py) の各レプリカが、
+同じシード値の WuPhysarum(engine="vector") と完全に一致するかを確認する
+使い方: python debug_ensemble_compare.py [datapoint_filename] [steps] [diffusion]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wu_physarum.ensemble import WuPhysarumEnsemble
+from wu_physarum.model import WuPhysarum
+
+
+SEEDS = [0, 1, 2, 3, 4, 5, 6]
+
+
+def compare(datapoint_filename="demo.json", steps=100, diffusion="box"):
+    start = time.time()
+    singles = []
+    for seed in SEEDS:
+        model = WuPhysarum(datapoint_filename=datapoint_filename, seed=seed, engine="vector", diffusion=diffusion)
+        for _ in range(steps):
+            model.step()
+        singles.append(model)
+    print("single   {:.2f} sec".format(time.time() - start))
+
+    start = time.time()
+    ensemble = WuPhysarumEnsemble(datapoint_filename=datapoint_filename, seeds=SEEDS, diffusion=diffusion)
+    for _ in range(steps):
+        ensemble.step()
+    print("ensemble {:.2f} sec".format(time.time() - start))
+
+    is_equivalent = True
+    for b, model in enumerate(singles):
+        replica = ensemble.replica(b)
+        ok = np.array_equal(replica.chenu_map, model.chenu_map) \
+            and np.array_equal(replica.trail_map, model.trail_map) \
+            and all(np.array_equal(r, m) for r, m in zip(replica.agent_state(), model.agent_state()))
+        is_equivalent &= ok
+        print("seed={} agents={} {}".format(replica.seed, replica.agent_count, "OK" if ok else "NG"))
+    return is_equivalent
+
+
+if __name__ == "__main__":
+    datapoint_filename = sys.argv[1] if len(sys.argv) > 1 else "demo.json"
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    diffusion = sys.argv[3] if len(sys.argv) > 3 else "box"
+    sys.exit(0 if compare(datapoint_filename, steps, diffusion) else 1)
@@ -0,0 +1,68 @@
+"""
+プロトタイプ比較デバッグ用モジュール
+
+WuPhysarumPrototype.fork で同じプロセスに複数のモデルを作り、1ステップずつ交互に実行しても、
+各モデルが同じシード値の WuPhysarum を単独で実行した場合と完全に一致するかを確認する
+（エージェントの状態, chenu_map, trail_map, 乱数生成器の状態を毎ステップ比較する）。
+使い方: python debug_fork_compare.py [datapoint_filename] [steps] [engine]
+"""
+
+import sys
+
+import numpy as np
+
+from wu_physarum.model import WuPhysarum, WuPhysarumPrototype
+
+
+# 同じシード値を2つ含め、同じシード値のモデル同士が乱数を取り合わないことも確認する
+SEEDS = [0, 1, 0]
+
+
+def snapshot(model):
+    return (*model.agent_state(), model.chenu_map.copy(), model.trail_map.copy(), model.random.getstate())
+
+
+def is_same(a, b):
+    *arrays_a, random_a = a
+    *arrays_b, random_b = b
+    return all(np.array_equal(p, q) for p, q in zip(arrays_a, arrays_b)) and random_a == random_b
+
+
+def run_single(datapoint_filename, seed, steps, engine):
+    """
+    モデルを1つだけ作って実行し、各ステップ後の状態のリストを返す
+    """
+    model = WuPhysarum(datapoint_filename=datapoint_filename, seed=seed, engine=engine)
+    snapshots = [snapshot(model)]
+    for _ in range(steps):
+        model.step()
+        snapshots.append(snapshot(model))
+    return snapshots
+
+
+def compare(datapoint_filename="demo.json", steps=10, engine="mesa"):
+    singles = {seed: run_single(datapoint_filename, seed, steps, engine) for seed in set(SEEDS)}
+
+    # すべてのモデルを作ってから交互に実行する
+    prototype = WuPhysarumPrototype(datapoint_filename=datapoint_filename)
+    models = [prototype.fork(seed, engine=engine) for seed in SEEDS]
+    is_equivalent = True
+    for step in range(steps + 1):
+        if step > 0:
+            for model in models:
+                model.step()
+        for i, (seed, model) in enumerate(zip(SEEDS, models)):
+            if not is_same(snapshot(model), singles[seed][step]):
+                print("step {}: model {} (seed={}) NG".format(step, i, seed))
+                is_equivalent = False
+        if not is_equivalent:
+            return False
+    print("{} steps OK ({} models, engine={})".format(steps, len(models), engine))
+    return True
+
+
+if __name__ == "__main__":
+    datapoint_filename = sys.argv[1] if len(sys.argv) > 1 else "demo.json"
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    engine = sys.argv[3] if len(sys.argv) > 3 else "mesa"
+    sys.exit(0 if compare(datapoint_filename, steps, engine) else 1)
@@ -0,0 +1,77 @@
+"""
+JITカーネル デバッグ用モジュール
+
+同じシード値で WuPhysarum(engine="mesa") と WuPhysarum(engine="jit") を実行し、
+エージェント（ID, 位置, dir_id, motion_counter）, chenu_map, trail_map, 乱数生成器の状態が
+毎ステップ完全に一致するかを確認する。
+numbaがインストールされていない場合は、カーネルをPythonのまま実行して確認する（遅い）。
+使い方: python debug_jit_compare.py [datapoint_filename] [steps] [precision]
+"""
+
+import os
+import sys
+import time
+
+try:
+    import numba  # noqa: F401
+except ImportError:
+    # lib/jit.py を import する前に設定する
+    os.environ["WU_PHYSARUM_JIT"] = "python"
+
+import numpy as np
+
+from wu_physarum.lib.jit import JIT_MODE
+from wu_physarum.model import WuPhysarum
+
+
+SEED = 0
+
+
+def snapshot(model):
+    if model.engine == "jit":
+        unique_id = model.vectorized_agents.unique_id.copy()
+    else:
+        unique_id = np.array([a.unique_id for a in model.schedule.agents], dtype=np.int64)
+    return (unique_id, *model.agent_state(), model.chenu_map.copy(), model.trail_map.copy(),
+            np.array(model.occupancy_map), model.random.getstate())
+
+
+def is_same(a, b):
+    *arrays_a, random_a = a
+    *arrays_b, random_b = b
+    return all(np.array_equal(p, q) for p, q in zip(arrays_a, arrays_b)) and random_a == random_b
+
+
+def run(datapoint_filename, steps, precision, engine):
+    """
+    各ステップ後の状態のリストと実行時間を返す
+    """
+    model = WuPhysarum(datapoint_filename=datapoint_filename, seed=SEED, engine=engine, precision=precision)
+    snapshots = [snapshot(model)]
+    elapsed = 0.0
+    for _ in range(steps):
+        start = time.perf_counter()
+        model.step()
+        elapsed += time.perf_counter() - start
+        snapshots.append(snapshot(model))
+    return snapshots, elapsed, model.agent_count
+
+
+def compare(datapoint_filename="demo.json", steps=20, precision="float64"):
+    print("jit mode: {}".format(JIT_MODE))
+    mesa, mesa_elapsed, _ = run(datapoint_filename, steps, precision, "mesa")
+    jit, jit_elapsed, agent_count = run(datapoint_filename, steps, precision, "jit")
+    for step, (a, b) in enumerate(zip(mesa, jit)):
+        if not is_same(a, b):
+            print("step {}: NG".format(step))
+            return False
+    print("{} steps OK (agents={}, mesa {:.2f} sec, jit {:.2f} sec)".format(
+        steps, agent_count, mesa_elapsed, jit_elapsed))
+    return True
+
+
+if __name__ == "__main__":
+    datapoint_filename = sys.argv[1] if len(sys.argv) > 1 else "demo.json"
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    precision = sys.argv[3] if len(sys.argv) > 3 else "float64"
+    sys.exit(0 if compare(datapoint_filename, steps, precision) else 1)
@@ -0,0 +1,108 @@
+"""
+"sparse" 拡散処理デバッグ用モジュール
+
+1. WuPhysarum(diffusion="sparse") を実行し、毎ステップの格子セルの更新結果を
+   同じ入力に対する "convolve" の更新結果と比較する（最大誤差と有効なタイルの割合を表示する）
+2. 大きなグリッドのスター型ステージ（腕の部分のみがステージ）で、
+   エージェントのいるタイルの割合を変えながら "box" と "sparse" の1回の更新時間を比較する
+使い方: python debug_sparse_compare.py [datapoint_filename] [steps] [threshold] [size]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wu_physarum.model import WuPhysarum
+from wu_physarum.lib.diffusion import SparseDiffusion, create_diffusion
+from wu_physarum.lib.setting import SPARSE_DIFFUSION_PARAM
+from wu_physarum.lib.star_stage import StarStage
+
+
+SEED = 0
+
+
+class CheckedDiffusion:
+    """
+    sparseの更新結果を、同じ入力に対するdenseの更新結果と比較しながら返す
+    """
+    def __init__(self, sparse, dense):
+        self.sparse, self.dense = sparse, dense
+        self.max_error = 0.0
+        self.fixed_adjacent_stage_region_cell_num_on_chenu_map = sparse.fixed_adjacent_stage_region_cell_num_on_chenu_map
+        self.fixed_adjacent_stage_region_cell_num_on_trail_map = sparse.fixed_adjacent_stage_region_cell_num_on_trail_map
+
+    def update(self, chenu_map, trail_map):
+        expected = self.dense.update(chenu_map.copy(), trail_map.copy())
+        result = self.sparse.update(chenu_map, trail_map)
+        for a, b in zip(result, expected):
+            self.max_error = max(self.max_error, float(np.abs(a - b).max() / max(b.max(), 1.0)))
+        return result
+
+
+def compare_model(datapoint_filename, steps, threshold):
+    SPARSE_DIFFUSION_PARAM["threshold"] = threshold
+    model = WuPhysarum(datapoint_filename=datapoint_filename, seed=SEED, engine="vector", diffusion="sparse")
+    dense = create_diffusion("convolve", model.stage_region, model.datapoint_region,
+                             model.diffusion.chenu_adding_intensity, model.torus)
+    checked = CheckedDiffusion(model.diffusion, dense)
+    model.diffusion = checked
+    for _ in range(steps):
+        model.step()
+    print("model: {} steps, max relative error {:.3e}, active tiles trail {:.1%}, chenu {:.1%}".format(
+        steps, checked.max_error,
+        checked.sparse.trail_field.active.mean(), checked.sparse.chenu_field.active.mean()))
+    return checked.max_error <= max(threshold, 1e-12)
+
+
+def star_stage(size):
+    """
+    中心から6本の腕が伸びるスター型のステージ（create_stage の星を size に合わせて拡大したもの）
+    """
+    stage = StarStage(size, size)
+    center, width = size // 2, max(5, size // 40)
+    for i, length in enumerate((10, 12, 7, 9, 21, 16)):
+        stage.draw_rect(center, center, 0, width, length * size / 50, 60 * i)
+    return stage.stage_region.astype(np.float64)
+
+
+def compare_speed(size, threshold, repeat=5):
+    stage = star_stage(size)
+    region = np.zeros((size, size))
+    region[size // 2 - 1:size // 2 + 2, size // 2 - 1:size // 2 + 2] = 1
+    intensity = region * 10
+    rng = np.random.default_rng(SEED)
+    i, j = np.ogrid[:size, :size]
+    distance = np.hypot(i - size // 2, j - size // 2)
+    print("star stage {}x{}: stage area {:.1%}".format(size, size, stage.mean()))
+    for fraction in (0.1, 0.3, 1.0):
+        # 中心から半径 fraction * size / 2 以内のステージのセルの半分にエージェントがいるとする
+        occupancy = (stage != 0) & (distance <= fraction * size / 2) & (rng.random((size, size)) < 0.5)
+        trail = occupancy * 5.0
+        chenu = np.zeros((size, size))
+        timings = {}
+        for backend in ("box", "sparse"):
+            if backend == "sparse":
+                diffusion = SparseDiffusion(stage, region, intensity, False, threshold=threshold)
+                diffusion.track_occupancy(occupancy)
+            else:
+                diffusion = create_diffusion(backend, stage, region, intensity, False)
+            c, t = diffusion.update(chenu, trail)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                t[occupancy] += 5.0
+                c, t = diffusion.update(c, t)
+            timings[backend] = (time.perf_counter() - start) / repeat
+        print("  agents within radius {:.0%}: box {:.2f} ms, sparse {:.2f} ms (active tiles trail {:.1%}, chenu {:.1%})".format(
+            fraction, timings["box"] * 1000, timings["sparse"] * 1000,
+            diffusion.trail_field.active.mean(), diffusion.chenu_field.active.mean()))
+
+
+if __name__ == "__main__":
+    datapoint_filename = sys.argv[1] if len(sys.argv) > 1 else "demo.json"
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    size = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+    ok = compare_model(datapoint_filename, steps, threshold)
+    compare_speed(size, threshold)
+    sys.exit(0 if ok else 1)
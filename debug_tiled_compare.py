@@ -0,0 +1,69 @@
+"""
+ストリップ分割実行デバッグ用モジュール
+
+WuPhysarumTiled (tiled.py) について以下を確認する
+- ストリップ数1の結果が、同じシード値の WuPhysarum(engine="vector") と完全に一致するか
+- 同じシード値・ストリップ数で2回実行した結果が完全に一致するか
+- 占有マップがエージェントの位置と一致し、1セルに1エージェントの制約が守られているか
+使い方: python debug_tiled_compare.py [datapoint_filename] [steps] [tiles] [diffusion]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wu_physarum.model import WuPhysarum
+from wu_physarum.tiled import WuPhysarumTiled
+
+
+SEED = 0
+
+
+def run_tiled(datapoint_filename, steps, tiles, diffusion):
+    with WuPhysarumTiled(datapoint_filename=datapoint_filename, seed=SEED, tiles=tiles, diffusion=diffusion) as model:
+        start = time.time()
+        model.run(steps)
+        print("tiles={} {:.2f} sec".format(tiles, time.time() - start))
+        return model.agent_state(), model.chenu_map.copy(), model.trail_map.copy(), np.array(model.occupancy_map)
+
+
+def is_same(a, b):
+    agents_a, *maps_a = a
+    agents_b, *maps_b = b
+    return all(np.array_equal(p, q) for p, q in zip(agents_a, agents_b)) \
+        and all(np.array_equal(p, q) for p, q in zip(maps_a, maps_b))
+
+
+def compare(datapoint_filename="demo.json", steps=100, tiles=4, diffusion="box"):
+    start = time.time()
+    model = WuPhysarum(datapoint_filename=datapoint_filename, seed=SEED, engine="vector", diffusion=diffusion)
+    for _ in range(steps):
+        model.step()
+    print("vector  {:.2f} sec".format(time.time() - start))
+    vector = (model.agent_state(), model.chenu_map, model.trail_map, model.occupancy_map)
+
+    single = run_tiled(datapoint_filename, steps, 1, diffusion)
+    ok_single = is_same(single, vector)
+    print("tiles=1 == vector: {}".format("OK" if ok_single else "NG"))
+
+    first = run_tiled(datapoint_filename, steps, tiles, diffusion)
+    second = run_tiled(datapoint_filename, steps, tiles, diffusion)
+    ok_deterministic = is_same(first, second)
+    print("tiles={} deterministic: {}".format(tiles, "OK" if ok_deterministic else "NG"))
+
+    (x, y, _, _), _, _, occupancy = first
+    expected = np.zeros_like(occupancy)
+    expected[x, y] = True
+    ok_occupancy = np.array_equal(expected, occupancy) and len(set(zip(x.tolist(), y.tolist()))) == len(x)
+    print("tiles={} occupancy: {} (agents={}, vector agents={})".format(
+        tiles, "OK" if ok_occupancy else "NG", len(x), len(vector[0][0])))
+    return ok_single and ok_deterministic and ok_occupancy
+
+
+if __name__ == "__main__":
+    datapoint_filename = sys.argv[1] if len(sys.argv) > 1 else "demo.json"
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    tiles = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    diffusion = sys.argv[4] if len(sys.argv) > 4 else "box"
+    sys.exit(0 if compare(datapoint_filename, steps, tiles, diffusion) else 1)
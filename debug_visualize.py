@@ -9,21 +9,7 @@ import seaborn as sns
 import numpy as np
 import matplotlib.pyplot as plt
 
-from wu_physarum.lib.setting import MODEL_PARAM
-
-
-def _coords2ndarray(coords):
-    """
-    model.py内の二次元配列形式
-    (プロットされる点の座標のみが入っている二次元配列)を、
-    numpy.ndarray形式に変換する
-
-    入力：((0, 0), (1, 1)) ※1に指定されている座標が(0, 0)と(1, 1)だと解釈
-    出力：[[1 0]
-           [0 1]]
-    """
-    array = [[(i, j) in coords for j in range(MODEL_PARAM["height"])] for i in range(MODEL_PARAM["width"])]
-    return np.array(array)
+from wu_physarum.lib.rasterize import coords2ndarray
 
 
 def visualize(coords, is_plotted_only_True_points):
@@ -36,7 +22,7 @@ def visualize(coords, is_plotted_only_True_points):
       -> False: 二次元配列内でプロットされる点の要素のみが1となっている二次元配列
     出力：seaborn画像
     """
-    arr = _coords2ndarray(coords) if is_plotted_only_True_points else np.array(coords)
+    arr = coords2ndarray(coords) if is_plotted_only_True_points else np.array(coords)
     plt.figure()
     ax = sns.heatmap(arr.T, cmap='gnuplot')
     ax.invert_yaxis()
@@ -1,11 +1,9 @@
-from wu_physarum.model import WuPhysarum
-from wu_physarum.lib.record import ModelRecorder
+from wu_physarum.lib.batch import ExperimentJob, run_experiments
 
-for seed in [2018, 1133, 5201, 8113, 3520, 1811, 335]:
-    experiment_name = "knapsack6"
+experiment_name = "knapsack6"
 
-    recorder = ModelRecorder(
-        model=WuPhysarum,
+jobs = [
+    ExperimentJob(
         datapoint_filename="knapsack6_R5_center8.json",
         seed=seed,                                            # モデルに与えるseed値
         figure_foldername="experiment/{}/figure/seed_{}".format(experiment_name, seed),  # 画像を保存するディレクトリ名
@@ -13,5 +11,12 @@ for seed in [2018, 1133, 5201, 8113, 3520, 1811, 335]:
         max_iteration=10000,                                   # 最大試行回数
         record_interval=100,                                   # 画像を保存する間隔（ステップ）
     )
+    for seed in [2018, 1133, 5201, 8113, 3520, 1811, 335]
+]
 
-    recorder.start()
+if __name__ == "__main__":
+    run_experiments(
+        jobs,
+        workers=None,   # 並列に実行するプロセス数（Noneの場合はCPUコア数）
+        resume=True,    # 実行済みのseedをスキップする
+    )
@@ -1,75 +1,109 @@
-from mesa import Agent
+NINF = -1000000000
 
-from .lib.setting import MODEL_PARAM, PHYSARUM_PARAM
 
+class PhysarumPool:
+    """
+    Physarumの生成・消滅で使うオブジェクトとIDのプール
 
-NINF = -1000000000
+    消滅したエージェントのオブジェクトを再利用し、IDは空きIDのリストから割り当てる。
+    ステップ中に消滅したエージェントのIDは、そのステップのスケジュール（ステップ開始時のIDの並び）に
+    残っているため、end_stepを呼ぶまで再利用しない。
 
-__SENSOR_OFFSET = PHYSARUM_PARAM["sensor_arm_length"] // 2
-OFFSET = {
-    # [offset of x, offset of y]
-    # under-left is [0, 0]
-
-    # NORTH
-    0: {"LSENSOR": [-__SENSOR_OFFSET, __SENSOR_OFFSET],
-        "RSENSOR": [__SENSOR_OFFSET, __SENSOR_OFFSET],
-        "FORWARD": [0, 1]},
-    # NORTH_EAST
-    1: {"LSENSOR": [0, __SENSOR_OFFSET],
-        "RSENSOR": [__SENSOR_OFFSET, 0],
-        "FORWARD": [1, 1]},
-    # EAST
-    2: {"LSENSOR": [__SENSOR_OFFSET, __SENSOR_OFFSET],
-        "RSENSOR": [__SENSOR_OFFSET, -__SENSOR_OFFSET],
-        "FORWARD": [1, 0]},
-    # SOUTH_EAST
-    3: {"LSENSOR": [__SENSOR_OFFSET, 0],
-        "RSENSOR": [0, -__SENSOR_OFFSET],
-        "FORWARD": [1, -1]},
-    # SOUTH
-    4: {"LSENSOR": [__SENSOR_OFFSET, -__SENSOR_OFFSET],
-        "RSENSOR": [-__SENSOR_OFFSET, -__SENSOR_OFFSET],
-        "FORWARD": [0, -1]},
-    # SOUTH_WEST
-    5: {"LSENSOR": [0, -__SENSOR_OFFSET],
-        "RSENSOR": [-__SENSOR_OFFSET, 0],
-        "FORWARD": [-1, -1]},
-    # WEST
-    6: {"LSENSOR": [-__SENSOR_OFFSET, -__SENSOR_OFFSET],
-        "RSENSOR": [-__SENSOR_OFFSET, __SENSOR_OFFSET],
-        "FORWARD": [-1, 0]},
-    # NORTH_WEST
-    7: {"LSENSOR": [-__SENSOR_OFFSET, 0],
-        "RSENSOR": [0, __SENSOR_OFFSET],
-        "FORWARD": [-1, 1]},
-}
-
-
-class Physarum(Agent):
+    ステップ中の移動・移動の失敗・増殖の回数 (moves, failed_moves, births) も保持し、
+    end_step で消滅の回数とともに model.profiler に渡す（エージェントごとには profiler を呼ばない）。
+    """
+    def __init__(self, model):
+        self.model = model
+        self.next_id = 1                    # まだ使っていない最小のID
+        self.free_ids = []                  # 再利用できるID
+        self.__released_ids = []            # このステップで消滅したエージェントのID
+        self.__free_agents = []             # 再利用できるオブジェクト
+        self.moves = 0                      # このステップで移動したエージェント数
+        self.failed_moves = 0               # このステップで移動できなかったエージェント数
+        self.births = 0                     # このステップで増殖したエージェント数
+
+    def acquire(self, pos):
+        """
+        posにいる新しいエージェントを返す（向きは乱数で決める）
+        """
+        if self.free_ids:
+            unique_id = self.free_ids.pop()
+        else:
+            unique_id = self.next_id
+            self.next_id += 1
+        if self.__free_agents:
+            agent = self.__free_agents.pop()
+            agent.reset(unique_id, pos)
+            return agent
+        return Physarum(unique_id, pos, self.model)
+
+    def release(self, agent):
+        """
+        grid, scheduleから取り除いたエージェントを返却する
+        """
+        self.__released_ids.append(agent.unique_id)
+        self.__free_agents.append(agent)
+
+    def end_step(self):
+        profiler = self.model.profiler
+        if profiler is not None:
+            profiler.count("moves", self.moves)
+            profiler.count("failed_moves", self.failed_moves)
+            profiler.count("births", self.births)
+            profiler.count("deaths", len(self.__released_ids))
+        self.moves = self.failed_moves = self.births = 0
+        self.free_ids.extend(self.__released_ids)
+        self.__released_ids.clear()
+
+    def get_state(self):
+        return {"next_id": self.next_id, "free_ids": self.free_ids + self.__released_ids}
+
+    def set_state(self, state):
+        self.next_id = state["next_id"]
+        self.free_ids = list(state["free_ids"])
+        self.__released_ids.clear()
+
+
+class Physarum:
     """
     モジホコリエージェント
+
+    大量に生成・消滅するため __slots__ で属性を固定し、PhysarumPool で再利用する。
+    mesa.Agent と同じ属性・メソッド（unique_id, model, pos, random, step, advance）を持つ。
     """
-    unique_id = 1
+    __slots__ = ("unique_id", "model", "pos", "dir_id", "motion_counter", "__is_successfully_moved")
     MAX_NUMBER = 410
 
-    def __init__(self, pos, model):
-        super().__init__(Physarum.unique_id, model)
-        Physarum.unique_id += 1
+    def __init__(self, unique_id, pos, model):
+        self.model = model
+        self.reset(unique_id, pos)
+
+    def reset(self, unique_id, pos):
+        """
+        生成直後の状態にする
+        """
+        self.unique_id = unique_id
         self.pos = pos
         self.dir_id = self.random.randint(0, 7)
         self.motion_counter = 0
 
         self.__is_successfully_moved = False
 
+    @property
+    def random(self):
+        return self.model.random
+
     def __get_weighted_value(self, sensor):
+        params = self.model.params
+        offset = params.offset[self.dir_id][sensor]
         sensing_pos = (
-            self.pos[0] + OFFSET[self.dir_id][sensor][0],
-            self.pos[1] + OFFSET[self.dir_id][sensor][1]
+            self.pos[0] + offset[0],
+            self.pos[1] + offset[1]
         )
         if self.model.torus is True:
             sensing_pos = (
-                sensing_pos[0] % MODEL_PARAM["width"],
-                sensing_pos[1] % MODEL_PARAM["height"]
+                sensing_pos[0] % params.model["width"],
+                sensing_pos[1] % params.model["height"]
             )
 
         if self.model.grid.out_of_bounds(sensing_pos) or self.model.stage_region[sensing_pos] is False:
@@ -78,30 +112,33 @@ class Physarum(Agent):
             sensing_cell_trail = self.model.trail_map[sensing_pos]
             sensing_cell_chenu = self.model.chenu_map[sensing_pos]
 
-            weighted_value = sensing_cell_trail * PHYSARUM_PARAM["WT"] \
-                + sensing_cell_chenu * PHYSARUM_PARAM["WN"]
+            weighted_value = sensing_cell_trail * params.physarum["WT"] \
+                + sensing_cell_chenu * params.physarum["WN"]
             return weighted_value
 
     def __move_forward(self):
+        params = self.model.params
+        offset = params.offset[self.dir_id]["FORWARD"]
         forward_pos = (
-            self.pos[0] + OFFSET[self.dir_id]["FORWARD"][0],
-            self.pos[1] + OFFSET[self.dir_id]["FORWARD"][1]
+            self.pos[0] + offset[0],
+            self.pos[1] + offset[1]
         )
         if self.model.torus is True:
             forward_pos = (
-                forward_pos[0] % MODEL_PARAM["width"],
-                forward_pos[1] % MODEL_PARAM["height"]
+                forward_pos[0] % params.model["width"],
+                forward_pos[1] % params.model["height"]
             )
 
         if not self.model.grid.out_of_bounds(forward_pos) and self.model.grid.is_cell_empty(forward_pos) and self.model.stage_region[forward_pos]:
             # If agent CAN move forward successfully,
             # 1. deposit trail on now position
-            self.model.trail_map[self.pos] += PHYSARUM_PARAM["depT"]
+            self.model.trail_map[self.pos] += params.physarum["depT"]
             # 2. agent moves forward
             self.model.grid.move_agent(self, forward_pos)
             # add 1 to self motion counter.
             self.motion_counter += 1
             self.__is_successfully_moved = True
+            self.model.physarum_pool.moves += 1
         else:
             # If agent CANNOT move forward successfully,
             # subtract 1 from self motion counter.
@@ -109,6 +146,7 @@ class Physarum(Agent):
             self.motion_counter -= 1
             self.__is_successfully_moved = False
             self.dir_id = self.random.randint(0, 7)
+            self.model.physarum_pool.failed_moves += 1
 
     @property
     def is_successfully_moved(self):
@@ -125,6 +163,23 @@ class Physarum(Agent):
             # if Lweighted_value == Rweighted_value
             return self.dir_id                      # 直進する
 
+    def __reproduct_or_eliminate(self, reproduction_pos):
+        """
+        増殖・消滅の処理を行う
+        """
+        physarum_param = self.model.params.physarum
+        # Reproduct
+        if self.motion_counter > physarum_param["RT"] and self.is_successfully_moved:
+            chrone = self.model.physarum_pool.acquire(reproduction_pos)
+            self.model.grid.place_agent(chrone, reproduction_pos)
+            self.model.schedule.add(chrone)
+            self.model.physarum_pool.births += 1
+        # Elimination
+        if self.motion_counter < physarum_param["ET"]:
+            self.model.grid.remove_agent(self)
+            self.model.schedule.remove(self)
+            self.model.physarum_pool.release(self)
+
     def step(self):
         # Memory self position for reproduction step before move or rotate
         __reproduction_pos = self.pos
@@ -141,12 +196,7 @@ class Physarum(Agent):
         self.__move_forward()
 
         """ Reproduct/Elimination Step"""
-        # Reproduct
-        if self.motion_counter > PHYSARUM_PARAM["RT"] and self.is_successfully_moved:
-            chrone = Physarum(pos=__reproduction_pos, model=self.model)
-            self.model.grid.place_agent(chrone, __reproduction_pos)
-            self.model.schedule.add(chrone)
-        # Elimination
-        if self.motion_counter < PHYSARUM_PARAM["ET"]:
-            self.model.grid.remove_agent(self)
-            self.model.schedule.remove(self)
+        self.__reproduct_or_eliminate(__reproduction_pos)
+
+    def advance(self):
+        pass
@@ -0,0 +1,199 @@
+import numpy as np
+
+from .vector_agent import EnsemblePhysarum
+from .model import all_zero_stage, create_stage
+from .lib.chenu_cache import ChenuCache, create_cached_diffusion
+from .lib.datapoint import read_datapoints
+from .lib.diffusion import create_diffusion
+from .lib.memory import memory_report, precision_dtypes
+from .lib.params import ModelParams
+from .lib.profiler import StepProfiler
+
+
+class WuPhysarumEnsemble:
+    """
+    シード値だけが異なる複数のWuPhysarumを、1つの重ねた状態としてまとめて実行するモデル
+
+    ステージ・データポイント・フィルタは全レプリカで共通のものを1度だけ作り、
+    chenu_map, trail_map は (レプリカ数, width, height) の配列として保持する。
+    エージェントは EnsemblePhysarum で全レプリカ分を一括処理し、
+    格子セルの拡散も全レプリカについて1回の呼び出しで行う。
+
+    各レプリカの結果は WuPhysarum(engine="vector", diffusion=同じもの) を
+    同じシード値で実行した結果と一致する（replica(b) でレプリカごとに取り出せる）。
+
+    # 使用例
+    ensemble = WuPhysarumEnsemble(datapoint_filename="demo.json", seeds=[0, 1, 2])
+    for _ in range(100):
+        ensemble.step()
+    for b, seed in enumerate(ensemble.seeds):
+        print(seed, ensemble.replica(b).agent_count)
+    """
+    def __init__(self, datapoint_filename, seeds, diffusion="box", profiler=None, chenu_cache=None,
+                 precision="float64", params=None):
+        """
+        Args:
+            datapoint_filename: データポイントを表したファイル
+            seeds: 各レプリカの乱数のシード値のリスト
+            diffusion: 格子セルの拡散処理のバックエンド（"box" もしくは "fft"）
+            profiler: ステップ処理の計測（WuPhysarum と同じ、全レプリカの合計を記録する）
+            chenu_cache: chenu_mapの定常状態のキャッシュ（WuPhysarum と同じ）
+                         chenu_mapは全レプリカで共通なので、1面分の配列をレプリカ数分に見せたビューになる
+            precision: chenu_map, trail_map とステージのマスクの精度（WuPhysarum と同じ）
+            params: モデルのパラメータ（WuPhysarum と同じ、全レプリカで共通）
+        """
+        if len(seeds) == 0:
+            raise ValueError("seeds must not be empty")
+        self.seeds = list(seeds)
+        self.datapoint_filename = datapoint_filename
+        self.diffusion_backend = diffusion
+        self.precision = precision
+        self.params = ModelParams() if params is None else params
+        field_dtype = precision_dtypes(precision)["field"]
+        if profiler is True:
+            profiler = StepProfiler()
+        self.profiler = profiler or None
+        self.steps = 0
+
+        # read datapoint position and create stage (全レプリカで共通)
+        self.__datapoint_pos = read_datapoints(datapoint_filename)
+        stage = create_stage(self.__datapoint_pos, precision, self.params)
+        self.create_physarum_region = stage["create_physarum_region"]
+        self.stage_region = stage["stage_region"]
+        self.__chenu_adding_region = stage["chenu_adding_region"]
+        shape = (len(self.seeds), self.params.model["width"], self.params.model["height"])
+        self.chenu_map = np.stack([all_zero_stage(field_dtype, self.params)] * len(self.seeds))
+        self.trail_map = np.stack([all_zero_stage(field_dtype, self.params)] * len(self.seeds))
+
+        # create physarum agents
+        self.torus = False
+        self.agents = EnsemblePhysarum(self, self.seeds)
+        self.agents.seed_agents(self.create_physarum_region, self.params.model["density"])
+
+        # create lattice cell updater for stacked maps
+        self.diffusion = create_diffusion(
+            diffusion,
+            self.stage_region,
+            self.__chenu_adding_region,
+            stage["chenu_adding_intensity"],
+            self.torus,
+            shape=shape,
+            dtype=field_dtype,
+            lattice=self.params.lattice,
+        )
+        if chenu_cache is True:
+            chenu_cache = ChenuCache()
+        self.chenu_cache = chenu_cache or None
+        if self.chenu_cache is not None:
+            self.diffusion = create_cached_diffusion(
+                self.chenu_cache,
+                self.diffusion,
+                diffusion,
+                self.stage_region,
+                self.__chenu_adding_region,
+                stage["chenu_adding_intensity"],
+                self.torus,
+                shape=shape,
+                dtype=field_dtype,
+                lattice=self.params.lattice,
+            )
+
+        print("初期配置エージェント数: {}".format(self.agent_counts.tolist()))
+        self.running = True
+
+    def __len__(self):
+        return len(self.seeds)
+
+    @property
+    def datapoint_region(self):
+        return self.__chenu_adding_region
+
+    @property
+    def agent_count(self):
+        return len(self.agents)
+
+    @property
+    def agent_counts(self):
+        """
+        レプリカごとのエージェント数
+        """
+        return self.agents.counts
+
+    @property
+    def occupancy_map(self):
+        """
+        モジホコリエージェントが存在するセルをTrueとする (レプリカ数, width, height) の配列を返す
+        （WuPhysarum.occupancy_map と同じく読み取り専用のビュー）
+        """
+        view = self.agents.occupied.view()
+        view.flags.writeable = False
+        return view
+
+    def replica(self, b):
+        """
+        b番目のレプリカを、WuPhysarumと同じ属性で参照できるオブジェクトとして返す
+        """
+        return EnsembleReplica(self, b)
+
+    def memory_report(self):
+        """
+        全レプリカ分の配列ごとのメモリ使用量を返す（lib/memory.py を参照）
+        """
+        return memory_report(self)
+
+    def step(self):
+        profiler = self.profiler
+        if profiler is not None:
+            t_start = profiler.now()
+
+        # モジホコリエージェントのステップ処理
+        self.agents.step()
+        if profiler is not None:
+            t_agents = profiler.now()
+
+        # 格子セルのステップ処理
+        self.chenu_map, self.trail_map = self.diffusion.update(self.chenu_map, self.trail_map)
+        self.steps += 1
+
+        if profiler is not None:
+            t_end = profiler.now()
+            profiler.add_time("agents", t_agents - t_start)
+            profiler.add_time("lattice", t_end - t_agents)
+            profiler.end_step(self.steps, self.agent_count)
+
+
+class EnsembleReplica:
+    """
+    WuPhysarumEnsemble の1つのレプリカ
+
+    render.snapshot_arrays や ModelRecorder の記録処理が参照する属性
+    （chenu_map, trail_map, occupancy_map, datapoint_region, agent_count, agent_state）を、
+    レプリカの部分のみ取り出して返す。chenu_map, trail_map はアンサンブルの配列のビューである。
+    """
+    def __init__(self, ensemble, index):
+        self.ensemble = ensemble
+        self.index = index
+        self.seed = ensemble.seeds[index]
+
+    @property
+    def chenu_map(self):
+        return self.ensemble.chenu_map[self.index]
+
+    @property
+    def trail_map(self):
+        return self.ensemble.trail_map[self.index]
+
+    @property
+    def occupancy_map(self):
+        return self.ensemble.occupancy_map[self.index]
+
+    @property
+    def datapoint_region(self):
+        return self.ensemble.datapoint_region
+
+    @property
+    def agent_count(self):
+        return int(self.ensemble.agent_counts[self.index])
+
+    def agent_state(self):
+        return self.ensemble.agents.select(self.index)
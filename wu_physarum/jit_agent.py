@@ -0,0 +1,303 @@
+import numpy as np
+
+from .agent import NINF
+from .lib.jit import njit
+
+# random.Random (メルセンヌ・ツイスタ MT19937) の定数
+MT_N = 624
+MT_M = 397
+
+
+@njit
+def _mt_twist(mt):
+    for kk in range(MT_N):
+        y = (mt[kk] & 0x80000000) | (mt[(kk + 1) % MT_N] & 0x7fffffff)
+        value = mt[(kk + MT_M) % MT_N] ^ (y >> 1)
+        if y & 1:
+            value ^= 0x9908b0df
+        mt[kk] = value
+
+
+@njit
+def _mt_genrand(mt, mt_pos):
+    """
+    random.Random の内部状態 (mt, mt_pos[0]) から32ビットの乱数を1つ取り出す
+    """
+    if mt_pos[0] >= MT_N:
+        _mt_twist(mt)
+        mt_pos[0] = 0
+    y = mt[mt_pos[0]]
+    mt_pos[0] += 1
+    y ^= y >> 11
+    y ^= (y << 7) & 0x9d2c5680
+    y ^= (y << 15) & 0xefc60000
+    y ^= y >> 18
+    return y
+
+
+@njit
+def _randbelow(mt, mt_pos, n):
+    """
+    random.Random._randbelow(n) と同じ値を同じだけ乱数を消費して返す
+    （random.randint(0, 7) は _randbelow(8), random.shuffle は _randbelow(i + 1) を使う）
+    """
+    k = 0
+    while (n >> k) > 0:
+        k += 1
+    r = _mt_genrand(mt, mt_pos) >> (32 - k)
+    while r >= n:
+        r = _mt_genrand(mt, mt_pos) >> (32 - k)
+    return r
+
+
+@njit
+def _weighted_value(px, py, offset, trail_map, chenu_map, torus, wt, wn):
+    """
+    センサーの位置の重み付けした値と、センサーがグリッド内かどうかを返す
+    （グリッド外の場合は NINF, Physarum.__get_weighted_value と同じ）
+    """
+    width, height = trail_map.shape
+    sx, sy = px + offset[0], py + offset[1]
+    if torus:
+        sx, sy = sx % width, sy % height
+    if 0 <= sx < width and 0 <= sy < height:
+        return float(trail_map[sx, sy] * wt + chenu_map[sx, sy] * wn), True
+    return float(NINF), False
+
+
+@njit
+def agent_sweep(unique_id, x, y, dir_id, motion_counter, alive, n, occupied,
+                trail_map, chenu_map, stage_region, offset, torus, wt, wn, dep_t, rt, et,
+                mt, mt_pos, free_ids, n_free, next_id, released, counts):
+    """
+    全エージェントを random.shuffle と同じ順に1体ずつ処理する（RandomActivation.step と同じ処理）
+
+    各エージェントの処理は agent.py の Physarum.step と同じで、
+    増殖したエージェントは配列の末尾に追加し、このステップでは処理しない。
+    消滅したエージェントを詰めた後のエージェント数, 空きIDの数, 次のIDを返す。
+    配列は増殖に備えて 2n 以上の長さを確保しておくこと。
+    """
+    width, height = occupied.shape
+    order = np.arange(n)
+    for i in range(n - 1, 0, -1):
+        j = _randbelow(mt, mt_pos, i + 1)
+        order[i], order[j] = order[j], order[i]
+
+    n_total = n
+    n_released = 0
+    for t in range(n):
+        k = order[t]
+        if not alive[k]:
+            continue
+        px, py, d = x[k], y[k], dir_id[k]
+
+        """ Sensing Step """
+        Lweighted_value, Lvalid = _weighted_value(px, py, offset[d, 0], trail_map, chenu_map, torus, wt, wn)
+        Rweighted_value, Rvalid = _weighted_value(px, py, offset[d, 1], trail_map, chenu_map, torus, wt, wn)
+
+        """ Turning Step """
+        if not Lvalid and not Rvalid:
+            d = (d + 4) % 8                     # 真後ろを向く
+        elif Lweighted_value < Rweighted_value:
+            d = (d + 1) % 8                     # 右に曲がる
+        elif Lweighted_value > Rweighted_value:
+            d = (d - 1) % 8                     # 左に曲がる
+
+        """ Moving Step """
+        fx, fy = px + offset[d, 2, 0], py + offset[d, 2, 1]
+        if torus:
+            fx, fy = fx % width, fy % height
+        moved = 0 <= fx < width and 0 <= fy < height and not occupied[fx, fy] and stage_region[fx, fy] != 0
+        if moved:
+            trail_map[px, py] += dep_t
+            occupied[px, py] = False
+            occupied[fx, fy] = True
+            x[k], y[k] = fx, fy
+            motion_counter[k] += 1
+            counts[0] += 1
+        else:
+            motion_counter[k] -= 1
+            d = _randbelow(mt, mt_pos, 8)
+            counts[1] += 1
+        dir_id[k] = d
+
+        """ Reproduct/Elimination Step"""
+        if motion_counter[k] > rt and moved:
+            if n_free > 0:
+                n_free -= 1
+                unique_id[n_total] = free_ids[n_free]
+            else:
+                unique_id[n_total] = next_id
+                next_id += 1
+            x[n_total], y[n_total] = px, py
+            dir_id[n_total] = _randbelow(mt, mt_pos, 8)
+            motion_counter[n_total] = 0
+            alive[n_total] = True
+            occupied[px, py] = True
+            n_total += 1
+            counts[2] += 1
+        if motion_counter[k] < et:
+            occupied[x[k], y[k]] = False
+            alive[k] = False
+            released[n_released] = unique_id[k]
+            n_released += 1
+            counts[3] += 1
+
+    # 消滅したエージェントを詰める（スケジュールの並び順を保つ）
+    n_alive = 0
+    for i in range(n_total):
+        if alive[i]:
+            unique_id[n_alive], x[n_alive], y[n_alive] = unique_id[i], x[i], y[i]
+            dir_id[n_alive], motion_counter[n_alive] = dir_id[i], motion_counter[i]
+            alive[n_alive] = True
+            n_alive += 1
+    # このステップで消滅したエージェントのIDは次のステップから再利用する (PhysarumPool.end_step)
+    for i in range(n_released):
+        free_ids[n_free] = released[i]
+        n_free += 1
+    return n_alive, n_free, next_id
+
+
+class KernelPhysarum:
+    """
+    モジホコリエージェント群を平坦な配列で保持し、agent_sweep で1体ずつ逐次処理するエンジン
+
+    VectorizedPhysarum とは異なり、RandomActivation と同じくシャッフルした順に1体ずつ処理するため、
+    1セルに1エージェントの逐次的な衝突の扱いを含め engine="mesa" と完全に同じ結果になる。
+    乱数は model.random (random.Random) の内部状態をカーネルに渡して同じ順に消費し、
+    エージェントのIDも PhysarumPool と同じ規則で割り当てる。
+    agent_sweep は lib/jit.py の njit でコンパイルする。
+
+    エージェントごとの処理時間 (sense, turn, move, reproduce) は計測せず、回数のみprofilerに記録する。
+    """
+    def __init__(self, model):
+        self.model = model
+        self.width, self.height = model.params.model["width"], model.params.model["height"]
+        self.n = 0
+        self.next_id = 1
+        self.n_free = 0
+        self.__resize(0)
+        self.__free_ids = np.zeros(0, dtype=np.int64)
+        self.occupied = np.zeros((self.width, self.height), dtype=bool)
+
+    def __resize(self, capacity):
+        """
+        エージェントの配列を長さcapacityにする（先頭n体の値は保つ）
+        """
+        n = self.n
+        arrays = []
+        for name in ("unique_id", "x", "y", "dir_id", "motion_counter"):
+            array = np.zeros(capacity, dtype=np.int64)
+            if n:
+                array[:n] = getattr(self, "_KernelPhysarum__" + name)[:n]
+            arrays.append(array)
+        self.__unique_id, self.__x, self.__y, self.__dir_id, self.__motion_counter = arrays
+        self.__alive = np.zeros(capacity, dtype=bool)
+        self.__alive[:n] = True
+
+    def seed_agents(self, create_region, density):
+        """
+        create_regionのうち確率densityでエージェントを配置する
+        （engine="mesa" と同じ順に model.random を消費する）
+        """
+        random = self.model.random
+        agents = []
+        for x, _row in enumerate(create_region):
+            for y, create in enumerate(_row):
+                if create and random.random() < density:
+                    agents.append((self.next_id, x, y, random.randint(0, 7)))
+                    self.next_id += 1
+        self.__resize(2 * len(agents))
+        self.n = len(agents)
+        self.__alive[:self.n] = True
+        if agents:
+            self.__unique_id[:self.n], self.__x[:self.n], self.__y[:self.n], self.__dir_id[:self.n] = \
+                np.array(agents, dtype=np.int64).T
+        self.occupied[self.x, self.y] = True
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def unique_id(self):
+        return self.__unique_id[:self.n]
+
+    @property
+    def x(self):
+        return self.__x[:self.n]
+
+    @property
+    def y(self):
+        return self.__y[:self.n]
+
+    @property
+    def dir_id(self):
+        return self.__dir_id[:self.n]
+
+    @property
+    def motion_counter(self):
+        return self.__motion_counter[:self.n]
+
+    @property
+    def positions(self):
+        return np.stack([self.x, self.y], axis=1)
+
+    def get_state(self):
+        return {
+            "unique_id": self.unique_id.copy(),
+            "x": self.x.copy(),
+            "y": self.y.copy(),
+            "dir_id": self.dir_id.copy(),
+            "motion_counter": self.motion_counter.copy(),
+            "next_id": self.next_id,
+            "free_ids": self.__free_ids[:self.n_free].copy(),
+        }
+
+    def set_state(self, state):
+        self.n = 0
+        self.__resize(2 * len(state["x"]))
+        self.n = len(state["x"])
+        for name in ("unique_id", "x", "y", "dir_id", "motion_counter"):
+            getattr(self, "_KernelPhysarum__" + name)[:self.n] = state[name]
+        self.__alive[:self.n] = True
+        self.next_id = state["next_id"]
+        self.n_free = len(state["free_ids"])
+        self.__free_ids = np.array(state["free_ids"], dtype=np.int64)
+        self.occupied[...] = False
+        self.occupied[self.x, self.y] = True
+
+    def step(self):
+        if self.n == 0:
+            return
+        model = self.model
+        # 増殖・消滅に備えて配列を確保する（1ステップで高々n体増え、n個のIDが空く）
+        if len(self.__x) < 2 * self.n:
+            self.__resize(4 * self.n)
+        if len(self.__free_ids) < self.n_free + self.n:
+            free_ids = np.zeros(2 * (self.n_free + self.n), dtype=np.int64)
+            free_ids[:self.n_free] = self.__free_ids[:self.n_free]
+            self.__free_ids = free_ids
+
+        # random.Random の内部状態を配列にしてカーネルで消費し、消費後の状態に戻す
+        version, internal_state, gauss_next = model.random.getstate()
+        mt = np.array(internal_state[:MT_N], dtype=np.int64)
+        mt_pos = np.array(internal_state[MT_N:], dtype=np.int64)
+
+        # Physarum.step と同じ型で重み付けの計算を行う
+        trail_map = model.trail_map
+        physarum_param = model.params.physarum
+        weight_type = (trail_map.dtype.type(0) * physarum_param["WT"]).dtype.type
+        counts = np.zeros(4, dtype=np.int64)
+        self.n, self.n_free, self.next_id = agent_sweep(
+            self.__unique_id, self.__x, self.__y, self.__dir_id, self.__motion_counter, self.__alive, self.n,
+            self.occupied, trail_map, model.chenu_map, model.stage_region, model.params.offset_array, model.torus is True,
+            weight_type(physarum_param["WT"]), weight_type(physarum_param["WN"]), float(physarum_param["depT"]),
+            physarum_param["RT"], physarum_param["ET"],
+            mt, mt_pos, self.__free_ids, self.n_free, self.next_id, np.zeros(self.n, dtype=np.int64), counts,
+        )
+        model.random.setstate((version, tuple(mt.tolist()) + tuple(mt_pos.tolist()), gauss_next))
+
+        profiler = model.profiler
+        if profiler is not None:
+            for name, count in zip(("moves", "failed_moves", "births", "deaths"), counts.tolist()):
+                profiler.count(name, count)
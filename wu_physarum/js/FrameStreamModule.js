@@ -0,0 +1,42 @@
+// lib/stream.py の FrameStreamElement が送るPNGのフレームを、マップごとのcanvasに描画する
+var FrameStreamModule = function(fields, canvasSize) {
+    var status = $("<p class='lead'></p>")[0];
+    $("#elements").append(status);
+
+    var canvases = {};
+    fields.forEach(function(field) {
+        var container = $("<div style='display:inline-block; margin:4px; text-align:center'></div>");
+        var canvas = $("<canvas width='" + canvasSize + "' height='" + canvasSize + "' " +
+                       "style='border:1px dotted; background:black'></canvas>")[0];
+        container.append(canvas).append($("<div></div>").text(field));
+        $("#elements").append(container);
+        canvases[field] = canvas;
+    });
+
+    var draw = function(canvas, src) {
+        var image = new Image();
+        image.onload = function() {
+            var context = canvas.getContext("2d");
+            context.imageSmoothingEnabled = false;
+            context.clearRect(0, 0, canvas.width, canvas.height);
+            context.drawImage(image, 0, 0, canvas.width, canvas.height);
+        };
+        image.src = src;
+    };
+
+    this.render = function(data) {
+        $(status).text("step: " + data.step + "  agents: " + data.agents +
+                       (data.steps_per_frame ? "  steps/frame: " + data.steps_per_frame : ""));
+        for (var field in data.images) {
+            draw(canvases[field], data.images[field]);
+        }
+    };
+
+    this.reset = function() {
+        $(status).text("");
+        for (var field in canvases) {
+            var canvas = canvases[field];
+            canvas.getContext("2d").clearRect(0, 0, canvas.width, canvas.height);
+        }
+    };
+};
@@ -0,0 +1,145 @@
+"""
+複数の実験（データポイントファイル, seed, パラメータの組）をプロセスプールで並列に実行する
+
+# 使用例
+jobs = [
+    ExperimentJob(
+        datapoint_filename="knapsack6_R5_center8.json",
+        seed=seed,
+        figure_foldername="experiment/knapsack6/figure/seed_{}".format(seed),
+        meta_foldername="experiment/knapsack6/meta",
+        max_iteration=10000,
+        record_interval=100,
+    )
+    for seed in [2018, 1133, 5201]
+]
+results = run_experiments(jobs, workers=8)
+
+- 各ジョブの進捗は「[ジョブ名] step/max_iteration step (sec)」の形式で1行ずつ表示する
+- あるジョブで例外が発生しても、他のジョブは実行を続ける（結果のstatusが"failed"になる）
+- resume=True のとき、最後まで実行済みのジョブ（figure_foldernameに完了マークがあるもの）は実行しない
+- model_params={"prototype": prototype.share()} とすると、ステージ・拡散処理の前計算を共有メモリ上で
+  全ジョブに共有する（wu_physarum/model.py の WuPhysarumPrototype を参照）
+"""
+
+import os
+import time
+import threading
+import traceback
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .record import COMPLETED_MARKER
+
+
+ExperimentJob = namedtuple(
+    "ExperimentJob",
+    [
+        "datapoint_filename",
+        "seed",
+        "figure_foldername",
+        "meta_foldername",
+        "max_iteration",
+        "record_interval",
+        "model_params",     # モデルに与える追加の引数 (dict)
+        "name",             # 進捗表示に使う名前（省略時はfigure_foldername）
+    ],
+    defaults=[10000, 100, None, None],
+)
+
+
+def job_name(job):
+    return job.name or job.figure_foldername
+
+
+def is_job_completed(job):
+    return os.path.exists(os.path.join(job.figure_foldername, COMPLETED_MARKER))
+
+
+def _run_job(job, queue, progress_interval):
+    """
+    ワーカープロセスで1つのジョブを実行する
+    例外はワーカーの外に伝播させず、結果として返す
+    """
+    from wu_physarum.model import WuPhysarum
+    from wu_physarum.lib.record import ModelRecorder
+
+    name = job_name(job)
+
+    def progress(step, max_iteration, elapsed):
+        if step % progress_interval == 0 or step == max_iteration:
+            queue.put((name, step, max_iteration, elapsed))
+
+    start = time.time()
+    try:
+        recorder = ModelRecorder(
+            model=WuPhysarum,
+            datapoint_filename=job.datapoint_filename,
+            seed=job.seed,
+            figure_foldername=job.figure_foldername,
+            meta_foldername=job.meta_foldername,
+            max_iteration=job.max_iteration,
+            record_interval=job.record_interval,
+            model_params=job.model_params,
+            progress=progress,
+        )
+        recorder.start()
+        return {"status": "done", "error": None, "elapsed": time.time() - start}
+    except Exception:
+        return {"status": "failed", "error": traceback.format_exc(), "elapsed": time.time() - start}
+
+
+def _print_progress(queue):
+    while True:
+        message = queue.get()
+        if message is None:
+            break
+        print("[{}] {}/{} step ({:.2f} sec)".format(*message), flush=True)
+
+
+def run_experiments(jobs, workers=None, resume=True, progress_interval=100):
+    """
+    jobsをworkers個のプロセスで並列に実行する
+
+    Args:
+        jobs: ExperimentJobのリスト
+        workers: プロセス数（省略時はCPUコア数）
+        resume: Trueのとき、実行済みのジョブをスキップする
+        progress_interval: 進捗を表示する間隔（ステップ）
+    Returns:
+        jobsと同じ順に並んだ {"job", "status", "error", "elapsed"} のリスト
+        status は "done", "skipped", "failed" のいずれか
+    """
+    results = [None] * len(jobs)
+    pending = []
+    for i, job in enumerate(jobs):
+        if resume and is_job_completed(job):
+            results[i] = {"job": job, "status": "skipped", "error": None, "elapsed": 0.0}
+        else:
+            pending.append(i)
+
+    with multiprocessing.Manager() as manager:
+        queue = manager.Queue()
+        printer = threading.Thread(target=_print_progress, args=(queue,), daemon=True)
+        printer.start()
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_run_job, jobs[i], queue, progress_interval): i for i in pending}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    # ワーカープロセス自体が異常終了した場合
+                    result = {"status": "failed", "error": traceback.format_exc(), "elapsed": None}
+                result["job"] = jobs[i]
+                results[i] = result
+                print("[{}] {}".format(job_name(jobs[i]), result["status"]), flush=True)
+                if result["error"] is not None:
+                    print(result["error"], flush=True)
+
+        queue.put(None)
+        printer.join()
+
+    return results
@@ -0,0 +1,207 @@
+"""
+WuPhysarumのベンチマーク
+
+グリッドサイズ・エージェント密度・データポイントファイル・エンジン・拡散処理・精度の組み合わせごとに、
+新しいプロセスでモデルを画面表示なしで実行し、以下を計測する。
+
+- startup_sec:   モデルの生成にかかった時間
+- step_sec:      steps回のステップにかかった時間（steps_per_sec はその逆数×steps、profilerなしで計測する）
+- phases:        1ステップあたりの処理ごとの平均時間（lib/profiler.py を参照）
+                 phases=True の場合のみ、計測とは別のモデルを profiler=True で同じステップ数だけ実行して求める
+                 （profilerの負荷がエンジンごとに異なるため、step_sec には含めない）
+- peak_rss_mb:   プロセスの最大常駐メモリ
+- state_mb:      モデルが保持する配列の合計サイズ（lib/memory.py を参照）
+
+結果はコミットをまたいで比較できるようJSONで保存する（compare_results を参照）。
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import itertools
+import subprocess
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+
+
+BenchmarkCase = namedtuple(
+    "BenchmarkCase",
+    ["size", "density", "datapoint_filename", "engine", "diffusion", "steps", "seed", "precision"],
+    defaults=("float64",),
+)
+
+
+def build_cases(sizes, densities, datapoint_filenames, engines=("vector",), diffusions=("box",),
+                steps=20, seed=0, precisions=("float64",)):
+    return [
+        BenchmarkCase(size, density, datapoint_filename, engine, diffusion, steps, seed, precision)
+        for size, density, datapoint_filename, engine, diffusion, precision
+        in itertools.product(sizes, densities, datapoint_filenames, engines, diffusions, precisions)
+    ]
+
+
+def case_name(case):
+    name = "{}x{} density={} {} engine={} diffusion={}".format(
+        case.size, case.size, case.density, case.datapoint_filename, case.engine, case.diffusion)
+    if case.precision != "float64":
+        name += " precision={}".format(case.precision)
+    return name
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxではキロバイト, macOSではバイト単位
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+def _run_case(case, phases, queue):
+    """
+    新しいプロセスの中で1つのケースを実行する
+    """
+    try:
+        from wu_physarum.lib.setting import MODEL_PARAM
+        MODEL_PARAM.update(width=case.size, height=case.size, density=case.density)
+
+        from wu_physarum.model import WuPhysarum
+        from wu_physarum.lib.profiler import PHASES
+
+        def create_model(profiler=None):
+            return WuPhysarum(
+                datapoint_filename=case.datapoint_filename,
+                seed=case.seed,
+                engine=case.engine,
+                diffusion=case.diffusion,
+                profiler=profiler,
+                precision=case.precision,
+            )
+
+        t_start = time.perf_counter()
+        model = create_model()
+        startup_sec = time.perf_counter() - t_start
+        initial_agents = model.agent_count
+
+        t_start = time.perf_counter()
+        for _ in range(case.steps):
+            model.step()
+        step_sec = time.perf_counter() - t_start
+
+        state_bytes = sum(record["bytes"] for record in model.memory_report() if not record["mapped"])
+        final_agents = model.agent_count
+        phase_sec = None
+        if phases:
+            # 処理ごとの内訳は、profilerを付けた別のモデルで求める
+            del model
+            profiled = create_model(profiler=True)
+            for _ in range(case.steps):
+                profiled.step()
+            summary = profiled.profiler.summary()
+            phase_sec = {phase: summary[phase] / case.steps for phase in PHASES}
+        queue.put({
+            "status": "done",
+            "startup_sec": startup_sec,
+            "step_sec": step_sec,
+            "steps_per_sec": case.steps / step_sec if step_sec > 0 else None,
+            "phases": phase_sec,
+            "initial_agents": initial_agents,
+            "final_agents": final_agents,
+            "peak_rss_mb": _peak_rss_mb(),
+            "state_mb": state_bytes / 1024 ** 2,
+        })
+    except Exception as e:
+        queue.put({"status": "failed", "error": repr(e)})
+
+
+def run_case(case, timeout=None, phases=False):
+    """
+    caseを新しいプロセスで実行し、結果のdictを返す
+    （プロセスを分けることで、最大常駐メモリや起動時間がケースごとに独立する）
+    phases=True の場合は処理ごとの内訳 (phases) も求める（その分だけ実行時間が延びる）
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(case, phases, queue))
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = {"status": "failed", "error": "timeout"}
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
+    result.update(case._asdict())
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmark(cases, output=None, timeout=None, phases=False):
+    """
+    casesを順に実行し、{"environment", "results"} を返す（outputを指定した場合はJSONで保存する）
+    """
+    results = []
+    for case in cases:
+        result = run_case(case, timeout=timeout, phases=phases)
+        results.append(result)
+        if result["status"] == "done":
+            print("{}: startup {:.3f} sec, {:.2f} steps/sec, peak RSS {} MB, state {:.1f} MB".format(
+                case_name(case), result["startup_sec"], result["steps_per_sec"],
+                None if result["peak_rss_mb"] is None else round(result["peak_rss_mb"], 1),
+                result["state_mb"]), flush=True)
+        else:
+            print("{}: {}".format(case_name(case), result["error"]), flush=True)
+
+    report = {"environment": environment(), "results": results}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=4)
+    return report
+
+
+def compare_results(old_report, new_report, keys=("startup_sec", "steps_per_sec", "peak_rss_mb")):
+    """
+    2つのベンチマーク結果のうち同じケースについて、keysの値の変化率を返す
+
+    出力：[{"case": ケース名, key: (旧, 新, 新/旧), ...}, ...]
+    """
+    def index(report):
+        # precision を記録していない結果は float64 とみなす
+        return {
+            BenchmarkCase(**{field: r[field] for field in BenchmarkCase._fields if field in r}): r
+            for r in report["results"] if r["status"] == "done"
+        }
+
+    old, new = index(old_report), index(new_report)
+    rows = []
+    for case in new:
+        if case not in old:
+            continue
+        row = {"case": case_name(case)}
+        for key in keys:
+            a, b = old[case][key], new[case][key]
+            row[key] = (a, b, b / a if a and b is not None else None)
+        rows.append(row)
+    return rows
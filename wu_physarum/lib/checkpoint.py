@@ -0,0 +1,60 @@
+"""
+WuPhysarumのチェックポイントファイルの読み書き
+
+チェックポイントはモデルの状態をまとめたdictをpickleしたものとする。
+書き込みは一時ファイルを経由して置き換えるため、書き込み中に異常終了しても
+既存のチェックポイントが壊れることはない。
+"""
+
+import os
+import glob
+import pickle
+import tempfile
+
+
+CHECKPOINT_VERSION = 2
+
+
+def write_checkpoint(filename, state):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(dict(state, version=CHECKPOINT_VERSION), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def read_checkpoint(filename):
+    with open(filename, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("unsupported checkpoint version: {}".format(state.get("version")))
+    return state
+
+
+def checkpoint_filename(dirname, step):
+    return os.path.join(dirname, "checkpoint_{:08d}.pkl".format(step))
+
+
+def list_checkpoints(dirname):
+    """
+    dirname内のチェックポイントをステップ順に返す
+    """
+    return sorted(glob.glob(os.path.join(dirname, "checkpoint_*.pkl")))
+
+
+def latest_checkpoint(dirname):
+    checkpoints = list_checkpoints(dirname)
+    return checkpoints[-1] if checkpoints else None
+
+
+def prune_checkpoints(dirname, keep):
+    """
+    新しいものからkeep個を残して古いチェックポイントを削除する
+    """
+    for filename in list_checkpoints(dirname)[:-keep]:
+        os.remove(filename)
@@ -0,0 +1,282 @@
+"""
+chenu_mapの定常状態のキャッシュ
+
+chenu_mapはエージェントによらず、ステージ・データポイント・LATTICECELL_PARAM・拡散処理のみで決まり、
+数百ステップで定常状態に達する。ただし浮動小数点の丸めにより、厳密には不動点ではなく
+最下位ビットのみが変化する短い周期解になることがある（"box" の demo.json では周期2など）。
+そこで、周期解とそれに達するステップ数を (ステージ, データポイント, パラメータ) の組ごとに1度だけ求めて
+ディスクに保存しておき、以降のモデルでは定常状態に達した後のchenu_mapの拡散を省略する。
+
+# キャッシュの内容
+- cycle:       定常状態の周期解（周期MAX_PERIOD以下, 周期1なら不動点）
+- steady_step: 初期状態から cycle に達するまでの更新回数
+- transient:   cycle に達するまでの chenu_map の時系列（1回目〜steady_step-1回目の更新結果）
+               CHENU_CACHE_PARAM["max_transient_bytes"] 以下の場合のみ保存し、メモリマップで読み込む
+               保存しなかった場合、steady_step までは従来通りchenu_mapを拡散する
+いずれも chenu_map の型 (dtype, float64 / float32) ごとに別のキャッシュとして保存する。
+
+tolerance=0.0 の場合、キャッシュを使ったモデルの chenu_map, trail_map は使わないモデルと完全に一致する。
+（max_steps 回の更新で周期解に達しなかった場合のみ、max_steps 回目の更新結果を定常状態とみなす。
+  "fft" は丸め誤差が周期的にならないため、これに当たることがある）
+
+キャッシュの合計サイズが CHENU_CACHE_PARAM["max_bytes"] を超えた場合、最後に使われた時刻が古いものから削除する。
+
+# 使用例
+model = WuPhysarum(datapoint_filename="demo.json", seed=1, diffusion="box", chenu_cache=True)
+"""
+
+import os
+import copy
+import json
+import glob
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .diffusion import create_diffusion
+from .setting import CHENU_CACHE_PARAM, LATTICECELL_PARAM
+
+
+CHENU_CACHE_VERSION = 3
+
+# 定常状態として検出する周期解の最大の周期
+MAX_PERIOD = 8
+
+
+def default_cache_dirname():
+    return os.path.join(os.path.expanduser("~"), ".cache", "wu_physarum", "chenu")
+
+
+def solve_chenu_steady_state(diffusion, shape, max_steps, tolerance, max_transient_bytes, dtype=np.float64):
+    """
+    0から始めてchenu_mapを更新し続け、定常状態（周期MAX_PERIOD以下の周期解）に達するまでの時系列を求める
+
+    出力：(cycle, steady_step, transient)
+          cycle:       steady_step回目以降の更新結果を周期順に並べた配列 (shape: (周期, width, height))
+          transient:   1回目〜steady_step-1回目の更新結果のリスト（max_transient_bytes を超える場合 None）
+    """
+    chenu_map = np.zeros(shape, dtype=dtype)
+    frames = [chenu_map]                    # 0回目〜step-1回目の更新結果（直近MAX_PERIOD個以外はtransient用）
+    frame_bytes = chenu_map.nbytes
+    keep_transient = True
+    for step in range(1, max_steps + 1):
+        chenu_map = diffusion.update_chenu(chenu_map)
+        for period in range(1, min(MAX_PERIOD, len(frames)) + 1):
+            if np.max(np.abs(chenu_map - frames[-period])) <= tolerance:
+                # step-period回目以降の更新結果は周期periodで繰り返す
+                steady_step = step - period
+                cycle = np.array(frames[-period:])
+                transient = frames[1:-period] if keep_transient else None
+                return cycle, steady_step, transient
+        frames.append(chenu_map.copy())
+        if keep_transient and (len(frames) - 1 - MAX_PERIOD) * frame_bytes > max_transient_bytes:
+            keep_transient = False
+        if not keep_transient:
+            # transientを保存しない場合は周期の判定に使う分のみ残す
+            del frames[1:-MAX_PERIOD]
+    # 周期解に達しなかった場合は max_steps 回目の更新結果を定常状態とみなす
+    return np.array(frames[-1:]), max_steps, frames[1:-1] if keep_transient else None
+
+
+def _atomic_write(filename, write):
+    """
+    一時ファイルのパスをwriteに渡して書き込ませ、filenameに置き換える
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp_", suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class ChenuCache:
+    def __init__(self, **params):
+        """
+        Args:
+            params: CHENU_CACHE_PARAM の値を上書きする
+        """
+        unknown = set(params) - set(CHENU_CACHE_PARAM)
+        if unknown:
+            raise ValueError("unknown chenu cache parameter: {}".format(sorted(unknown)))
+        self.params = dict(CHENU_CACHE_PARAM, **params)
+        self.dirname = self.params["dirname"] or default_cache_dirname()
+        self.last_hit = None                # 直前のgetでキャッシュを使ったかどうか
+
+    def key(self, backend, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=np.float64,
+            lattice=None):
+        """
+        chenu_mapの時系列を決める値すべてから作ったハッシュ値
+        （latticeは LATTICECELL_PARAM の代わりに使う辞書）
+        """
+        lattice = LATTICECELL_PARAM if lattice is None else lattice
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "version": CHENU_CACHE_VERSION,
+            "backend": backend,
+            "dtype": np.dtype(dtype).name,
+            "torus": bool(torus),
+            "shape": list(np.shape(stage_region)),
+            "dampN": lattice["dampN"],
+            "filterN_width": lattice["filterN_width"],
+            "filterN_height": lattice["filterN_height"],
+            "max_steps": self.params["max_steps"],
+            "tolerance": self.params["tolerance"],
+        }, sort_keys=True).encode())
+        for array in (stage_region, chenu_adding_region, chenu_adding_intensity):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def __filenames(self, key):
+        return (os.path.join(self.dirname, key + ".npz"),
+                os.path.join(self.dirname, key + ".transient.npy"))
+
+    def load(self, key):
+        """
+        キャッシュを読み込む（なければNone）
+        """
+        steady_filename, transient_filename = self.__filenames(key)
+        try:
+            with np.load(steady_filename) as f:
+                entry = {"cycle": f["cycle"], "steady_step": int(f["steady_step"]), "transient": None}
+                has_transient = bool(f["has_transient"])
+            if has_transient:
+                entry["transient"] = np.load(transient_filename, mmap_mode="r")
+        except (OSError, KeyError, ValueError):
+            return None
+        # 最後に使われた時刻を更新する（削除の順番に使う）
+        os.utime(steady_filename)
+        return entry
+
+    def store(self, key, cycle, steady_step, transient):
+        os.makedirs(self.dirname, exist_ok=True)
+        steady_filename, transient_filename = self.__filenames(key)
+        if transient is not None:
+            def write_transient(tmp):
+                array = np.lib.format.open_memmap(
+                    tmp, mode="w+", dtype=cycle.dtype, shape=(len(transient), *np.shape(cycle)[1:]))
+                for i, frame in enumerate(transient):
+                    array[i] = frame
+                array.flush()
+                del array
+            _atomic_write(transient_filename, write_transient)
+        _atomic_write(steady_filename, lambda tmp: np.savez(
+            tmp, cycle=cycle, steady_step=steady_step, has_transient=transient is not None))
+        self.evict()
+
+    def evict(self):
+        """
+        合計サイズが max_bytes 以下になるまで、最後に使われた時刻が古いキャッシュを削除する
+        """
+        entries = []
+        for steady_filename in glob.glob(os.path.join(self.dirname, "*.npz")):
+            key = os.path.basename(steady_filename)[:-len(".npz")]
+            filenames = [name for name in self.__filenames(key) if os.path.exists(name)]
+            try:
+                entries.append((os.path.getmtime(steady_filename),
+                                sum(os.path.getsize(name) for name in filenames), filenames))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, filenames in sorted(entries):
+            if total <= self.params["max_bytes"]:
+                break
+            for name in filenames:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            total -= size
+
+    def get(self, backend, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=np.float64,
+            lattice=None):
+        """
+        キャッシュを読み込み、なければ定常状態を求めて保存する
+        """
+        key = self.key(backend, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype, lattice)
+        entry = self.load(key)
+        self.last_hit = entry is not None
+        if entry is not None:
+            return entry
+
+        diffusion = create_diffusion(
+            backend, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=dtype, lattice=lattice)
+        cycle, steady_step, transient = solve_chenu_steady_state(
+            diffusion,
+            np.shape(stage_region),
+            self.params["max_steps"],
+            self.params["tolerance"],
+            self.params["max_transient_bytes"],
+            dtype=dtype,
+        )
+        self.store(key, cycle, steady_step, transient)
+        return self.load(key) or {"cycle": cycle, "steady_step": steady_step, "transient": None}
+
+
+class CachedChenuDiffusion:
+    """
+    キャッシュした定常状態を使って格子セルを更新する拡散処理
+
+    diffusion (lib/diffusion.py のいずれか) と同じく update(chenu_map, trail_map) を持ち、
+    trail_mapは毎回 diffusion で拡散する。chenu_mapは
+    - steady_step 回目以降の更新: キャッシュした周期解
+    - それより前の更新:          キャッシュした時系列（なければ diffusion で拡散する）
+    を返す。shapeに (B, width, height) を指定した場合、chenu_mapは2次元の配列をB面に見せたビューを返す。
+    返すchenu_mapは読み取り専用である。
+    """
+    def __init__(self, diffusion, entry, shape=None):
+        self.diffusion = diffusion
+        self.cycle = np.array(entry["cycle"])
+        self.cycle.setflags(write=False)
+        self.steady_step = entry["steady_step"]
+        self.transient = entry["transient"]
+        self.shape = tuple(shape) if shape is not None else np.shape(self.cycle)[1:]
+        self.updates = 0                    # これまでの更新回数
+        self.fixed_adjacent_stage_region_cell_num_on_chenu_map = \
+            diffusion.fixed_adjacent_stage_region_cell_num_on_chenu_map
+        self.fixed_adjacent_stage_region_cell_num_on_trail_map = \
+            diffusion.fixed_adjacent_stage_region_cell_num_on_trail_map
+
+    def fork(self):
+        """
+        キャッシュした定常状態と diffusion の定数部分を共有し、更新回数を0にした拡散処理を返す
+        """
+        cached = copy.copy(self)
+        cached.diffusion = self.diffusion.fork()
+        cached.updates = 0
+        return cached
+
+    def release(self):
+        self.diffusion.release()
+
+    def seek(self, updates):
+        """
+        更新回数を設定する（チェックポイントから復元した場合など）
+        """
+        self.updates = updates
+
+    def __view(self, chenu_map):
+        return np.broadcast_to(chenu_map, self.shape)
+
+    def update(self, chenu_map, trail_map):
+        self.updates += 1
+        if self.updates >= self.steady_step:
+            chenu_map = self.__view(self.cycle[(self.updates - self.steady_step) % len(self.cycle)])
+        elif self.transient is not None:
+            chenu_map = self.__view(self.transient[self.updates - 1])
+        else:
+            chenu_map = self.diffusion.update_chenu(chenu_map)
+        return [chenu_map, self.diffusion.update_trail(trail_map)]
+
+
+def create_cached_diffusion(cache, diffusion, backend, stage_region, chenu_adding_region,
+                            chenu_adding_intensity, torus, shape=None, dtype=np.float64, lattice=None):
+    """
+    diffusionをキャッシュした定常状態を使うものに置き換える
+    """
+    entry = cache.get(backend, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype, lattice)
+    return CachedChenuDiffusion(diffusion, entry, shape=shape)
@@ -0,0 +1,114 @@
+"""
+WuPhysarumの収束判定
+
+ConvergenceMonitorをモデルに渡すと、ステップごとに呼び出され、
+check_interval ステップごとに以下の統計量を記録する。
+
+- trail:     trail_mapのノルムの前回からの相対変化量
+- agents:    エージェント数の前回からの相対変化量
+- occupancy: エージェントが存在するセルのうち、前回から変化したセルの割合
+
+criteriaに指定した統計量が、直近window回の記録ですべて許容値以下になったとき
+収束したとみなし、model.running を False にする。
+
+# 使用例
+model = WuPhysarum(datapoint_filename="demo.json", seed=1, convergence=True)
+while model.running:
+    model.step()
+print(model.convergence_monitor.stop_step, model.convergence_monitor.stop_reason)
+"""
+
+from collections import deque
+
+import numpy as np
+
+from .setting import CONVERGENCE_PARAM
+
+
+STATISTICS = ("trail", "agents", "occupancy")
+
+
+class ConvergenceMonitor:
+    def __init__(self, **params):
+        """
+        Args:
+            params: CONVERGENCE_PARAM の値を上書きする
+        """
+        unknown = set(params) - set(CONVERGENCE_PARAM)
+        if unknown:
+            raise ValueError("unknown convergence parameter: {}".format(sorted(unknown)))
+        self.params = dict(CONVERGENCE_PARAM, **params)
+        for name in self.params["criteria"]:
+            if name not in STATISTICS:
+                raise ValueError("criteria must be chosen from {}: {}".format(STATISTICS, name))
+
+        self.history = []                   # 記録した統計量 (dict) のリスト
+        self.stop_step = None               # 収束したと判定したステップ
+        self.stop_reason = None             # 収束したと判定した理由
+        self.__changes = {name: deque(maxlen=self.params["window"]) for name in STATISTICS}
+        self.__previous = None
+
+    @property
+    def is_converged(self):
+        return self.stop_step is not None
+
+    def __relative_change(self, value, previous):
+        return abs(value - previous) / max(abs(previous), 1e-12)
+
+    def update(self, model):
+        """
+        モデルのステップごとに呼び出す
+        """
+        step = model.schedule.steps
+        if self.is_converged or step % self.params["check_interval"] != 0:
+            return
+
+        trail_norm = float(np.linalg.norm(model.trail_map))
+        agent_count = model.agent_count
+        occupancy = model.occupancy_map.copy()    # 次回の比較に使うため、ビューではなくコピーを保持する
+        record = {"step": step, "trail_norm": trail_norm, "agent_count": agent_count, "occupancy_diff": None}
+
+        if self.__previous is not None:
+            previous_trail_norm, previous_agent_count, previous_occupancy = self.__previous
+            changes = {
+                "trail": self.__relative_change(trail_norm, previous_trail_norm),
+                "agents": self.__relative_change(agent_count, previous_agent_count),
+                "occupancy": float(np.count_nonzero(occupancy != previous_occupancy)
+                                   / max(np.count_nonzero(occupancy | previous_occupancy), 1)),
+            }
+            record["occupancy_diff"] = changes["occupancy"]
+            for name, change in changes.items():
+                self.__changes[name].append(change)
+        self.__previous = (trail_norm, agent_count, occupancy)
+        self.history.append(record)
+
+        if step >= self.params["min_steps"] and self.__is_satisfied():
+            self.stop_step = step
+            self.stop_reason = ", ".join(
+                "{} change <= {} for {} checks".format(name, self.params["tolerance"][name], self.params["window"])
+                for name in self.params["criteria"]
+            )
+            model.running = False
+
+    def __is_satisfied(self):
+        for name in self.params["criteria"]:
+            changes = self.__changes[name]
+            if len(changes) < self.params["window"] or max(changes) > self.params["tolerance"][name]:
+                return False
+        return True
+
+    def get_state(self):
+        return {
+            "history": list(self.history),
+            "stop_step": self.stop_step,
+            "stop_reason": self.stop_reason,
+            "changes": {name: list(changes) for name, changes in self.__changes.items()},
+            "previous": self.__previous,
+        }
+
+    def set_state(self, state):
+        self.history = list(state["history"])
+        self.stop_step, self.stop_reason = state["stop_step"], state["stop_reason"]
+        for name, changes in state["changes"].items():
+            self.__changes[name] = deque(changes, maxlen=self.params["window"])
+        self.__previous = state["previous"]
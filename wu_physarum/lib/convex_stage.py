@@ -1,6 +1,6 @@
 import numpy as np
 
-from .setting import MODEL_PARAM
+from .rasterize import coords2ndarray  # noqa: F401
 
 
 def __convex_hull_vertex(points):
@@ -49,67 +49,52 @@ def __convex_hull_vertex(points):
     return tuple(lower[:-1] + upper[:-1])
 
 
-def __point_on_edge(p1, p2):
+def __point_on_edge(vertex):
     """
-    2点間をつなぐ線分上にある格子点を返す。
-    Input: 2点の座標のタプル
-            ((x_1, y_1), (x_2, y_2))
-    Output: 格子点の座標のリスト
-            [(x_1, y_1), (x_2, y_2), ...]
+    凸包の各辺（隣り合う頂点をつなぐ線分）上にある格子点をまとめて返す。
+    Input: 頂点座標のタプル
+            ((x_1, y_1), (x_2, y_2), ...)
+    Output: 格子点のx座標, y座標の配列の組
+            (np.array([x_1, x_2, ...]), np.array([y_1, y_2, ...]))
     """
-    (x_1, y_1), (x_2, y_2) = p1, p2
-
-    if x_1 > x_2:
-        (x_1, y_1), (x_2, y_2) = (x_2, y_2), (x_1, y_1)
-
-    points = []
-
-    # 傾きがy軸と平行になる場合
-    if x_1 == x_2:
-        for _y in range(y_1, y_2 + 1):
-            points.append((x_1, _y))
-        return points
-
-    # 傾きが求められるとき
-    tilt = (y_2 - y_1) / (x_2 - x_1)
-    for _x in range(x_1, x_2 + 1):
-        _y = y_1 + tilt * (_x - x_1)
-        points.append((_x, int(round(_y, 0))))
-    return points
-
-
-def __convex_hull_edge(points):
+    vertex = np.asarray(vertex, dtype=np.int64).reshape(-1, 2)
+    p1, p2 = vertex, np.roll(vertex, 1, axis=0)
+    # 各辺をx座標の小さい方から大きい方へ向ける
+    swap = p1[:, 0] > p2[:, 0]
+    p1, p2 = np.where(swap[:, None], p2, p1), np.where(swap[:, None], p1, p2)
+    (x_1, y_1), (x_2, y_2) = p1.T, p2.T
+
+    # 各辺のx方向の格子点をまとめて作る
+    length = x_2 - x_1 + 1
+    edge = np.repeat(np.arange(len(vertex)), length)
+    _x = x_1[edge] + np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length)
+
+    # 傾きがy軸と平行になる場合は端点のみ（内部の格子点は列ごとのy座標の範囲に含まれる）
+    is_vertical = x_1 == x_2
+    tilt = np.where(is_vertical, 0, y_2 - y_1) / np.where(is_vertical, 1, x_2 - x_1)
+    _y = y_1[edge] + tilt[edge] * (_x - x_1[edge])
+    _y = np.round(_y).astype(np.int64)
+
+    vertical = np.nonzero(is_vertical)[0]
+    _x = np.concatenate([_x, x_2[vertical]])
+    _y = np.concatenate([_y, y_2[vertical]])
+    return _x, _y
+
+
+def __column_range(vertex):
     """
-    凸包の辺上にある格子点を返す。
-    Input: 凸包の頂点座標群（反時計回りにならべてあること）
-    Output: 凸包の辺上にある格子点群
+    凸包の内部（辺上も含む）にある格子点を、x座標ごとのy座標の範囲として返す。
+    Input: 凸包の頂点座標群
+    Output: (min_x, 各列のyの最小値の配列, 各列のyの最大値の配列)
     """
-    edge_point = []
-    for i in range(len(points)):
-        edge_point.extend(__point_on_edge(points[i], points[i - 1]))
-    return tuple(sorted(set(edge_point)))
-
-
-def __convex_hull_inner(points):
-    """
-    凸包の内部（辺上も含む）にある格子点を返す。
-    Input: 凸包の辺上にある格子点群
-    Output: 凸包の内部にある格子点群
-    """
-    inner_point = []
-    points = sorted(points)
-
-    min_x, max_x = points[0][0], points[-1][0]
-    for _x in range(min_x, max_x + 1):
-        point_on_same_x = filter((lambda coord: coord[0] == _x), points)
-        y_coord_on_same_x = list(
-            map((lambda coord: coord[1]), point_on_same_x))
-
-        min_y, max_y = min(y_coord_on_same_x), max(y_coord_on_same_x)
-        for _y in range(min_y, max_y + 1):
-            inner_point.append((_x, _y))
-
-    return tuple(inner_point)
+    _x, _y = __point_on_edge(vertex)
+    min_x = _x.min()
+    columns = _x.max() - min_x + 1
+    min_y = np.full(columns, np.iinfo(np.int64).max)
+    max_y = np.full(columns, np.iinfo(np.int64).min)
+    np.minimum.at(min_y, _x - min_x, _y)
+    np.maximum.at(max_y, _x - min_x, _y)
+    return min_x, min_y, max_y
 
 
 def convex_hull_inner(points):
@@ -118,17 +103,25 @@ def convex_hull_inner(points):
     Output: 凸包の内部（辺上も含む）にある格子点群
     Implements Andrew's monotone chain algorithm. O(n log n) complexity.
     """
-    return __convex_hull_inner(__convex_hull_edge(__convex_hull_vertex(points)))
+    min_x, min_y, max_y = __column_range(__convex_hull_vertex(points))
+    inner_point = []
+    for _x, (_min_y, _max_y) in enumerate(zip(min_y, max_y), start=min_x):
+        for _y in range(_min_y, _max_y + 1):
+            inner_point.append((int(_x), int(_y)))
+    return tuple(inner_point)
 
 
-def coords2ndarray(coords):
+def convex_hull_mask(points, width, height):
     """
-    プロットされる点の座標のみが入っている二次元配列を、
-    プロットされる点の座標の要素が1となっている二次元配列に変換する
-
-    入力：((0, 0), (1, 1)) ※1に指定されている座標が(0, 0)と(1, 1)だと解釈
-    出力：np.array([[1, 0],
-                    [0, 1]])
+    2次元座標群で構成できる凸包の内部（辺上も含む）を1とする (width, height) の配列を返す。
+    グリッドの外にはみ出した部分は切り捨てる。
     """
-    array = [[(i, j) in coords for j in range(MODEL_PARAM["height"])] for i in range(MODEL_PARAM["width"])]
-    return np.array(array)
+    mask = np.zeros((width, height), dtype=bool)
+    min_x, min_y, max_y = __column_range(__convex_hull_vertex(points))
+    _x = np.arange(min_x, min_x + len(min_y))
+    is_inside = (0 <= _x) & (_x < width)
+    if not is_inside.any():
+        return mask
+    _y = np.arange(height)
+    mask[_x[is_inside]] = (min_y[is_inside, None] <= _y) & (_y <= max_y[is_inside, None])
+    return mask
@@ -0,0 +1,240 @@
+"""
+データポイントファイルの読み書き
+
+データポイントは (点の数, 2) もしくは (点の数, 3) の float64 の配列 (x, y[, intensity]) として扱う。
+ファイルの形式は拡張子で判定する。
+- .json: {"x", "y"[, "intensity"]} の辞書のリスト（従来の形式）, もしくは {"x": [...], "y": [...]} の列の辞書
+- .csv:  x,y[,intensity] の列（1行目がヘッダの場合は列名で並べ替える）
+- .npy:  (点の数, 2 or 3) の数値の配列, もしくはフィールド x, y[, intensity] を持つ構造化配列
+- .npz:  配列 x, y[, intensity] を持つファイル
+- .bin:  ヘッダ (BINARY_HEADER) に続けて、点ごとに x, y[, intensity] を float64 (リトルエンディアン) で並べたもの
+
+読み込んだ配列は列名・列の長さ・値が有限であることを一度にまとめて検証し、不正な場合は ValueError を送出する。
+JSON, CSV は解析した結果をファイルのハッシュ値をキーとして .npy に保存し（DATAPOINT_PARAM を参照）、
+同じ内容のファイルを次に読み込むときは解析を省略する。
+
+# 使用例
+points = read_datapoints("demo.json")           # wu_physarum/resource/demo.json
+write_datapoints("instance_10k.bin", points)
+"""
+
+import io
+import os
+import json
+import struct
+import hashlib
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .setting import DATAPOINT_PARAM
+
+
+# 解析方法を変えた場合は上げる（古いキャッシュを使わないようにする）
+DATAPOINT_CACHE_VERSION = 1
+
+# 列の名前（intensityは省略できる）
+COLUMNS = ("x", "y", "intensity")
+
+# .bin のヘッダ: マジックナンバー, バージョン, 列数, 点の数
+BINARY_HEADER = struct.Struct("<4sHHQ")
+BINARY_MAGIC = b"WUDP"
+BINARY_VERSION = 1
+
+# 解析結果をキャッシュする形式
+CACHED_FORMATS = (".json", ".csv")
+
+
+def default_cache_dirname():
+    return os.path.join(os.path.expanduser("~"), ".cache", "wu_physarum", "datapoint")
+
+
+def datapoint_path(datapoint_filename):
+    """
+    データポイントファイルのパス（相対パスは wu_physarum/resource からのパスとする）
+    """
+    return os.path.join(Path(__file__).parent.parent / "resource", datapoint_filename)
+
+
+def validate_datapoints(columns, filename=None):
+    """
+    列の辞書 {"x", "y"[, "intensity"]} を検証し、(点の数, 2 or 3) の float64 の配列にする
+    """
+    where = " in {}".format(filename) if filename is not None else ""
+    if not set(COLUMNS[:2]) <= set(columns) <= set(COLUMNS):
+        raise ValueError("datapoint columns must be {} or {}{}: {}".format(
+            COLUMNS[:2], COLUMNS, where, tuple(columns)))
+    names = [name for name in COLUMNS if name in columns]
+    try:
+        points = np.stack([np.asarray(columns[name], dtype=np.float64) for name in names], axis=1)
+    except (TypeError, ValueError) as e:
+        raise ValueError("invalid datapoint values{}: {}".format(where, e)) from None
+    if points.ndim != 2 or len(points) == 0:
+        raise ValueError("datapoints must be a non-empty list of points{}".format(where))
+    invalid = ~np.isfinite(points).all(axis=1)
+    if invalid.any():
+        raise ValueError("datapoint {} is not finite{}: {}".format(
+            int(np.argmax(invalid)), where, points[np.argmax(invalid)].tolist()))
+    return points
+
+
+def _array_columns(array):
+    """
+    (点の数, 2 or 3) の配列, もしくは構造化配列を列の辞書にする
+    """
+    if array.dtype.names is not None:
+        return {name: array[name] for name in array.dtype.names}
+    if array.ndim != 2 or array.shape[1] not in (2, 3):
+        raise ValueError("datapoint array must have shape (n, 2) or (n, 3): {}".format(array.shape))
+    return dict(zip(COLUMNS, array.T))
+
+
+def _parse_json(data):
+    datas = json.loads(data)
+    if isinstance(datas, dict):
+        # 列の辞書
+        return datas
+    if not isinstance(datas, list) or not all(isinstance(data, dict) for data in datas):
+        raise ValueError("datapoint json must be a list of {\"x\", \"y\"[, \"intensity\"]}")
+    keys = {frozenset(data) for data in datas}
+    if len(keys) > 1:
+        raise ValueError("all datapoints must have the same keys: {}".format(sorted(map(sorted, keys))))
+    return {name: [data[name] for data in datas] for name in next(iter(keys), COLUMNS[:2])}
+
+
+def _parse_csv(data):
+    text = data.decode("utf-8-sig")
+    header = text.split("\n", 1)[0].strip()
+    try:
+        [float(value) for value in header.split(",")]
+        names, skiprows = None, 0
+    except ValueError:
+        names, skiprows = tuple(name.strip() for name in header.split(",")), 1
+    values = np.loadtxt(io.StringIO(text), delimiter=",", skiprows=skiprows, ndmin=2, dtype=np.float64)
+    if names is None:
+        # ヘッダがない場合は x, y[, intensity] の順とする
+        names = COLUMNS[:values.shape[1]]
+    if len(names) != values.shape[1]:
+        raise ValueError("csv header has {} columns but rows have {}".format(len(names), values.shape[1]))
+    return dict(zip(names, values.T))
+
+
+def _read_binary(filename):
+    with open(filename, "rb") as f:
+        magic, version, n_columns, count = BINARY_HEADER.unpack(f.read(BINARY_HEADER.size))
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("unsupported datapoint binary file: {}".format(filename))
+    if n_columns not in (2, 3):
+        raise ValueError("datapoint binary file must have 2 or 3 columns: {}".format(n_columns))
+    values = np.fromfile(filename, dtype="<f8", offset=BINARY_HEADER.size)
+    if len(values) != count * n_columns:
+        raise ValueError("datapoint binary file is truncated: {}".format(filename))
+    return dict(zip(COLUMNS, values.reshape(count, n_columns).T))
+
+
+def _read_columns(filename, ext, data=None):
+    if ext == ".json":
+        return _parse_json(data)
+    if ext == ".csv":
+        return _parse_csv(data)
+    if ext == ".npy":
+        return _array_columns(np.load(filename, allow_pickle=False))
+    if ext == ".npz":
+        with np.load(filename, allow_pickle=False) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+    return _read_binary(filename)
+
+
+def _cache_filename(dirname, data, ext):
+    digest = hashlib.sha256(data)
+    digest.update("{}:{}".format(DATAPOINT_CACHE_VERSION, ext).encode())
+    return os.path.join(dirname, digest.hexdigest() + ".npy")
+
+
+def _load_cache(filename):
+    try:
+        points = np.load(filename, allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    if points.dtype != np.float64 or points.ndim != 2 or points.shape[1] not in (2, 3):
+        return None
+    return points
+
+
+def _store_cache(filename, points):
+    """
+    一時ファイルに書き込んでから置き換える（書き込めない場合はキャッシュしない）
+    """
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp_", suffix=".npy")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, points)
+        os.replace(tmp, filename)
+    except OSError:
+        os.remove(tmp)
+
+
+def read_datapoints(datapoint_filename, cache=None):
+    """
+    データポイントファイルを読み込み、(点の数, 2 or 3) の float64 の配列 (x, y[, intensity]) を返す（読み取り専用）
+
+    Args:
+        datapoint_filename: データポイントファイル（相対パスは wu_physarum/resource からのパス）
+        cache: JSON, CSV の解析結果のキャッシュ
+            None        -> DATAPOINT_PARAM["cache"] の設定に従う
+            True, False -> 使う, 使わない
+    """
+    filename = datapoint_path(datapoint_filename)
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in (".json", ".csv", ".npy", ".npz", ".bin"):
+        raise ValueError("unsupported datapoint file format: {}".format(datapoint_filename))
+    if cache is None:
+        cache = DATAPOINT_PARAM["cache"]
+
+    points = None
+    data = cache_filename = None
+    if ext in CACHED_FORMATS:
+        with open(filename, "rb") as f:
+            data = f.read()
+        if cache:
+            cache_filename = _cache_filename(
+                DATAPOINT_PARAM["cache_dirname"] or default_cache_dirname(), data, ext)
+            points = _load_cache(cache_filename)
+    if points is None:
+        points = validate_datapoints(_read_columns(filename, ext, data), datapoint_filename)
+        if cache_filename is not None:
+            _store_cache(cache_filename, points)
+    points.setflags(write=False)
+    return points
+
+
+def write_datapoints(filename, points):
+    """
+    (点の数, 2 or 3) の配列 (x, y[, intensity]) を filename の拡張子の形式で書き込む
+    （filename はそのままのパスとし、wu_physarum/resource からのパスとはしない）
+    """
+    points = validate_datapoints(dict(zip(COLUMNS, np.asarray(points, dtype=np.float64).T)), filename)
+    names = COLUMNS[:points.shape[1]]
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".json":
+        # 整数の座標・強度は整数として書き込む
+        values = [[int(v) if v.is_integer() else v for v in row] for row in points.tolist()]
+        with open(filename, "w") as f:
+            json.dump([dict(zip(names, row)) for row in values], f)
+    elif ext == ".csv":
+        np.savetxt(filename, points, delimiter=",", header=",".join(names), comments="", fmt="%.17g")
+    elif ext == ".npy":
+        np.save(filename, points)
+    elif ext == ".npz":
+        np.savez(filename, **dict(zip(names, points.T)))
+    elif ext == ".bin":
+        with open(filename, "wb") as f:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, points.shape[1], len(points)))
+            f.write(points.astype("<f8").tobytes())
+    else:
+        raise ValueError("unsupported datapoint file format: {}".format(filename))
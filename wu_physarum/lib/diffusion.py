@@ -0,0 +1,607 @@
+"""
+格子セル（chenu_map, trail_map）の拡散処理
+
+WuPhysarum.__update_map で行う
+「平均フィルタ → 周辺ステージセル数による倍率補正 → ステージ外の除去 → データポイントへのchenu追加」
+を、モデル生成時に定数部分を前計算したうえで実行する。
+chenu_mapとtrail_mapの更新は互いに依存しないため、update_chenu, update_trail で個別にも実行できる。
+
+# バックエンド
+- "convolve": scipy.signal.convolve2d による従来通りの計算（カーネルのみ前計算）
+- "box"     : 累積和による分離可能な箱型フィルタ。確保済みのバッファ上で計算し、ステップごとに配列を確保しない
+- "fft"     : FFTによる畳み込み。フィルタが大きい場合に有効
+- "sparse"  : グリッドをタイルに分け、値のあるタイル（とエージェントのいるタイル）の周辺のみを更新する。
+              ステージの外や値がほぼ0の領域が広い場合に、更新の計算量が値のある領域の面積に比例する
+
+いずれも境界条件 fill (torus=False) / wrap (torus=True) について
+"convolve" と浮動小数点誤差の範囲で同じ結果を返す。
+
+dtypeに np.float32 を指定すると、フィルタ・係数・バッファをすべて float32 で持ち、拡散処理も float32 で行う。
+latticeに LATTICECELL_PARAM と同じ形の辞書を渡すと、lib/setting.py の値の代わりに使う (ModelParams.lattice)。
+
+fork() は前計算した定数部分（フィルタ・周辺ステージセル数・係数）の配列を共有し、
+更新に使うバッファのみを新たに確保した拡散処理を返す（WuPhysarumPrototype を参照）。
+release() はバッファを解放し、以降は fork() の元としてのみ使えるようにする。
+"""
+
+import copy
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy import fft, signal
+
+from .setting import LATTICECELL_PARAM, SPARSE_DIFFUSION_PARAM
+
+
+def _axis_slice(axis, start, stop):
+    """
+    配列の末尾2軸のうちaxis (-2 or -1) をstart:stopで切り出すためのインデックス
+    """
+    if axis == -1:
+        return (Ellipsis, slice(start, stop))
+    return (Ellipsis, slice(start, stop), slice(None))
+
+
+class BoxSum:
+    """
+    配列の末尾2軸に対し、幅 (kw, kh) の箱型フィルタの総和を累積和で計算する
+
+    signal.convolve2d(arr, np.ones((kw, kh)), mode="same", boundary=...) と同じ値を返す。
+    作業用のバッファはコンストラクタで確保し、__call__では新たに配列を確保しない。
+    """
+    def __init__(self, shape, kw, kh, torus, dtype=np.float64):
+        *lead, width, height = shape
+        if torus and (kw > width or kh > height):
+            raise ValueError("filter size must not exceed the grid size on torus")
+        self.shape = tuple(shape)
+        self.kw, self.kh = kw, kh
+        self.torus = torus
+        self.dtype = dtype
+        self.__allocate()
+
+    def __allocate(self):
+        *lead, width, height = self.shape
+        self.__buf_x = np.zeros((*lead, width + self.kw, height), dtype=self.dtype)
+        self.__buf_y = np.zeros((*lead, width, height + self.kh), dtype=self.dtype)
+        self.__tmp = np.zeros(self.shape, dtype=self.dtype)
+
+    def fork(self):
+        """
+        作業用のバッファのみを新たに確保したコピーを返す
+        """
+        box_sum = copy.copy(self)
+        box_sum.__allocate()
+        return box_sum
+
+    def release(self):
+        self.__buf_x = self.__buf_y = self.__tmp = None
+
+    def __sum_axis(self, src, out, buf, k, axis):
+        n = src.shape[axis]
+        # convolve2d の mode="same" と同じく、自身より前にk//2個、後ろに(k-1)//2個のセルを足し合わせる
+        a, b = k // 2, (k - 1) // 2
+
+        # buf = [0, 前側の境界(a個), src(n個), 後ろ側の境界(b個)]
+        buf[_axis_slice(axis, 0, 1)] = 0
+        buf[_axis_slice(axis, 1 + a, 1 + a + n)] = src
+        if self.torus:
+            buf[_axis_slice(axis, 1, 1 + a)] = src[_axis_slice(axis, n - a, n)]
+            buf[_axis_slice(axis, 1 + a + n, None)] = src[_axis_slice(axis, 0, b)]
+        else:
+            buf[_axis_slice(axis, 1, 1 + a)] = 0
+            buf[_axis_slice(axis, 1 + a + n, None)] = 0
+        np.cumsum(buf, axis=axis, out=buf)
+        np.subtract(buf[_axis_slice(axis, k, k + n)], buf[_axis_slice(axis, 0, n)], out=out)
+        return out
+
+    def __call__(self, src, out):
+        self.__sum_axis(src, self.__tmp, self.__buf_x, self.kw, -2)
+        return self.__sum_axis(self.__tmp, out, self.__buf_y, self.kh, -1)
+
+
+class FFTBoxSum:
+    """
+    配列の末尾2軸に対し、幅 (kw, kh) の箱型フィルタの総和をFFTで計算する
+
+    フィルタのスペクトルはコンストラクタで前計算する。
+    """
+    def __init__(self, shape, kw, kh, torus, dtype=np.float64):
+        *_, width, height = shape
+        if torus and (kw > width or kh > height):
+            raise ValueError("filter size must not exceed the grid size on torus")
+        self.shape = tuple(shape)
+        self.torus = torus
+        self.dtype = dtype
+        self.__width, self.__height = width, height
+        (aw, bw), (ah, bh) = (kw // 2, (kw - 1) // 2), (kh // 2, (kh - 1) // 2)
+
+        if torus:
+            # 循環畳み込み: out[i] = Σ_{d=-a}^{b} src[(i + d) mod n]
+            self.__fft_shape = (width, height)
+            kernel = np.zeros(self.__fft_shape, dtype=dtype)
+            kernel[np.ix_(-np.arange(-aw, bw + 1) % width, -np.arange(-ah, bh + 1) % height)] = 1
+            self.__crop = (slice(0, width), slice(0, height))
+        else:
+            # 線形畳み込みの結果のうち "same" に相当する部分を切り出す
+            self.__fft_shape = (fft.next_fast_len(width + kw - 1, real=True),
+                                fft.next_fast_len(height + kh - 1, real=True))
+            kernel = np.zeros(self.__fft_shape, dtype=dtype)
+            kernel[:kw, :kh] = 1
+            self.__crop = (slice(bw, bw + width), slice(bh, bh + height))
+        self.__kernel_spectrum = fft.rfft2(kernel)
+
+    def fork(self):
+        # 作業用のバッファを持たないため、そのまま共有できる
+        return self
+
+    def release(self):
+        pass
+
+    def __call__(self, src, out):
+        spectrum = fft.rfft2(src, s=self.__fft_shape, axes=(-2, -1))
+        spectrum *= self.__kernel_spectrum
+        result = fft.irfft2(spectrum, s=self.__fft_shape, axes=(-2, -1))
+        out[...] = result[(Ellipsis, *self.__crop)]
+        return out
+
+
+def adjacent_cell_num(stage_region, filter_width, filter_height, torus):
+    """
+    各セルの周辺 (filter_width, filter_height) にあるステージセルの数を返す。
+    ただし、0の場合は0除算を避けるため1とする。
+    """
+    boundary = "wrap" if torus else "fill"
+    adjacent_cell_num = signal.convolve2d(
+        stage_region, np.ones((filter_width, filter_height)), mode="same", boundary=boundary
+    )
+    return np.maximum(adjacent_cell_num, np.ones(np.shape(stage_region)))
+
+
+class ConvolveDiffusion:
+    """
+    scipy.signal.convolve2d による格子セルの更新（従来の __update_map と同じ計算）
+    """
+    def __init__(self, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=np.float64,
+                 lattice=None):
+        self.dtype = np.dtype(dtype)
+        self.lattice = dict(LATTICECELL_PARAM if lattice is None else lattice)
+        self.stage_region = stage_region
+        self.chenu_adding_region = chenu_adding_region
+        self.chenu_adding_intensity = chenu_adding_intensity
+        self.torus = torus
+        self.boundary = "wrap" if torus else "fill"
+
+        cnf_w, cnf_h, dampN = (
+            self.lattice["filterN_width"],
+            self.lattice["filterN_height"],
+            self.lattice["dampN"])
+        self.cnf = np.full((cnf_w, cnf_h), (1 - dampN) / (cnf_w * cnf_h), dtype=dtype)
+        trf_w, trf_h, dampT = (
+            self.lattice["filterT_width"],
+            self.lattice["filterT_height"],
+            self.lattice["dampT"])
+        self.trf = np.full((trf_w, trf_h), (1 - dampT) / (trf_w * trf_h), dtype=dtype)
+
+        self.fixed_adjacent_stage_region_cell_num_on_chenu_map = \
+            adjacent_cell_num(stage_region, cnf_w, cnf_h, torus).astype(dtype, copy=False)
+        self.fixed_adjacent_stage_region_cell_num_on_trail_map = \
+            adjacent_cell_num(stage_region, trf_w, trf_h, torus).astype(dtype, copy=False)
+
+    def fork(self):
+        """
+        定数部分の配列を共有する拡散処理を返す（ConvolveDiffusion はバッファを持たない）
+        """
+        return copy.copy(self)
+
+    def release(self):
+        pass
+
+    def update(self, chenu_map, trail_map):
+        """
+        chenu_map, trail_mapの更新を行う
+        """
+        return [self.update_chenu(chenu_map), self.update_trail(trail_map)]
+
+    def update_chenu(self, chenu_map):
+        """
+        Applying average filter
+        """
+        chenu_map = signal.convolve2d(chenu_map, self.cnf, mode="same", boundary=self.boundary)
+
+        """
+        Adjust the magnification on chenu_map for star_stage
+        (chenu_map) .* (周辺セル数) ./ (周辺ステージセル数) .* (self.stage_region)
+        """
+        chenu_map = chenu_map * self.cnf.size\
+            / self.fixed_adjacent_stage_region_cell_num_on_chenu_map
+
+        """
+        Exclude overhang chenu
+        """
+        chenu_map *= self.stage_region
+
+        """
+        Add chenu on datapoint
+        """
+        # Exclude filter effect in datapoint region
+        chenu_map *= (1 - self.chenu_adding_region)
+        # Add chenu on datapoint
+        chenu_map += self.chenu_adding_intensity
+        return chenu_map
+
+    def update_trail(self, trail_map):
+        """
+        Applying average filter
+        """
+        trail_map = signal.convolve2d(trail_map, self.trf, mode="same", boundary=self.boundary)
+
+        """
+        Adjust the magnification on trail_map for star_stage
+        (trail_map) .* (周辺セル数) ./ (周辺ステージセル数) .* (self.stage_region)
+        """
+        trail_map = trail_map * self.trf.size\
+            / self.fixed_adjacent_stage_region_cell_num_on_trail_map
+
+        """
+        Exclude overhang trail
+        """
+        trail_map *= self.stage_region
+        return trail_map
+
+
+class BufferedDiffusion(ConvolveDiffusion):
+    """
+    箱型フィルタの総和にセルごとの係数を掛けて格子セルを更新する
+
+    chenu_map <- BoxSum(chenu_map) .* factorN + chenu_adding_intensity
+    trail_map <- BoxSum(trail_map) .* factorT
+    （factorN, factorT は減衰率・周辺ステージセル数・ステージ・データポイント領域をまとめた係数）
+
+    出力は2面ずつ確保したバッファに交互に書き込むため、
+    返された配列は次の次のupdate呼び出しまで有効である。
+    """
+    box_sum_class = BoxSum
+
+    def __init__(self, stage_region, chenu_adding_region, chenu_adding_intensity, torus, shape=None,
+                 dtype=np.float64, lattice=None):
+        super().__init__(stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=dtype,
+                         lattice=lattice)
+        shape = np.shape(stage_region) if shape is None else tuple(shape)
+
+        self.chenu_factor = (1 - self.lattice["dampN"]) \
+            / self.fixed_adjacent_stage_region_cell_num_on_chenu_map \
+            * self.stage_region * (1 - np.asarray(self.chenu_adding_region, dtype=dtype))
+        self.trail_factor = (1 - self.lattice["dampT"]) \
+            / self.fixed_adjacent_stage_region_cell_num_on_trail_map \
+            * self.stage_region
+        self.chenu_factor = self.chenu_factor.astype(dtype, copy=False)
+        self.trail_factor = self.trail_factor.astype(dtype, copy=False)
+        self.chenu_adding_intensity = np.asarray(self.chenu_adding_intensity, dtype=dtype)
+
+        self.shape = shape
+        self.__chenu_box_sum = self.box_sum_class(shape, *self.cnf.shape, torus, dtype=dtype)
+        self.__trail_box_sum = self.box_sum_class(shape, *self.trf.shape, torus, dtype=dtype)
+        self.__allocate()
+
+    def __allocate(self):
+        shape, dtype = self.shape, self.dtype
+        self.__chenu_buffers = (np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype))
+        self.__trail_buffers = (np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype))
+
+    def fork(self):
+        diffusion = copy.copy(self)
+        diffusion.__chenu_box_sum = self.__chenu_box_sum.fork()
+        diffusion.__trail_box_sum = self.__trail_box_sum.fork()
+        diffusion.__allocate()
+        return diffusion
+
+    def release(self):
+        self.__chenu_box_sum.release()
+        self.__trail_box_sum.release()
+        self.__chenu_buffers = self.__trail_buffers = None
+
+    @staticmethod
+    def __output_buffer(buffers, src):
+        return buffers[1] if src is buffers[0] else buffers[0]
+
+    def update_chenu(self, chenu_map):
+        chenu_out = self.__output_buffer(self.__chenu_buffers, chenu_map)
+        self.__chenu_box_sum(chenu_map, chenu_out)
+        chenu_out *= self.chenu_factor
+        chenu_out += self.chenu_adding_intensity
+        return chenu_out
+
+    def update_trail(self, trail_map):
+        trail_out = self.__output_buffer(self.__trail_buffers, trail_map)
+        self.__trail_box_sum(trail_map, trail_out)
+        trail_out *= self.trail_factor
+        return trail_out
+
+
+class FFTDiffusion(BufferedDiffusion):
+    """
+    FFTによる畳み込みで格子セルを更新する（フィルタが大きい場合向け）
+    """
+    box_sum_class = FFTBoxSum
+
+
+def _tile_reduce(arr, tile_size, reduce):
+    """
+    (nx * tile_size, ny * tile_size) の配列をタイルごとにreduce (np.maximum, np.logical_or) でまとめる
+    （行方向に先にまとめることで、4次元に並べ替えてまとめるより速い）
+    """
+    nx, ny = arr.shape[0] // tile_size, arr.shape[1] // tile_size
+    rows = reduce.reduce(arr.reshape(nx, tile_size, ny * tile_size), axis=1)
+    return reduce.reduce(rows.reshape(nx, ny, tile_size), axis=2)
+
+
+def _dilate(mask, torus):
+    """
+    タイルのマスクを上下左右斜めに1タイル広げる
+    """
+    for axis in (0, 1):
+        if torus:
+            mask = mask | np.roll(mask, 1, axis=axis) | np.roll(mask, -1, axis=axis)
+        else:
+            dilated = mask.copy()
+            lo, hi = _axis_slice(axis - 2, 0, -1), _axis_slice(axis - 2, 1, None)
+            dilated[hi] |= mask[lo]
+            dilated[lo] |= mask[hi]
+            mask = dilated
+    return mask
+
+
+class SparseField:
+    """
+    1つのマップ（chenu_map もしくは trail_map）をタイル単位で更新する
+
+    マップは周囲に halo セル分の余白を付けたバッファに2面ずつ確保し、内側のビューを返す
+    （余白はtorus=Falseでは常に0, torus=Trueでは反対側の値を写す）。
+    最大値が threshold を超えるタイルを有効とし、有効なタイルから1タイル以内のタイルのみ
+    余白付きの窓を集めて箱型フィルタの総和と係数を計算する。それ以外のタイルは0とする。
+    """
+    def __init__(self, shape, tile_size, halo, kw, kh, factor, intensity, torus, threshold, dtype):
+        width, height = shape
+        self.shape = tuple(shape)
+        self.tile_size, self.halo = tile_size, halo
+        self.kw, self.kh = kw, kh
+        self.torus = torus
+        self.threshold = threshold
+        self.tiles_shape = (-(-width // tile_size), -(-height // tile_size))
+        self.dtype = dtype
+        self.__allocate()
+
+        # 係数・追加する強度はタイルごとに並べ替えておく（グリッド外は0）
+        self.__factor_tiles = self.__to_tiles(factor, dtype)
+        self.__intensity_tiles = None if intensity is None else self.__to_tiles(intensity, dtype)
+        self.__source = np.zeros(self.tiles_shape, dtype=bool)
+        if intensity is not None:
+            self.__source = (self.__intensity_tiles != 0).any(axis=(2, 3))
+        # 係数が全て0のタイル（ステージ外）は、追加する強度がなければ常に0
+        self.__updatable = (self.__factor_tiles != 0).any(axis=(2, 3)) | self.__source
+
+    def __allocate(self):
+        nx, ny = self.tiles_shape
+        t, h = self.tile_size, self.halo
+        padded_shape = (nx * t + 2 * h, ny * t + 2 * h)
+        self.__buffers = (np.zeros(padded_shape, dtype=self.dtype), np.zeros(padded_shape, dtype=self.dtype))
+        self.__views = tuple(self.__interior(buffer) for buffer in self.__buffers)
+        self.__written = [np.zeros(self.tiles_shape, dtype=bool), np.zeros(self.tiles_shape, dtype=bool)]
+        self.__current = None               # 現在のマップを保持しているバッファの番号
+        self.active = np.zeros(self.tiles_shape, dtype=bool)    # 現在のマップの有効なタイル
+
+    def fork(self):
+        """
+        タイルごとの係数・強度を共有し、バッファと有効なタイルを初期状態にしたコピーを返す
+        """
+        field = copy.copy(self)
+        field.__allocate()
+        return field
+
+    def release(self):
+        self.__buffers = self.__views = self.__written = None
+
+    def __to_tiles(self, arr, dtype):
+        nx, ny = self.tiles_shape
+        padded = np.zeros((nx * self.tile_size, ny * self.tile_size), dtype=dtype)
+        padded[:self.shape[0], :self.shape[1]] = arr
+        return np.ascontiguousarray(
+            padded.reshape(nx, self.tile_size, ny, self.tile_size).transpose(0, 2, 1, 3))
+
+    def __interior(self, buffer):
+        h = self.halo
+        return buffer[h:h + self.shape[0], h:h + self.shape[1]]
+
+    def __tiles(self, buffer):
+        """
+        バッファのタイル部分を (nx, ny, tile_size, tile_size) として見たビュー
+        """
+        nx, ny = self.tiles_shape
+        t, h = self.tile_size, self.halo
+        return buffer[h:h + nx * t, h:h + ny * t].reshape(nx, t, ny, t).transpose(0, 2, 1, 3)
+
+    def __windows(self, buffer):
+        """
+        各タイルを余白込みで (nx, ny, tile_size + 2 halo, tile_size + 2 halo) として見たビュー
+        """
+        nx, ny = self.tiles_shape
+        t, size = self.tile_size, self.tile_size + 2 * self.halo
+        s0, s1 = buffer.strides
+        return as_strided(buffer, shape=(nx, ny, size, size), strides=(t * s0, t * s1, s0, s1), writeable=False)
+
+    def __wrap_halo(self, buffer):
+        width, height = self.shape
+        h = self.halo
+        buffer[:h] = buffer[width:width + h]
+        buffer[h + width:2 * h + width] = buffer[h:2 * h]
+        buffer[:, :h] = buffer[:, height:height + h]
+        buffer[:, h + height:2 * h + height] = buffer[:, h:2 * h]
+
+    def __box_sum(self, windows):
+        """
+        窓 (B, size, size) の中央 (B, tile_size, tile_size) について箱型フィルタの総和を返す
+        """
+        t, h = self.tile_size, self.halo
+        out = windows
+        for axis, k in ((1, self.kw), (2, self.kh)):
+            start = h - k // 2
+            index = [slice(None)] * 3
+            index[axis] = slice(start, start + t)
+            total = out[tuple(index)].copy()
+            for d in range(1, k):
+                index[axis] = slice(start + d, start + d + t)
+                total += out[tuple(index)]
+            out = total
+        return out
+
+    def update(self, src, extra_active=None, scan=False):
+        """
+        srcを更新したマップ（バッファの内側のビュー）を返す
+
+        Args:
+            extra_active: 有効なタイルに加えるマスク（エージェントのいるタイルなど）
+            scan: srcの全タイルの最大値を調べ直す（前回の出力以外に値が書き込まれうる場合）
+        """
+        if self.__current is None or src is not self.__views[self.__current]:
+            # 外部から与えられた配列はバッファに写してから全タイルを調べる
+            self.__current = 0
+            self.__buffers[0][...] = 0
+            self.__views[0][...] = src
+            self.__written[0][...] = True
+            scan = True
+        src_buffer = self.__buffers[self.__current]
+        if scan:
+            nx, ny = self.tiles_shape
+            t, h = self.tile_size, self.halo
+            self.active = _tile_reduce(src_buffer[h:h + nx * t, h:h + ny * t], t, np.maximum) > self.threshold
+        active = self.active if extra_active is None else self.active | extra_active
+        if self.torus:
+            self.__wrap_halo(src_buffer)
+
+        out_index = 1 - self.__current
+        out_buffer = self.__buffers[out_index]
+        out_active = (_dilate(active, self.torus) & self.__updatable) | self.__source
+        ix, iy = np.nonzero(out_active)
+        result = self.__box_sum(self.__windows(src_buffer)[ix, iy])
+        result *= self.__factor_tiles[ix, iy]
+        if self.__intensity_tiles is not None:
+            result += self.__intensity_tiles[ix, iy]
+
+        out_tiles = self.__tiles(out_buffer)
+        out_tiles[self.__written[out_index] & ~out_active] = 0
+        out_tiles[ix, iy] = result
+        self.__written[out_index] = out_active
+        self.active = np.zeros(self.tiles_shape, dtype=bool)
+        if len(ix):
+            self.active[ix, iy] = result.max(axis=(1, 2)) > self.threshold
+        self.__current = out_index
+        return self.__views[out_index]
+
+
+class SparseDiffusion(ConvolveDiffusion):
+    """
+    値のあるタイルの周辺のみを更新する格子セルの拡散処理（SparseField を参照）
+
+    chenu_map は前回の更新結果のみから有効なタイルが決まる。
+    trail_map にはエージェントがtrailを付着させるため、track_occupancy で占有マップ（のビュー）を渡した場合は
+    エージェントのいるタイルを有効なタイルに加え、渡していない場合は毎回全タイルの最大値を調べる。
+    返された配列は BufferedDiffusion と同じく次の次のupdate呼び出しまで有効である。
+    """
+    def __init__(self, stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=np.float64,
+                 lattice=None, **params):
+        """
+        Args:
+            params: SPARSE_DIFFUSION_PARAM の値を上書きする
+        """
+        super().__init__(stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=dtype,
+                         lattice=lattice)
+        unknown = set(params) - set(SPARSE_DIFFUSION_PARAM)
+        if unknown:
+            raise ValueError("unknown sparse diffusion parameter: {}".format(sorted(unknown)))
+        self.params = dict(SPARSE_DIFFUSION_PARAM, **params)
+        shape = np.shape(stage_region)
+        tile_size = self.params["tile_size"]
+        halo = max(k // 2 for k in self.cnf.shape + self.trf.shape)
+        if halo > tile_size:
+            raise ValueError("tile_size must not be smaller than the filter radius: {}".format(tile_size))
+        if torus and (shape[0] % tile_size or shape[1] % tile_size):
+            raise ValueError("the grid size must be a multiple of tile_size on torus")
+
+        chenu_factor = (1 - self.lattice["dampN"]) \
+            / self.fixed_adjacent_stage_region_cell_num_on_chenu_map \
+            * self.stage_region * (1 - np.asarray(self.chenu_adding_region, dtype=dtype))
+        trail_factor = (1 - self.lattice["dampT"]) \
+            / self.fixed_adjacent_stage_region_cell_num_on_trail_map \
+            * self.stage_region
+        self.chenu_field = SparseField(
+            shape, tile_size, halo, *self.cnf.shape, chenu_factor, self.chenu_adding_intensity,
+            torus, self.params["threshold"], dtype)
+        self.trail_field = SparseField(
+            shape, tile_size, halo, *self.trf.shape, trail_factor, None,
+            torus, self.params["threshold"], dtype)
+        self.__occupancy = None
+
+    def fork(self):
+        diffusion = copy.copy(self)
+        diffusion.chenu_field = self.chenu_field.fork()
+        diffusion.trail_field = self.trail_field.fork()
+        diffusion.__occupancy = None
+        return diffusion
+
+    def release(self):
+        self.chenu_field.release()
+        self.trail_field.release()
+
+    def track_occupancy(self, occupancy):
+        """
+        エージェントの占有マップ（ステップごとに更新されるビュー）を渡す
+        """
+        self.__occupancy = occupancy
+
+    def __occupied_tiles(self):
+        field = self.trail_field
+        nx, ny = field.tiles_shape
+        t = field.tile_size
+        occupied = self.__occupancy
+        if occupied.shape != (nx * t, ny * t):
+            occupied = np.zeros((nx * t, ny * t), dtype=bool)
+            occupied[:field.shape[0], :field.shape[1]] = self.__occupancy
+        return _tile_reduce(occupied, t, np.logical_or)
+
+    def update_chenu(self, chenu_map):
+        return self.chenu_field.update(chenu_map)
+
+    def update_trail(self, trail_map):
+        if self.__occupancy is None:
+            return self.trail_field.update(trail_map, scan=True)
+        return self.trail_field.update(trail_map, extra_active=self.__occupied_tiles())
+
+
+DIFFUSION_BACKENDS = {
+    "convolve": ConvolveDiffusion,
+    "box": BufferedDiffusion,
+    "fft": FFTDiffusion,
+    "sparse": SparseDiffusion,
+}
+
+
+def create_diffusion(backend, stage_region, chenu_adding_region, chenu_adding_intensity, torus, shape=None,
+                     dtype=np.float64, lattice=None):
+    """
+    backend名から拡散処理のオブジェクトを作る
+
+    shapeに (B, width, height) を指定すると、B面を重ねた格子セルをまとめて更新する
+    （"box", "fft" のみ対応）
+    dtypeは chenu_map, trail_map の型で、拡散処理もこの型で行う
+    latticeは LATTICECELL_PARAM の代わりに使う辞書（Noneの場合は LATTICECELL_PARAM）
+    """
+    if backend not in DIFFUSION_BACKENDS:
+        raise ValueError("diffusion must be one of {}: {}".format(list(DIFFUSION_BACKENDS), backend))
+    if shape is None:
+        return DIFFUSION_BACKENDS[backend](
+            stage_region, chenu_adding_region, chenu_adding_intensity, torus, dtype=dtype, lattice=lattice)
+    if not issubclass(DIFFUSION_BACKENDS[backend], BufferedDiffusion):
+        raise ValueError("diffusion '{}' does not support stacked maps".format(backend))
+    return DIFFUSION_BACKENDS[backend](
+        stage_region, chenu_adding_region, chenu_adding_intensity, torus, shape=shape, dtype=dtype,
+        lattice=lattice)
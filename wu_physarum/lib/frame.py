@@ -0,0 +1,480 @@
+"""
+matplotlibを使わないスナップショットの描画とアニメーションの書き出し
+
+FrameRenderer は occupancy, chenu_map, trail_map をカラーマップの索引 (0〜254) に変換し、
+FRAME_PARAM["columns"] 列に並べた1枚のフレーム（パレット画像、uint8の2次元配列）に書き込む。
+色は palette[フレーム] で引く（索引255は余白の色）。
+200x200のマップ3枚で1フレーム数ミリ秒で描画・圧縮できる（render.render_snapshot は数百ミリ秒）。
+
+# 書き出し形式 (create_frame_writer)
+- "png":  スナップショットごとに step_{ステップ}.png を保存する
+- "apng": 全フレームを1つのアニメーションPNG (animation.png) に追記する
+          フレームごとにファイルへ書き込むため、フレーム数によらずメモリ使用量は一定である
+- "gif":  全フレームを1つのGIF (animation.gif) にまとめる（Pillowが必要）
+          書き出しまでは索引のフレームを animation.gif.frames に追記し、close() でGIFに変換する
+- "raw":  RGB24のフレームを animation.rgb に連結する（ステップは animation.steps, サイズは animation.json）
+          ffmpeg -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i animation.rgb で動画にできる
+いずれも resume_step を指定すると、既存のフレームのうち resume_step 未満のステップを残して続きから書き込む。
+
+# 使用例
+renderer = FrameRenderer(scale=2)
+with create_frame_writer("apng", "output", renderer.palette) as writer:
+    for step in range(0, 1000, 10):
+        writer.write(step, renderer.render(*snapshot_arrays(model)))
+        ...
+"""
+
+import os
+import json
+import zlib
+import struct
+
+import numpy as np
+
+from .setting import FRAME_PARAM
+
+
+# カラーマップの色数（索引 N_COLORS は余白の色）
+N_COLORS = 255
+
+# viridis を16等分した点の色（間は線形補間する）
+VIRIDIS = (
+    (68, 1, 84), (72, 24, 106), (71, 45, 123), (66, 64, 134), (59, 82, 139), (51, 99, 141),
+    (44, 114, 142), (38, 130, 142), (33, 145, 140), (31, 160, 136), (40, 174, 128), (63, 188, 115),
+    (94, 201, 98), (132, 212, 75), (173, 220, 48), (216, 226, 25), (253, 231, 37),
+)
+COLORMAPS = {
+    "viridis": VIRIDIS,
+    "gray": ((0, 0, 0), (255, 255, 255)),
+}
+
+# occupancyの値の範囲（render.snapshot_arrays の arr: モジホコリセル 0, 非datapoint 1, datapoint 2）
+OCCUPANCY_RANGE = (0.0, 2.0)
+
+FRAME_FORMATS = ("png", "apng", "gif", "raw")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def colormap_palette(name, background=(255, 255, 255)):
+    """
+    カラーマップ name を N_COLORS 色に分けたパレット (shape: (256, 3), uint8) を返す（最後の色は background）
+    COLORMAPS にない名前は、matplotlibがインストールされていればそのカラーマップを使う
+    """
+    if name in COLORMAPS:
+        stops = np.array(COLORMAPS[name], dtype=np.float64)
+        position = np.linspace(0, len(stops) - 1, N_COLORS)
+        colors = np.stack([np.interp(position, np.arange(len(stops)), stops[:, c]) for c in range(3)], axis=1)
+    else:
+        try:
+            import matplotlib
+        except ImportError:
+            raise ValueError("unknown colormap (matplotlib is not installed): {}".format(name)) from None
+        colors = matplotlib.colormaps[name](np.linspace(0, 1, N_COLORS))[:, :3] * 255
+    palette = np.empty((N_COLORS + 1, 3), dtype=np.uint8)
+    palette[:N_COLORS] = np.rint(colors)
+    palette[N_COLORS] = background
+    return palette
+
+
+class FrameRenderer:
+    """
+    occupancy, chenu_map, trail_map をカラーマップの索引に変換して1枚のフレームに並べる
+
+    各マップは render_snapshot と同じく x を横軸、y を縦軸（左下が原点）として描画し、
+    1セルを scale × scale 画素にする。
+    """
+    def __init__(self, **params):
+        """
+        Args:
+            params: FRAME_PARAM の値を上書きする
+        """
+        unknown = set(params) - set(FRAME_PARAM)
+        if unknown:
+            raise ValueError("unknown frame parameter: {}".format(sorted(unknown)))
+        self.params = dict(FRAME_PARAM, **params)
+        for field in self.params["fields"]:
+            if field not in ("occupancy", "chenu", "trail"):
+                raise ValueError("unknown frame field: {}".format(field))
+        self.palette = colormap_palette(self.params["colormap"], self.params["background"])
+        self.__shape = None
+        self.__frame = None
+        self.__tiles = []
+
+    def __layout(self, shape):
+        """
+        グリッドのサイズ shape のマップを並べるフレームと、各マップを書き込むビューを作る
+        """
+        scale, padding, columns = self.params["scale"], self.params["padding"], self.params["columns"]
+        width, height = shape[0] * scale, shape[1] * scale
+        n = len(self.params["fields"])
+        rows = -(-n // columns)
+        columns = min(columns, n)
+        frame = np.full((rows * height + (rows - 1) * padding, columns * width + (columns - 1) * padding),
+                        N_COLORS, dtype=np.uint8)
+        self.__tiles = []
+        for i in range(n):
+            top, left = (i // columns) * (height + padding), (i % columns) * (width + padding)
+            self.__tiles.append(frame[top:top + height, left:left + width])
+        self.__shape, self.__frame = shape, frame
+
+    def __indices(self, values, vmin, vmax):
+        """
+        vmin〜vmax を 0〜N_COLORS-1 の索引にする（範囲外は端の色）
+        """
+        values = np.asarray(values, dtype=np.float32)
+        scale = (N_COLORS - 1) / (vmax - vmin) if vmax > vmin else 0.0
+        indices = (values - np.float32(vmin)) * np.float32(scale)
+        np.clip(indices, 0, N_COLORS - 1, out=indices)
+        return indices.astype(np.uint8)
+
+    def render(self, arr, chenu_map, trail_map):
+        """
+        render.snapshot_arrays の (arr, chenu_map, trail_map) から索引のフレーム (shape: (高さ, 幅)) を作る
+        （返す配列は次のrender呼び出しで上書きされる）
+        """
+        shape = np.shape(arr)
+        if shape != self.__shape:
+            self.__layout(shape)
+        maps = {
+            "occupancy": (arr, *OCCUPANCY_RANGE),
+            "chenu": (chenu_map, 0.0, self.params["chenu_vmax"]),
+            "trail": (trail_map, 0.0, self.params["trail_vmax"]),
+        }
+        scale = self.params["scale"]
+        for field, tile in zip(self.params["fields"], self.__tiles):
+            values, vmin, vmax = maps[field]
+            if vmax is None:
+                vmax = float(np.max(values))
+            # [x, y] を [高さ方向（上がyの大きい側）, 幅方向] にする
+            indices = self.__indices(values, vmin, vmax).T[::-1]
+            if scale > 1:
+                indices = indices.repeat(scale, axis=0).repeat(scale, axis=1)
+            tile[...] = indices
+        return self.__frame
+
+    def rgb(self, frame):
+        """
+        索引のフレームをRGBの配列 (shape: (高さ, 幅, 3)) にする
+        """
+        return self.palette[frame]
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data \
+        + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def _png_image_data(frame, compress_level):
+    """
+    索引のフレームを、各行の先頭にフィルタ0を付けてzlibで圧縮したバイト列にする
+    """
+    rows = np.empty((frame.shape[0], frame.shape[1] + 1), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = frame
+    return zlib.compress(rows.tobytes(), compress_level)
+
+
+def _png_header(frame, palette):
+    height, width = frame.shape
+    return _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)) \
+        + _png_chunk(b"PLTE", palette.tobytes())
+
+
+def encode_png(frame, palette, compress_level=1):
+    """
+    索引のフレームをパレット形式のPNGのバイト列にする
+    """
+    return PNG_SIGNATURE + _png_header(frame, palette) \
+        + _png_chunk(b"IDAT", _png_image_data(frame, compress_level)) + _png_chunk(b"IEND", b"")
+
+
+class FrameWriter:
+    """
+    フレームの書き出しの共通部分（with文で使える）
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, step, frame):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PNGFrameWriter(FrameWriter):
+    """
+    スナップショットごとに dirname/step_{ステップ}.png を保存する
+    """
+    def __init__(self, dirname, palette, compress_level=1):
+        self.dirname = dirname
+        self.palette = palette
+        self.compress_level = compress_level
+
+    def write(self, step, frame):
+        filename = os.path.join(self.dirname, "step_{}.png".format(step))
+        with open(filename, "wb") as f:
+            f.write(encode_png(frame, self.palette, self.compress_level))
+        return filename
+
+
+class APNGWriter(FrameWriter):
+    """
+    フレームを1つのアニメーションPNGに追記する
+
+    各フレームの前に、そのフレームのステップを持つ独自の補助チャンク stEp を置く（ビューアは無視する）。
+    フレーム数 (acTL) と終端 (IEND) は flush, close の呼び出し時に書き込み、次のフレームで終端を上書きする。
+    """
+    STEP_CHUNK = b"stEp"
+
+    def __init__(self, filename, palette, fps=10, compress_level=1, resume_step=None):
+        self.filename = filename
+        self.palette = palette
+        self.fps = fps
+        self.compress_level = compress_level
+        self.frames = 0                     # 書き込んだフレーム数
+        self.__sequence = 0                 # fcTL, fdAT の通し番号
+        self.__size = None                  # フレームの (幅, 高さ)
+        self.__actl_offset = None           # acTL チャンクの位置
+        self.__file = None
+        if resume_step is not None and os.path.exists(filename):
+            self.__resume(resume_step)
+
+    def __resume(self, resume_step):
+        """
+        既存のファイルのうち resume_step 未満のフレームを残し、続きから書き込めるようにする
+        """
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        if not data.startswith(PNG_SIGNATURE):
+            return
+        position = len(PNG_SIGNATURE)
+        frames = sequence = 0
+        while position + 12 <= len(data):
+            length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+            end = position + 12 + length
+            if end > len(data) or chunk_type == b"IEND":
+                break
+            if chunk_type == b"IHDR":
+                self.__size = struct.unpack(">II", data[position + 8:position + 16])
+            elif chunk_type == b"acTL":
+                self.__actl_offset = position
+            elif chunk_type == self.STEP_CHUNK:
+                if struct.unpack(">q", data[position + 8:position + 16])[0] >= resume_step:
+                    break
+                frames += 1
+            elif chunk_type in (b"fcTL", b"fdAT"):
+                sequence += 1
+            position = end
+        if self.__actl_offset is None or frames == 0:
+            return
+        self.frames, self.__sequence = frames, sequence
+        self.__file = open(self.filename, "r+b")
+        self.__file.truncate(position)
+        self.__file.seek(position)
+
+    def __open(self, frame):
+        header = PNG_SIGNATURE + _png_header(frame, self.palette)
+        self.__actl_offset = len(header)
+        self.__size = frame.shape[::-1]
+        self.__file = open(self.filename, "wb")
+        self.__file.write(header + _png_chunk(b"acTL", struct.pack(">II", 0, 0)))
+
+    def write(self, step, frame):
+        if self.__file is None:
+            self.__open(frame)
+        width, height = self.__size
+        if frame.shape != (height, width):
+            raise ValueError("frame size changed: {} != {}".format(frame.shape, (height, width)))
+        image_data = _png_image_data(frame, self.compress_level)
+        chunks = [
+            _png_chunk(self.STEP_CHUNK, struct.pack(">q", step)),
+            _png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", self.__sequence, width, height, 0, 0, 1, self.fps, 0, 0)),
+        ]
+        self.__sequence += 1
+        if self.frames == 0:
+            chunks.append(_png_chunk(b"IDAT", image_data))
+        else:
+            chunks.append(_png_chunk(b"fdAT", struct.pack(">I", self.__sequence) + image_data))
+            self.__sequence += 1
+        self.__file.write(b"".join(chunks))
+        self.frames += 1
+
+    def flush(self):
+        """
+        フレーム数と終端を書き込み、そこまでのフレームを読めるファイルにする
+        """
+        f = self.__file
+        if f is None:
+            return
+        end = f.tell()
+        f.write(_png_chunk(b"IEND", b""))
+        f.seek(self.__actl_offset)
+        f.write(_png_chunk(b"acTL", struct.pack(">II", self.frames, 0)))
+        f.flush()
+        f.seek(end)
+
+    def close(self):
+        if self.__file is not None:
+            self.flush()
+            self.__file.close()
+            self.__file = None
+
+
+class RawFrameWriter(FrameWriter):
+    """
+    フレームを連結したファイル filename と、各フレームのステップを1行ずつ書いた filename_base.steps に書き込む
+
+    rgb=True の場合はRGB24の画素、False の場合は索引のまま書き込む。
+    フレームのサイズとパレットは filename_base.json に書き込む。
+    """
+    def __init__(self, filename, palette, fps=10, rgb=True, resume_step=None, steps_filename=None):
+        self.filename = filename
+        self.palette = palette
+        self.fps = fps
+        self.rgb = rgb
+        base = os.path.splitext(filename)[0]
+        self.steps_filename = steps_filename or base + ".steps"
+        self.meta_filename = base + ".json"
+        self.steps = []
+        self.__file = self.__steps_file = None
+        self.__frame_bytes = None
+        if resume_step is not None and os.path.exists(filename) and os.path.exists(self.steps_filename):
+            self.__resume(resume_step)
+
+    def __resume(self, resume_step):
+        if not os.path.exists(self.meta_filename):
+            return
+        with open(self.meta_filename) as f:
+            meta = json.load(f)
+        with open(self.steps_filename) as f:
+            steps = [int(line) for line in f.read().split()]
+        frame_bytes = meta["width"] * meta["height"] * (3 if self.rgb else 1)
+        # 異常終了で書きかけのフレームは捨てる
+        complete = os.path.getsize(self.filename) // frame_bytes
+        self.steps = [step for step in steps[:complete] if step < resume_step]
+        if not self.steps:
+            return
+        self.__frame_bytes = frame_bytes
+        self.__file = open(self.filename, "r+b")
+        self.__file.truncate(len(self.steps) * frame_bytes)
+        self.__file.seek(0, os.SEEK_END)
+        self.__steps_file = open(self.steps_filename, "w")
+        self.__steps_file.write("".join("{}\n".format(step) for step in self.steps))
+
+    def __open(self, frame):
+        height, width = frame.shape
+        with open(self.meta_filename, "w") as f:
+            json.dump({
+                "width": width,
+                "height": height,
+                "pix_fmt": "rgb24" if self.rgb else "pal8",
+                "fps": self.fps,
+                "palette": self.palette.tolist(),
+            }, f)
+        self.__frame_bytes = frame.size * (3 if self.rgb else 1)
+        self.__file = open(self.filename, "wb")
+        self.__steps_file = open(self.steps_filename, "w")
+
+    def write(self, step, frame):
+        if self.__file is None:
+            self.__open(frame)
+        data = self.palette[frame] if self.rgb else frame
+        if data.nbytes != self.__frame_bytes:
+            raise ValueError("frame size changed: {} != {} bytes".format(data.nbytes, self.__frame_bytes))
+        self.__file.write(np.ascontiguousarray(data).tobytes())
+        self.__steps_file.write("{}\n".format(step))
+        self.steps.append(step)
+
+    def flush(self):
+        if self.__file is not None:
+            self.__file.flush()
+            self.__steps_file.flush()
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__steps_file.close()
+            self.__file = self.__steps_file = None
+
+    def read_frames(self):
+        """
+        書き込んだフレームをメモリマップした配列 (shape: (フレーム数, 高さ, 幅[, 3])) を返す
+        """
+        with open(self.meta_filename) as f:
+            meta = json.load(f)
+        shape = (len(self.steps), meta["height"], meta["width"]) + ((3,) if self.rgb else ())
+        if len(self.steps) == 0:
+            return np.zeros(shape, dtype=np.uint8)
+        return np.memmap(self.filename, dtype=np.uint8, mode="r", shape=shape)
+
+
+class GIFWriter(FrameWriter):
+    """
+    フレームを1つのGIFにまとめる（Pillowを使う）
+
+    GIFは全フレームをまとめて書き出す必要があるため、書き込み中は索引のフレームを
+    filename.frames に追記し（RawFrameWriter）、close() でGIFに変換して削除する。
+    （resume_step で続きから書き込めるのは、close() の前に中断した場合のみ）
+    """
+    def __init__(self, filename, palette, fps=10, resume_step=None):
+        from PIL import Image
+
+        self.__image = Image
+        self.filename = filename
+        self.palette = palette
+        self.fps = fps
+        self.__raw = RawFrameWriter(filename + ".frames", palette, fps=fps, rgb=False, resume_step=resume_step,
+                                    steps_filename=filename + ".steps")
+
+    def write(self, step, frame):
+        self.__raw.write(step, frame)
+
+    def flush(self):
+        self.__raw.flush()
+
+    def close(self):
+        Image = self.__image
+        raw = self.__raw
+        raw.close()
+        if not raw.steps:
+            return
+        frames = raw.read_frames()
+        palette = self.palette.ravel().tolist()
+
+        def image(frame):
+            im = Image.frombytes("P", frame.shape[::-1], np.ascontiguousarray(frame).tobytes())
+            im.putpalette(palette)
+            return im
+
+        images = (image(frame) for frame in frames[1:])
+        image(frames[0]).save(self.filename, save_all=True, append_images=images,
+                              duration=1000 / self.fps, loop=0, optimize=False)
+        del frames
+        for filename in (raw.filename, raw.steps_filename, raw.meta_filename):
+            os.remove(filename)
+
+
+def create_frame_writer(image_format, dirname, palette, fps=None, compress_level=None, resume_step=None):
+    """
+    image_format ("png", "apng", "gif", "raw") のフレームの書き出しを dirname に作る
+    （fps, compress_level の省略時は FRAME_PARAM の値）
+    """
+    fps = FRAME_PARAM["fps"] if fps is None else fps
+    compress_level = FRAME_PARAM["compress_level"] if compress_level is None else compress_level
+    if image_format == "png":
+        return PNGFrameWriter(dirname, palette, compress_level)
+    if image_format == "apng":
+        return APNGWriter(os.path.join(dirname, "animation.png"), palette, fps, compress_level, resume_step)
+    if image_format == "gif":
+        return GIFWriter(os.path.join(dirname, "animation.gif"), palette, fps, resume_step)
+    if image_format == "raw":
+        return RawFrameWriter(os.path.join(dirname, "animation.rgb"), palette, fps, resume_step=resume_step)
+    raise ValueError("image_format must be one of {}: {}".format(FRAME_FORMATS, image_format))
@@ -0,0 +1,35 @@
+"""
+numbaによるJITコンパイル（任意）
+
+numba (pip install numba) がインストールされている場合、njit を付けた関数をネイティブコードにコンパイルする
+（初回の呼び出し時にコンパイルし、結果は __pycache__ にキャッシュする）。
+インストールされていない場合 kernel_available() は False を返し、
+WuPhysarum(engine="jit") は engine="mesa"（Physarumをエージェントごとに処理する）で実行する。
+
+環境変数 WU_PHYSARUM_JIT=python を設定してから import すると、numbaの有無によらず
+njit を付けた関数をコンパイルせずにPythonのまま実行する
+（numbaの NUMBA_DISABLE_JIT に相当。遅いのでカーネルの動作確認用）。
+"""
+
+import os
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+JIT_MODE = "python" if os.environ.get("WU_PHYSARUM_JIT") == "python" else ("numba" if numba is not None else None)
+
+
+def kernel_available():
+    """
+    njit を付けた関数を（コンパイルして、もしくはPythonのまま）カーネルとして使えるかどうか
+    """
+    return JIT_MODE is not None
+
+
+def njit(func):
+    if JIT_MODE == "numba":
+        return numba.njit(cache=True)(func)
+    return func
@@ -6,6 +6,7 @@ import json
 def jsonreader(datapoint_filename):
     """
     jsonファイルから座標の組を読み込む
+    （モデルは lib/datapoint.py の read_datapoints で読み込む。JSON以外の形式とキャッシュはそちらを参照）
     usuage:
         jsonreader("demo.json")
         -> ((100, 100), (200, 200), (300, 300))
@@ -0,0 +1,115 @@
+"""
+状態の配列の精度とメモリ使用量
+
+# 精度 (WuPhysarum, WuPhysarumEnsemble の precision)
+- "float64": chenu_map, trail_map などの場を float64、ステージのマスクを float64 で持つ（従来通り）
+- "float32": 場を float32、ステージのマスクを uint8（create_physarum_region は bool）で持ち、
+             拡散処理も float32 で行う。拡散処理で読み書きするバイト数がおよそ半分になる
+
+# メモリ使用量
+memory_report(model) はモデルが（属性をたどって）持つndarrayを列挙し、
+配列ごとの名前・shape・dtype・バイト数を返す。ビューは元の配列の分だけ1度数える。
+
+# 使用例
+model = WuPhysarum(datapoint_filename="demo.json", seed=1, engine="vector", diffusion="box", precision="float32")
+print(format_memory_report(memory_report(model)))
+"""
+
+import mmap
+
+import numpy as np
+
+
+PRECISIONS = {
+    "float64": {"field": np.float64, "mask": np.float64, "region": np.float64},
+    "float32": {"field": np.float32, "mask": np.uint8, "region": np.bool_},
+}
+
+
+def precision_dtypes(precision):
+    """
+    精度名から {"field": 場のdtype, "mask": マスクのdtype, "region": 領域のdtype} を返す
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("precision must be one of {}: {}".format(list(PRECISIONS), precision))
+    return PRECISIONS[precision]
+
+
+def root_array(array):
+    """
+    ビューの元になっている配列を返す
+    """
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def _attribute_name(name):
+    # 名前修飾された属性 (_Class__name) は __name として表示する
+    if name.startswith("_") and "__" in name[1:]:
+        return "__" + name.split("__", 1)[1]
+    return name
+
+
+def iter_arrays(obj, max_depth=3):
+    """
+    objとその属性（wu_physarum のオブジェクトのみたどる）が持つndarrayを (名前, 配列) として順に返す
+    （ビューもそのまま返す。同じオブジェクトは1度だけたどる）
+    """
+    visited = set()
+
+    def walk(value, name, depth):
+        if isinstance(value, np.ndarray):
+            yield name, value
+        elif isinstance(value, (list, tuple)):
+            for i, item in enumerate(value):
+                if isinstance(item, np.ndarray):
+                    yield "{}[{}]".format(name, i), item
+        elif depth < max_depth and type(value).__module__.startswith("wu_physarum") and id(value) not in visited:
+            visited.add(id(value))
+            attributes = getattr(value, "__dict__", {})
+            for key, item in list(attributes.items()):
+                yield from walk(item, "{}.{}".format(name, _attribute_name(key)) if name else _attribute_name(key),
+                                depth + 1)
+
+    yield from walk(obj, "", 0)
+
+
+def is_mapped(array):
+    """
+    ファイルをメモリマップした配列かどうか
+    """
+    return isinstance(array, np.memmap) or isinstance(array.base, mmap.mmap)
+
+
+def memory_report(obj, max_depth=3):
+    """
+    objとその属性（wu_physarum のオブジェクトのみたどる）が持つndarrayのメモリ使用量を返す
+
+    出力：{"name", "shape", "dtype", "bytes", "mapped"} のリスト（bytesの大きい順）
+          mapped はファイルをメモリマップした配列（常駐メモリとは限らない）かどうか
+    """
+    records = {}
+    for name, array in iter_arrays(obj, max_depth):
+        root = root_array(array)
+        if id(root) in records:
+            continue
+        records[id(root)] = {
+            "name": name,
+            "shape": tuple(root.shape),
+            "dtype": root.dtype.name,
+            "bytes": int(root.nbytes),
+            "mapped": is_mapped(root),
+        }
+    return sorted(records.values(), key=lambda record: -record["bytes"])
+
+
+def format_memory_report(report):
+    lines = ["{:<60} {:<16} {:<8} {:>12}".format("name", "shape", "dtype", "bytes")]
+    for record in report:
+        lines.append("{:<60} {:<16} {:<8} {:>12,}{}".format(
+            record["name"], "x".join(map(str, record["shape"])), record["dtype"], record["bytes"],
+            " (mapped)" if record["mapped"] else ""))
+    total = sum(record["bytes"] for record in report if not record["mapped"])
+    lines.append("total {:,} bytes ({:.1f} MB)".format(total, total / 1024 ** 2))
+    return "\n".join(lines)
@@ -0,0 +1,525 @@
+"""
+trail_mapからのネットワーク抽出と解の評価
+
+TrailNetworkAnalyzerをモデルに渡すと、interval ステップごとに以下を行い、結果を1行の記録として保持する。
+
+1. trail_map を threshold で二値化する（use_occupancy=True の場合はエージェントのいるセルも加える）
+   各データポイントの周辺 node_radius セルは常にネットワークに含める
+2. 二値画像を細線化 (Zhang-Suen) してネットワークの骨格を求める
+   細線化は8連結成分ごとに独立なので、前回から画素が変化した連結成分のみをラベル付け・細線化し直す
+   （ラベル付けは変化した画素を含む範囲のみで行い、グリッド全体はラベル付けし直さない）
+3. 骨格上の最短経路で、他のデータポイントを経由せずに結ばれるデータポイントの組を辺とするグラフを作る
+   最短経路は連結成分の中で閉じるため、変化しなかった連結成分のデータポイント間の距離は前回の値を使う
+4. グラフから解を読み取り、厳密解と比較する
+   - ナップザック問題 (KNAPSACK_PARAM にデータポイントファイルがある場合):
+     root と連結な品物を選んだものとし、重さ・価値・制約を満たすかを評価する
+   - 巡回セールスマン問題 (それ以外):
+     グラフが全データポイントを通る1つの閉路の場合にその巡回路長を評価する
+     比較する巡回路（tour_reference）はデータポイント数が exact_tour_limit 以下なら厳密解 ("exact")、
+     heuristic_tour_limit 以下なら最近傍法+2-opt の近似解 ("heuristic")、それより多い場合は求めない
+     巡回路はステップの処理では求めず、history を最初に参照したときに求めて tour_ratio を埋める
+
+記録には経過時間も含むため、記録を並べると解の質の時間変化が得られる。
+
+# 使用例
+model = WuPhysarum(datapoint_filename="knapsack6_R5_center8.json", seed=1, network=True)
+for _ in range(3000):
+    model.step()
+model.network_analyzer.dump_csv("network.csv")
+print(model.network_analyzer.history[-1])
+"""
+
+import csv
+import time
+
+import networkx as nx
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from .rasterize import datapoint_cells, datapoint_region
+from .setting import KNAPSACK_PARAM, NETWORK_PARAM
+
+
+EIGHT_CONNECTIVITY = np.ones((3, 3), dtype=bool)
+
+FIELDNAMES = (
+    "step", "elapsed", "mask_cells", "components", "rethinned_cells", "network_cells", "edges",
+    "connected", "tour", "tour_length", "tour_ratio", "tour_reference", "selected", "weight", "value", "feasible", "value_ratio",
+)
+
+
+def thin(mask):
+    """
+    二値画像を Zhang-Suen の方法で細線化する
+    """
+    image = np.pad(np.asarray(mask, dtype=np.uint8), 1)
+    core = image[1:-1, 1:-1]
+    while True:
+        is_changed = False
+        for is_first in (True, False):
+            # P2 (上) から時計回りに P9 (左上) まで
+            p2, p3, p4, p5 = image[:-2, 1:-1], image[:-2, 2:], image[1:-1, 2:], image[2:, 2:]
+            p6, p7, p8, p9 = image[2:, 1:-1], image[2:, :-2], image[1:-1, :-2], image[:-2, :-2]
+            neighbours = (p2, p3, p4, p5, p6, p7, p8, p9)
+            count = sum(p.astype(np.int8) for p in neighbours)
+            transitions = sum(((a == 0) & (b == 1)).astype(np.int8)
+                              for a, b in zip(neighbours, neighbours[1:] + neighbours[:1]))
+            if is_first:
+                condition = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                condition = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            is_deleted = (core == 1) & (2 <= count) & (count <= 6) & (transitions == 1) & condition
+            if is_deleted.any():
+                core[is_deleted] = 0
+                is_changed = True
+        if not is_changed:
+            return core.astype(bool)
+
+
+def skeleton_distances(skeleton, node_cells):
+    """
+    骨格上で、他のデータポイントを経由せずに各データポイントの組を結ぶ最短経路長を返す
+
+    骨格の画素のグラフ (CSR) は1度だけ作り、他のデータポイントの領域から出る辺の重みを inf にして
+    データポイントごとに Dijkstra 法を行う。
+
+    入力：node_cells は各データポイントの領域のセルの座標 (x, y) の組のリスト（skeleton の範囲外のセルは無視する）
+    出力：shape (データポイント数, データポイント数) の配列（結ばれていない組は inf）
+    """
+    width, height = skeleton.shape
+    index = np.full(skeleton.shape, -1, dtype=np.int64)
+    pixels = np.flatnonzero(skeleton)
+    index.ravel()[pixels] = np.arange(len(pixels))
+
+    # 8近傍の画素の組（右, 下, 右下, 左下）
+    sources, targets, weights = [], [], []
+    for dx, dy, weight in ((0, 1, 1.0), (1, 0, 1.0), (1, 1, np.sqrt(2)), (1, -1, np.sqrt(2))):
+        a = index[:width - dx, max(0, -dy):height - max(0, dy)]
+        b = index[dx:, max(0, dy):height + min(0, dy)]
+        is_edge = (a >= 0) & (b >= 0)
+        sources += [a[is_edge], b[is_edge]]
+        targets += [b[is_edge], a[is_edge]]
+        weights += [np.full(2 * np.count_nonzero(is_edge), weight)]
+    sources, targets, weights = np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+    graph = coo_matrix((weights, (sources, targets)), shape=(len(pixels), len(pixels))).tocsr()
+    graph.sort_indices()
+    weights = graph.data.copy()
+
+    terminals = []
+    for x, y in node_cells:
+        is_inside = (0 <= x) & (x < width) & (0 <= y) & (y < height)
+        terminal = index[x[is_inside], y[is_inside]]
+        terminals.append(terminal[terminal >= 0])
+
+    # データポイントの領域の画素から出る辺（CSRの行）の重みを inf にしておき、出発するデータポイントのみ戻す
+    def out_edges(terminal):
+        starts = graph.indptr[terminal]
+        counts = graph.indptr[terminal + 1] - starts
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    blocked = [out_edges(terminal) for terminal in terminals]
+    for edges in blocked:
+        graph.data[edges] = np.inf
+
+    n = len(node_cells)
+    distances = np.full((n, n), np.inf)
+    # 骨格上に領域があるデータポイントの、各領域の画素までの距離の最小値を reduceat でまとめて求める
+    connected = np.array([i for i in range(n) if len(terminals[i]) > 0], dtype=np.int64)
+    if len(connected) == 0:
+        return distances
+    all_terminals = np.concatenate([terminals[i] for i in connected])
+    offsets = np.cumsum([0] + [len(terminals[i]) for i in connected[:-1]])
+    for i in connected:
+        graph.data[blocked[i]] = weights[blocked[i]]
+        distance = dijkstra(graph, directed=True, indices=terminals[i], min_only=True)
+        graph.data[blocked[i]] = np.inf
+        distances[i, connected] = np.minimum.reduceat(distance[all_terminals], offsets)
+    np.fill_diagonal(distances, np.inf)
+    return np.minimum(distances, distances.T)
+
+
+def tour_length(points, tour):
+    points = np.asarray(points, dtype=np.float64)[:, :2]
+    ordered = points[list(tour) + [tour[0]]]
+    return float(np.sum(np.linalg.norm(np.diff(ordered, axis=0), axis=1)))
+
+
+def optimal_tour(points):
+    """
+    巡回セールスマン問題の厳密解を動的計画法 (Held-Karp) で求める
+
+    出力：(巡回路長, データポイントの巡回順)
+    """
+    points = np.asarray(points, dtype=np.float64)[:, :2]
+    n = len(points)
+    if n < 2:
+        return 0.0, list(range(n))
+    distance = np.linalg.norm(points[:, None] - points[None, :], axis=2)
+    # cost[S, j]: データポイント0から出発し、集合S (0を除く, bit j-1) を訪れてjで終わる最短経路長
+    full = 1 << (n - 1)
+    cost = np.full((full, n), np.inf)
+    parent = np.full((full, n), -1, dtype=np.int64)
+    for j in range(1, n):
+        cost[1 << (j - 1), j] = distance[0, j]
+    for subset in range(1, full):
+        members = [j for j in range(1, n) if subset & (1 << (j - 1))]
+        for j in members:
+            previous = subset & ~(1 << (j - 1))
+            if previous == 0:
+                continue
+            candidates = [k for k in members if k != j]
+            values = cost[previous, candidates] + distance[candidates, j]
+            best = int(np.argmin(values))
+            cost[subset, j], parent[subset, j] = values[best], candidates[best]
+    last = int(np.argmin(cost[full - 1, 1:] + distance[1:, 0])) + 1
+    length = float(cost[full - 1, last] + distance[last, 0])
+    tour, subset = [], full - 1
+    while last > 0:
+        tour.append(last)
+        subset, last = subset & ~(1 << (last - 1)), parent[subset, last]
+    return length, [0] + tour[::-1]
+
+
+def heuristic_tour(points):
+    """
+    巡回セールスマン問題の近似解を最近傍法で作り、2-opt で改善して求める
+
+    出力：(巡回路長, データポイントの巡回順)
+    """
+    points = np.asarray(points, dtype=np.float64)[:, :2]
+    n = len(points)
+    if n < 4:
+        return tour_length(points, list(range(n))) if n > 0 else 0.0, list(range(n))
+    distance = np.linalg.norm(points[:, None] - points[None, :], axis=2)
+
+    # 最近傍法
+    tour = np.zeros(n, dtype=np.int64)
+    is_visited = np.zeros(n, dtype=bool)
+    is_visited[0] = True
+    for k in range(1, n):
+        d = np.where(is_visited, np.inf, distance[tour[k - 1]])
+        tour[k] = np.argmin(d)
+        is_visited[tour[k]] = True
+
+    # 2-opt: 辺 (tour[i], tour[i+1]) と (tour[j], tour[j+1]) を最も短くなる組に張り替える
+    is_improved = True
+    while is_improved:
+        is_improved = False
+        for i in range(n - 2):
+            a, b = tour[i], tour[i + 1]
+            c, d = tour[i + 2:], np.append(tour[i + 3:], tour[0])
+            delta = distance[a, c] + distance[b, d] - distance[a, b] - distance[c, d]
+            if i == 0:
+                # 最後の辺は (tour[0], tour[1]) と隣り合う
+                delta = delta[:-1]
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                j += i + 2
+                tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1].copy()
+                is_improved = True
+    return tour_length(points, tour.tolist()), tour.tolist()
+
+
+def optimal_knapsack(weights, values, capacity):
+    """
+    0-1ナップザック問題の厳密解を全探索で求める
+
+    出力：(最大価値, 選ぶ品物の番号のリスト)
+    """
+    n = len(weights)
+    choices = (np.arange(1 << n)[:, None] >> np.arange(n)) & 1
+    total_weights, total_values = choices @ np.asarray(weights), choices @ np.asarray(values)
+    total_values = np.where(total_weights <= capacity, total_values, -1)
+    best = int(np.argmax(total_values))
+    return int(total_values[best]), [i for i in range(n) if choices[best, i]]
+
+
+class TrailNetworkAnalyzer:
+    def __init__(self, **params):
+        """
+        Args:
+            params: NETWORK_PARAM の値を上書きする
+        """
+        unknown = set(params) - set(NETWORK_PARAM)
+        if unknown:
+            raise ValueError("unknown network parameter: {}".format(sorted(unknown)))
+        self.params = dict(NETWORK_PARAM, **params)
+
+        self.__history = []                 # 解析結果 (dict) のリスト（history を参照）
+        self.graph = None                   # 直前の解析で得たデータポイントのグラフ (networkx.Graph)
+        self.skeleton = None                # 直前の解析で得たネットワークの骨格
+        self.problem = None                 # ナップザック問題 (KNAPSACK_PARAM の値)
+        self.__points = None
+        self.__node_cells = None            # 各データポイントの領域のセルの座標 (x, y)
+        self.__node_mask = None             # 全データポイントの領域
+        self.__optimum = None
+        self.__tour_reference = None
+        self.__mask = None
+        self.__labels = None                # maskの8連結成分のラベル（変化しなかった成分はラベルを保つ）
+        self.__objects = {}                 # ラベル -> 連結成分の範囲 (slice の組)
+        self.__next_label = 1
+        self.__distance_cache = {}          # ラベル -> (成分内のデータポイント, その間の距離)
+        self.__elapsed = 0.0
+        self.__timer_start = None
+
+    def setup(self, datapoint_pos, datapoint_filename=None, width=None, height=None):
+        """
+        データポイントの座標から各データポイントの領域と、ナップザック問題の厳密解を求める
+        （最初のupdateで自動的に呼ばれる。巡回セールスマン問題の巡回路は optimum の参照時に求める）
+        """
+        self.__points = np.asarray(datapoint_pos, dtype=np.float64)[:, :2]
+        x, y, index = datapoint_cells(self.__points, width, height, radius=self.params["node_radius"])
+        bounds = np.searchsorted(index, np.arange(len(self.__points) + 1))
+        self.__node_cells = [(x[a:b], y[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+        self.__node_mask = datapoint_region(self.__points, width, height, radius=self.params["node_radius"])
+        self.problem = KNAPSACK_PARAM.get(datapoint_filename)
+        if self.problem is not None:
+            self.__optimum = optimal_knapsack(self.problem["weights"], self.problem["values"], self.problem["capacity"])
+
+    @property
+    def optimum(self):
+        """
+        比較する解（ナップザック問題なら厳密解 (最大価値, 品物), 巡回セールスマン問題なら (巡回路長, 巡回順)）
+        巡回セールスマン問題では最初の参照時に求め、データポイント数が heuristic_tour_limit より多い場合は None
+        """
+        if self.problem is None and self.__tour_reference is None and self.__points is not None:
+            n = len(self.__points)
+            if n <= self.params["exact_tour_limit"]:
+                self.__optimum, self.__tour_reference = optimal_tour(self.__points), "exact"
+            elif n <= self.params["heuristic_tour_limit"]:
+                self.__optimum, self.__tour_reference = heuristic_tour(self.__points), "heuristic"
+            else:
+                self.__tour_reference = "none"
+        return self.__optimum
+
+    @property
+    def history(self):
+        """
+        解析結果 (dict) のリスト（巡回セールスマン問題の tour_ratio, tour_reference はここで埋める）
+        """
+        pending = [record for record in self.__history
+                   if record["tour_length"] is not None and record.get("tour_reference") is None]
+        if pending:
+            optimum = self.optimum
+            for record in pending:
+                record["tour_reference"] = self.__tour_reference
+                if optimum is not None and optimum[0] > 0:
+                    record["tour_ratio"] = record["tour_length"] / optimum[0]
+        return self.__history
+
+    def update(self, model):
+        """
+        モデルのステップごとに呼び出す
+        """
+        if self.__timer_start is None:
+            self.__timer_start = time.perf_counter()
+        step = model.schedule.steps
+        if step % self.params["interval"] != 0:
+            return
+        if self.__points is None:
+            width, height = model.trail_map.shape
+            self.setup(model.datapoint_pos, model.datapoint_filename, width, height)
+        occupancy_map = model.occupancy_map if self.params["use_occupancy"] else None
+        self.analyze(model.trail_map, occupancy_map, step)
+
+    def __relabel(self, mask):
+        """
+        前回から画素が変化した範囲のみをラベル付けし直す
+
+        変化した画素（の8近傍）に接する連結成分には新しいラベルを付け、それ以外の連結成分は前回のラベルを保つ。
+        出力：(ラベル付けし直した範囲 (slice の組), 新しいラベルのリスト, 消えたラベルのリスト)
+        """
+        if self.__labels is None:
+            self.__labels, components = ndimage.label(mask, structure=EIGHT_CONNECTIVITY)
+            self.__objects = dict(enumerate(ndimage.find_objects(self.__labels), start=1))
+            self.__next_label = components + 1
+            return (slice(None), slice(None)), list(self.__objects), []
+
+        changed = mask != self.__mask
+        x, y = np.nonzero(changed)
+        if len(x) == 0:
+            return None, [], []
+        # 変化した画素の8近傍と、範囲にかかる前回の連結成分を含むまで範囲を広げる
+        # （範囲の外の画素は変化していないため、範囲内の新しい連結成分は範囲の外に続かない）
+        width, height = mask.shape
+        x0, x1, y0, y1 = max(x.min() - 1, 0), min(x.max() + 2, width), max(y.min() - 1, 0), min(y.max() + 2, height)
+        while True:
+            region = (slice(x0, x1), slice(y0, y1))
+            old = np.unique(self.__labels[region])
+            old = old[old > 0]
+            bounds = [(x0, x1, y0, y1)] + [(sx.start, sx.stop, sy.start, sy.stop) for sx, sy in
+                                            (self.__objects[label] for label in old)]
+            expanded = (min(b[0] for b in bounds), max(b[1] for b in bounds),
+                        min(b[2] for b in bounds), max(b[3] for b in bounds))
+            if expanded == (x0, x1, y0, y1):
+                break
+            x0, x1, y0, y1 = expanded
+
+        labels, components = ndimage.label(mask[region], structure=EIGHT_CONNECTIVITY)
+        touched = ndimage.binary_dilation(changed[region], structure=EIGHT_CONNECTIVITY)
+        index = np.arange(1, components + 1)
+        is_touched = np.asarray(ndimage.maximum(touched, labels, index), dtype=bool) if components else \
+            np.zeros(0, dtype=bool)
+        previous = np.asarray(ndimage.maximum(self.__labels[region], labels, index), dtype=np.int64) if components \
+            else np.zeros(0, dtype=np.int64)
+        mapping = np.zeros(components + 1, dtype=np.int64)
+        mapping[1:] = previous
+        fresh = np.arange(self.__next_label, self.__next_label + np.count_nonzero(is_touched))
+        mapping[1:][is_touched] = fresh
+        self.__next_label += len(fresh)
+
+        removed = sorted(set(old.tolist()) - set(previous[~is_touched].tolist()))
+        for label in removed:
+            del self.__objects[label]
+        is_fresh = set(fresh.tolist())
+        for label, (sx, sy) in zip(mapping[1:].tolist(), ndimage.find_objects(labels)):
+            if label in is_fresh:
+                self.__objects[int(label)] = (slice(sx.start + x0, sx.stop + x0), slice(sy.start + y0, sy.stop + y0))
+        self.__labels[region] = mapping[labels]
+        return region, fresh.tolist(), removed
+
+    def __skeletonize(self, mask, region, fresh):
+        """
+        ラベル付けし直した範囲 region のうち、新しいラベルの連結成分のみを細線化し直す
+
+        出力：(骨格, 細線化し直した領域の画素数)
+        """
+        if region is None:
+            return self.skeleton, 0
+        skeleton = np.zeros_like(mask) if self.skeleton is None else self.skeleton.copy()
+        labels = self.__labels[region]
+        skeleton[region] &= mask[region] & ~np.isin(labels, fresh)
+        rethinned_cells = 0
+        for label in fresh:
+            bbox = self.__objects[label]
+            component = self.__labels[bbox] == label
+            skeleton[bbox] |= thin(component)
+            rethinned_cells += component.size
+        return skeleton, rethinned_cells
+
+    def __distances(self, skeleton, fresh, removed):
+        """
+        データポイント間の骨格上の距離を返す（新しいラベルの連結成分のデータポイント間のみ求め直す）
+        """
+        for label in removed:
+            self.__distance_cache.pop(label, None)
+        n = len(self.__points)
+        # 各データポイントの領域は mask に含まれ、1つの連結成分に属する
+        node_labels = np.array([self.__labels[x[0], y[0]] if len(x) else 0 for x, y in self.__node_cells])
+        if fresh:
+            is_fresh = np.isin(node_labels, fresh)
+            nodes = np.flatnonzero(is_fresh)
+            if len(nodes) > 0:
+                bboxes = [self.__objects[label] for label in np.unique(node_labels[nodes])]
+                x0, x1 = min(sx.start for sx, _ in bboxes), max(sx.stop for sx, _ in bboxes)
+                y0, y1 = min(sy.start for _, sy in bboxes), max(sy.stop for _, sy in bboxes)
+                region = (slice(x0, x1), slice(y0, y1))
+                sub_skeleton = skeleton[region] & np.isin(self.__labels[region], fresh)
+                sub_distances = skeleton_distances(
+                    sub_skeleton, [(self.__node_cells[i][0] - x0, self.__node_cells[i][1] - y0) for i in nodes])
+                for label in np.unique(node_labels[nodes]):
+                    members = np.flatnonzero(node_labels[nodes] == label)
+                    self.__distance_cache[int(label)] = (nodes[members], sub_distances[np.ix_(members, members)])
+        distances = np.full((n, n), np.inf)
+        for members, member_distances in self.__distance_cache.values():
+            distances[np.ix_(members, members)] = member_distances
+        return distances
+
+    def analyze(self, trail_map, occupancy_map=None, step=None):
+        mask = np.asarray(trail_map) >= self.params["threshold"]
+        if occupancy_map is not None:
+            mask |= occupancy_map
+        mask |= self.__node_mask
+
+        region, fresh, removed = self.__relabel(mask)
+        skeleton, rethinned_cells = self.__skeletonize(mask, region, fresh)
+        self.__mask, self.skeleton = mask, skeleton
+        components = len(self.__objects)
+
+        n = len(self.__points)
+        distances = self.__distances(skeleton, fresh, removed)
+        graph = nx.Graph()
+        graph.add_nodes_from(range(n))
+        rows, columns = np.nonzero(np.triu(np.isfinite(distances), 1))
+        graph.add_weighted_edges_from(zip(rows.tolist(), columns.tolist(), distances[rows, columns].tolist()))
+        self.graph = graph
+
+        record = {name: None for name in FIELDNAMES}
+        record.update({
+            "step": step,
+            "elapsed": self.elapsed,
+            "mask_cells": int(np.count_nonzero(mask)),
+            "components": int(components),
+            "rethinned_cells": int(rethinned_cells),
+            "network_cells": int(np.count_nonzero(skeleton)),
+            "edges": graph.number_of_edges(),
+            "connected": nx.is_connected(graph),
+        })
+        if self.problem is not None:
+            record.update(self.__score_knapsack(graph))
+        else:
+            record.update(self.__score_tour(graph))
+        self.__history.append(record)
+        return record
+
+    def __score_knapsack(self, graph):
+        root = self.problem["root"]
+        items = [node for node in range(len(self.__points)) if node != root]
+        connected = nx.node_connected_component(graph, root)
+        selected = [i for i, node in enumerate(items) if node in connected]
+        weight = sum(self.problem["weights"][i] for i in selected)
+        value = sum(self.problem["values"][i] for i in selected)
+        feasible = weight <= self.problem["capacity"]
+        return {
+            "selected": selected,
+            "weight": weight,
+            "value": value,
+            "feasible": feasible,
+            "value_ratio": value / self.__optimum[0] if feasible and self.__optimum[0] > 0 else 0.0,
+        }
+
+    def __score_tour(self, graph):
+        n = graph.number_of_nodes()
+        if n < 3 or any(degree != 2 for _, degree in graph.degree()) or not nx.is_connected(graph):
+            return {}
+        # 全データポイントを通る1つの閉路を、データポイント0からたどる
+        tour, previous = [0], None
+        while len(tour) < n:
+            node = next(nx.neighbors(graph, tour[-1]) if previous is None else
+                        (v for v in graph.neighbors(tour[-1]) if v != previous))
+            previous = tour[-1]
+            tour.append(node)
+        # tour_ratio は history の参照時に埋める（比較する巡回路をステップの処理で求めない）
+        return {"tour": tour, "tour_length": tour_length(self.__points, tour)}
+
+    @property
+    def elapsed(self):
+        """
+        最初のupdateからの経過時間（チェックポイントから復元した場合は保存時までの時間を含む）
+        """
+        if self.__timer_start is None:
+            return self.__elapsed
+        return self.__elapsed + time.perf_counter() - self.__timer_start
+
+    def get_state(self):
+        return {
+            "history": list(self.__history),
+            "mask": self.__mask,
+            "skeleton": self.skeleton,
+            "elapsed": self.elapsed,
+        }
+
+    def set_state(self, state):
+        self.__history = list(state["history"])
+        self.__mask, self.skeleton = state["mask"], state["skeleton"]
+        # ラベルと距離は次の解析でグリッド全体から求め直す（骨格は連結成分ごとに同じ結果になる）
+        self.__labels, self.__objects, self.__distance_cache = None, {}, {}
+        self.__elapsed, self.__timer_start = state["elapsed"], None
+
+    def dump_csv(self, filename):
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(self.history)
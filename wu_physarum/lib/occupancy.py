@@ -0,0 +1,113 @@
+"""
+エージェントの配置を配列で保持するグリッド
+
+mesa.space.SingleGrid はセルごとのエージェントをリストのリストで保持するため、
+衝突判定や占有マップの作成がPythonのループになる。
+OccupancyGrid は
+- occupied: エージェントが存在するセルをTrueとする二次元配列
+- agent_id: 各セルのエージェントの unique_id（空きセルは EMPTY）
+を正とし、SingleGrid と同じメソッド（place_agent, move_agent, remove_agent, is_cell_empty など）を
+配列の読み書きとして提供する。エージェントごとの呼び出しでnumpyのスカラー参照の遅さが効かないよう、
+配列の実体は bytearray, array.array とし、occupied, agent_id はそれを共有するndarrayとする。
+mesaの可視化（CanvasGrid）が使う get_cell_list_contents も持つ。
+
+occupancy_view() は occupied の読み取り専用のビューを返す（コピーしない）。
+"""
+
+from array import array
+
+import numpy as np
+
+
+EMPTY = -1
+
+
+class OccupancyGrid:
+    def __init__(self, width, height, torus):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.__cells = bytearray(width * height)                 # セル x * height + y の occupied
+        self.__ids = array("q", [EMPTY]) * (width * height)       # セル x * height + y の agent_id
+        self.occupied = np.frombuffer(self.__cells, dtype=bool).reshape(width, height)
+        self.agent_id = np.frombuffer(self.__ids, dtype=np.int64).reshape(width, height)
+        self.__agents = {}                  # unique_id -> エージェント
+
+    def occupancy_view(self):
+        """
+        occupiedの読み取り専用のビューを返す（以降の配置の変更が反映される）
+        """
+        view = self.occupied.view()
+        view.flags.writeable = False
+        return view
+
+    def torus_adj(self, pos):
+        if not self.out_of_bounds(pos):
+            return pos
+        elif not self.torus:
+            raise Exception("Point out of bounds, and space non-toroidal.")
+        return pos[0] % self.width, pos[1] % self.height
+
+    def out_of_bounds(self, pos):
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def is_cell_empty(self, pos):
+        return not self.__cells[pos[0] * self.height + pos[1]]
+
+    def place_agent(self, agent, pos):
+        if not self.is_cell_empty(pos):
+            raise Exception("Cell not empty")
+        self.__set(agent, pos)
+        agent.pos = pos
+
+    def move_agent(self, agent, pos):
+        pos = self.torus_adj(pos)
+        self.__clear(agent.pos)
+        self.__set(agent, pos)
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        self.__clear(agent.pos)
+        agent.pos = None
+
+    def __set(self, agent, pos):
+        cell = pos[0] * self.height + pos[1]
+        self.__cells[cell] = 1
+        self.__ids[cell] = agent.unique_id
+        self.__agents[agent.unique_id] = agent
+
+    def __clear(self, pos):
+        cell = pos[0] * self.height + pos[1]
+        del self.__agents[self.__ids[cell]]
+        self.__cells[cell] = 0
+        self.__ids[cell] = EMPTY
+
+    def __getitem__(self, x):
+        """
+        SingleGridの grid[x][y] と同じく、列xの各セルのエージェント（空きセルはNone）を返す
+        """
+        return [self.__agents.get(unique_id) for unique_id in self.agent_id[x].tolist()]
+
+    @property
+    def grid(self):
+        """
+        SingleGrid.grid と同じリストのリスト（互換用、呼び出すたびに作る）
+        """
+        return [self[x] for x in range(self.width)]
+
+    def iter_cell_list_contents(self, cell_list):
+        if isinstance(cell_list, tuple) and len(cell_list) == 2:
+            cell_list = [cell_list]
+        for x, y in cell_list:
+            unique_id = self.__ids[x * self.height + y]
+            if unique_id != EMPTY:
+                yield self.__agents[unique_id]
+
+    def get_cell_list_contents(self, cell_list):
+        return list(self.iter_cell_list_contents(cell_list))
+
+    def coord_iter(self):
+        for x in range(self.width):
+            for y, agent in enumerate(self[x]):
+                yield agent, x, y
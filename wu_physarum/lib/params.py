@@ -0,0 +1,156 @@
+"""
+モデルごとのパラメータ
+
+MODEL_PARAM, PHYSARUM_PARAM, LATTICECELL_PARAM (lib/setting.py) はモジュールの辞書で、
+書き換えるとそれ以降に作る全てのモデルに影響する。
+ModelParams はこれらのコピーに値を上書きしたものをモデルごとに持ち、
+WuPhysarum(params=...) に与えると、ステージの作成・拡散処理・エージェント (Physarum) まで同じ値で実行する。
+乱数生成器もモデルごとに持つため、同じプロセス内でパラメータの異なるモデルを並べて（交互にステップして）
+実行しても、どのエンジンでも各モデルを単独で実行した場合と同じ結果になる（パラメータスイープは lib/sweep.py を参照）。
+
+パラメータ名は3つの辞書で重複しないため、上書きする値は辞書を区別せずに名前で指定する。
+- ステージのパラメータ (STAGE_KEYS):  ステージ・データポイント周辺の配列・拡散処理の前計算が変わる
+                                       （WuPhysarumPrototype を共有できるのはこれらが同じモデルのみ）
+- エージェントのパラメータ (それ以外): エージェントの配置・処理のみが変わる
+
+# 使用例
+params = ModelParams(WT=0.3, RT=20, dampN=0.1)
+model = WuPhysarum(datapoint_filename="demo.json", seed=1, params=params)
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from .setting import LATTICECELL_PARAM, MODEL_PARAM, PHYSARUM_PARAM
+
+
+# 値を変えるとステージ・拡散処理の前計算が変わるパラメータ
+STAGE_KEYS = ("width", "height") + tuple(LATTICECELL_PARAM)
+
+# センサーと移動先の位置の名前
+SENSORS = ("LSENSOR", "RSENSOR", "FORWARD")
+
+
+@lru_cache(maxsize=None)
+def sensor_offset(sensor_arm_length):
+    """
+    dir_idごとのセンサー (LSENSOR, RSENSOR) と移動先 (FORWARD) の位置のずれを返す
+    （sensor_arm_lengthごとに1度だけ作る。返す辞書は変更しないこと）
+    """
+    offset = sensor_arm_length // 2
+    return {
+        # [offset of x, offset of y]
+        # under-left is [0, 0]
+
+        # NORTH
+        0: {"LSENSOR": [-offset, offset],
+            "RSENSOR": [offset, offset],
+            "FORWARD": [0, 1]},
+        # NORTH_EAST
+        1: {"LSENSOR": [0, offset],
+            "RSENSOR": [offset, 0],
+            "FORWARD": [1, 1]},
+        # EAST
+        2: {"LSENSOR": [offset, offset],
+            "RSENSOR": [offset, -offset],
+            "FORWARD": [1, 0]},
+        # SOUTH_EAST
+        3: {"LSENSOR": [offset, 0],
+            "RSENSOR": [0, -offset],
+            "FORWARD": [1, -1]},
+        # SOUTH
+        4: {"LSENSOR": [offset, -offset],
+            "RSENSOR": [-offset, -offset],
+            "FORWARD": [0, -1]},
+        # SOUTH_WEST
+        5: {"LSENSOR": [0, -offset],
+            "RSENSOR": [-offset, 0],
+            "FORWARD": [-1, -1]},
+        # WEST
+        6: {"LSENSOR": [-offset, -offset],
+            "RSENSOR": [-offset, offset],
+            "FORWARD": [-1, 0]},
+        # NORTH_WEST
+        7: {"LSENSOR": [-offset, 0],
+            "RSENSOR": [0, offset],
+            "FORWARD": [-1, 1]},
+    }
+
+
+@lru_cache(maxsize=None)
+def sensor_offset_array(sensor_arm_length):
+    """
+    sensor_offset をdir_idで引ける配列にしたもの (shape: (8, 3, 2), 2軸目は LSENSOR, RSENSOR, FORWARD)
+    （読み取り専用）
+    """
+    offset = sensor_offset(sensor_arm_length)
+    array = np.array([[offset[d][sensor] for sensor in SENSORS] for d in range(8)], dtype=np.int64)
+    array.setflags(write=False)
+    return array
+
+
+class ModelParams:
+    """
+    MODEL_PARAM, PHYSARUM_PARAM, LATTICECELL_PARAM のコピーに値を上書きした、モデルごとのパラメータ
+
+    model, physarum, lattice はそれぞれ MODEL_PARAM, PHYSARUM_PARAM, LATTICECELL_PARAM と同じ形の辞書。
+    作った時点の lib/setting.py の値をコピーするので、以降に辞書を書き換えても影響しない。
+    """
+    def __init__(self, **overrides):
+        self.model = dict(MODEL_PARAM)
+        self.physarum = dict(PHYSARUM_PARAM)
+        self.lattice = dict(LATTICECELL_PARAM)
+        self.__update(overrides)
+
+    def __update(self, overrides):
+        for key, value in overrides.items():
+            for group in (self.model, self.physarum, self.lattice):
+                if key in group:
+                    group[key] = value
+                    break
+            else:
+                raise ValueError("unknown parameter: {}".format(key))
+
+    def replace(self, **overrides):
+        """
+        値を上書きしたコピーを返す
+        """
+        params = ModelParams()
+        params.model, params.physarum, params.lattice = dict(self.model), dict(self.physarum), dict(self.lattice)
+        params.__update(overrides)
+        return params
+
+    def as_dict(self):
+        """
+        全てのパラメータを1つの辞書として返す
+        """
+        return {**self.model, **self.physarum, **self.lattice}
+
+    def stage_key(self):
+        """
+        ステージのパラメータ (STAGE_KEYS) の値の組（同じであれば WuPhysarumPrototype を共有できる）
+        """
+        values = self.as_dict()
+        return tuple((key, values[key]) for key in STAGE_KEYS)
+
+    @property
+    def offset(self):
+        return sensor_offset(self.physarum["sensor_arm_length"])
+
+    @property
+    def offset_array(self):
+        return sensor_offset_array(self.physarum["sensor_arm_length"])
+
+    def __eq__(self, other):
+        return isinstance(other, ModelParams) and self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        # 辞書のキー・集合の要素にした後は値を書き換えないこと
+        return hash(tuple(sorted(self.as_dict().items())))
+
+    def __repr__(self):
+        defaults = ModelParams().as_dict()
+        changed = ", ".join("{}={!r}".format(key, value) for key, value in self.as_dict().items()
+                            if defaults[key] != value)
+        return "ModelParams({})".format(changed)
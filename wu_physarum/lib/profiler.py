@@ -0,0 +1,91 @@
+"""
+WuPhysarumのステップ処理の計測
+
+StepProfilerをモデルに渡すと、ステップごとに各処理の所要時間（秒）と
+移動・増殖・消滅の回数を集計し、1ステップ1行の記録として保持する。
+エージェントごとの処理時間は呼び出しごとには記録せず、ステップ単位で合計する。
+
+# 計測する処理
+WuPhysarum.step:  agents（エージェントの処理全体）, lattice（格子セルの更新）, convergence（収束判定）, network（ネットワーク抽出）
+エージェント:     sense, turn, move, reproduce（engine="vector" のみ。engine="mesa", "jit" では agents に含める）
+ModelRecorder:    record（画像・軌跡の保存依頼）
+# 計数する値
+moves, failed_moves, births, deaths, agent_count
+
+# 使用例
+model = WuPhysarum(datapoint_filename="demo.json", seed=1, profiler=True)
+for _ in range(100):
+    model.step()
+model.profiler.dump_csv("profile.csv")
+print(model.profiler.summary())
+"""
+
+import csv
+import json
+import time
+from collections import defaultdict
+
+
+PHASES = ("agents", "sense", "turn", "move", "reproduce", "lattice", "convergence", "network", "record")
+COUNTERS = ("moves", "failed_moves", "births", "deaths")
+
+
+class StepProfiler:
+    def __init__(self, callback=None):
+        """
+        Args:
+            callback: ステップごとの記録 (dict) を受け取る関数（省略可）
+        """
+        self.callback = callback
+        self.records = []
+        self.__times = defaultdict(float)
+        self.__counts = defaultdict(int)
+
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+    def add_time(self, phase, seconds):
+        self.__times[phase] += seconds
+
+    def count(self, name, n=1):
+        self.__counts[name] += int(n)
+
+    def end_step(self, step, agent_count):
+        """
+        1ステップ分の集計を記録として確定する
+        """
+        record = {"step": step, "agent_count": agent_count}
+        record.update({phase: self.__times[phase] for phase in PHASES})
+        record.update({name: self.__counts[name] for name in COUNTERS})
+        self.records.append(record)
+        self.__times.clear()
+        self.__counts.clear()
+        if self.callback is not None:
+            self.callback(record)
+        return record
+
+    def summary(self):
+        """
+        全ステップの合計を返す
+        """
+        total = {key: 0 for key in PHASES + COUNTERS}
+        for record in self.records:
+            for key in total:
+                total[key] += record[key]
+        total["steps"] = len(self.records)
+        return total
+
+    @property
+    def fieldnames(self):
+        return ["step", "agent_count", *PHASES, *COUNTERS]
+
+    def dump_csv(self, filename):
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def dump_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump({"records": self.records, "summary": self.summary()}, f, indent=4)
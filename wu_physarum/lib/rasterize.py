@@ -0,0 +1,110 @@
+"""
+座標の組を二次元配列に変換する（データポイント領域の作成など）
+
+いずれの関数も座標を配列としてまとめて扱い、グリッドのセル数や座標数によらず
+fancy indexingで一度に書き込む
+"""
+
+import numpy as np
+
+from .setting import MODEL_PARAM, LATTICECELL_PARAM
+
+
+def _grid_size(width, height):
+    return (MODEL_PARAM["width"] if width is None else width,
+            MODEL_PARAM["height"] if height is None else height)
+
+
+def _as_points(points):
+    points = np.asarray(points, dtype=np.float64)
+    return points.reshape(-1, points.shape[-1] if points.ndim > 1 else 2)
+
+
+def coords2ndarray(coords, width=None, height=None):
+    """
+    プロットされる点の座標のみが入っている二次元配列を、
+    プロットされる点の座標の要素が1となっている二次元配列に変換する
+    （グリッドの外の座標は無視する）
+
+    入力：((0, 0), (1, 1)) ※1に指定されている座標が(0, 0)と(1, 1)だと解釈
+    出力：np.array([[1, 0],
+                    [0, 1]])
+    """
+    width, height = _grid_size(width, height)
+    array = np.zeros((width, height), dtype=bool)
+    if len(coords) == 0:
+        return array
+    coords = _as_points(coords)[:, :2].astype(np.int64)
+    x, y = coords[:, 0], coords[:, 1]
+    is_inside = (0 <= x) & (x < width) & (0 <= y) & (y < height)
+    array[x[is_inside], y[is_inside]] = True
+    return array
+
+
+def _neighbourhood(points, width, height, radius):
+    """
+    各点の周辺 (2 * radius + 1) × (2 * radius + 1) セルの座標を返す
+
+    出力：(x座標, y座標, 元の点の番号) の配列の組（グリッド外のセルは除く）
+          同じ点から作られたセルは連続し、点の順に並ぶ
+    """
+    points = _as_points(points)
+    offset = np.arange(-radius, radius + 1)
+    dx, dy = np.meshgrid(offset, offset, indexing="ij")
+    x = (points[:, 0, None].astype(np.int64) + dx.ravel()).ravel()
+    y = (points[:, 1, None].astype(np.int64) + dy.ravel()).ravel()
+    index = np.repeat(np.arange(len(points)), dx.size)
+    is_inside = (0 <= x) & (x < width) & (0 <= y) & (y < height)
+    return x[is_inside], y[is_inside], index[is_inside]
+
+
+def datapoint_cells(points, width=None, height=None, radius=1):
+    """
+    各データポイントの周辺 radius セル以内のセルの座標を返す（datapoint_region の1のセル）
+
+    出力：(x座標, y座標, 元の点の番号) の配列の組（同じ点のセルは連続し、点の順に並ぶ）
+    """
+    width, height = _grid_size(width, height)
+    if len(points) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    return _neighbourhood(points, width, height, radius)
+
+
+def datapoint_region(points, width=None, height=None, radius=1):
+    """
+    各データポイントの周辺 radius セル以内を1とする二次元配列を返す
+    """
+    width, height = _grid_size(width, height)
+    region = np.zeros((width, height), dtype=bool)
+    if len(points) == 0:
+        return region
+    x, y, _ = _neighbourhood(points, width, height, radius)
+    region[x, y] = True
+    return region
+
+
+def datapoint_intensity(points, width=None, height=None, radius=1, intensity=None):
+    """
+    各データポイントの周辺 radius セル以内に、そのデータポイントの強度を書き込んだ二次元配列を返す
+
+    強度は intensity (点ごとの配列), 各点の3番目の値, LATTICECELL_PARAM["CN"] の順に優先する。
+    複数のデータポイントの周辺が重なるセルには、後ろにある点の強度を書き込む。
+    """
+    width, height = _grid_size(width, height)
+    intensity_map = np.zeros((width, height))
+    if len(points) == 0:
+        return intensity_map
+    points = _as_points(points)
+    if intensity is None:
+        intensity = points[:, 2] if points.shape[1] >= 3 else np.full(len(points), LATTICECELL_PARAM["CN"])
+    intensity = np.broadcast_to(np.asarray(intensity, dtype=np.float64), (len(points),))
+
+    x, y, index = _neighbourhood(points, width, height, radius)
+    # fancy indexingでは重複した添字への書き込み順が保証されないため、
+    # 各セルについて最後に書き込まれるもののみを残す
+    cell = x * height + y
+    _, last = np.unique(cell[::-1], return_index=True)
+    last = len(cell) - 1 - last
+    intensity_map[x[last], y[last]] = intensity[index[last]]
+    return intensity_map
@@ -4,7 +4,7 @@ ModelRecorder
 # 役割
 ModelRecorderを通してモデルを実行することで、
 一定の間隔（ステップ）ごとにシミュレーションの
-出力を画像として保存することができる
+出力を画像、もしくは軌跡ファイルとして保存することができる
 
 # 使用例
 recorder = ModelRecorder(
@@ -14,6 +14,9 @@ recorder = ModelRecorder(
     figure_foldername="output_fig/twelve_ring/seed_13647",  # 画像を保存するディレクトリ名
     max_iteration=20000,                                   # 最大試行回数
     record_interval=200,                                   # 画像を保存する間隔（ステップ）
+    model_params={"engine": "vector"},                     # モデルに与える追加の引数（省略可）
+    renderer="thread",                                     # 画像の描画方法 sync/thread/process（省略可）
+    image_format="apng",                                   # 画像の形式（省略時は matplotlib の step_*.png）
 )
 
 recorder.start()
@@ -21,18 +24,37 @@ recorder.start()
 """
 
 import os
+import json
 import time
 import shutil
+import tempfile
 from pathlib import Path
 
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-from wu_physarum.lib.setting import MODEL_PARAM
+from wu_physarum.lib.checkpoint import checkpoint_filename, latest_checkpoint, prune_checkpoints
+from wu_physarum.lib.frame import FRAME_FORMATS, FrameRenderer, create_frame_writer
+from wu_physarum.lib.render import SnapshotRenderer, snapshot_arrays
+from wu_physarum.lib.trajectory import TrajectoryWriter
 
 path = Path(__file__).parent.parent
 
+COMPLETED_MARKER = ".completed"  # 最後まで実行を終えたことを示すファイル（figure_foldername内に作成）
+
+
+def atomic_copy(src, dst_dir):
+    """
+    srcをdst_dirへコピーする。
+    一時ファイルへ書き込んでから置き換えるため、
+    複数プロセスが同じファイルを同時にコピーしても中途半端な内容が見えることはない
+    """
+    fd, tmp = tempfile.mkstemp(dir=dst_dir, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f, open(src, "rb") as g:
+            shutil.copyfileobj(g, f)
+        os.replace(tmp, os.path.join(dst_dir, os.path.basename(src)))
+    except BaseException:
+        os.remove(tmp)
+        raise
+
 
 class ModelRecorder:
     def __init__(
@@ -44,16 +66,81 @@ class ModelRecorder:
             meta_foldername,
             max_iteration,
             record_interval,
+            model_params=None,
+            progress=None,
+            renderer="thread",
+            render_workers=1,
+            max_pending_render=8,
+            output="png",
+            trajectory_options=None,
+            checkpoint_interval=None,
+            keep_checkpoints=2,
+            image_format="matplotlib",
+            frame_options=None,
     ):
+        """
+        Args:
+            model_params: モデルに与える追加の引数 (dict)
+            progress: 進捗を受け取る関数 progress(step, max_iteration, elapsed_sec)
+                      省略時は標準出力に進捗を上書き表示する
+            renderer: 画像の描画方法 "sync", "thread", "process" (lib/render.py を参照)
+            render_workers: 描画に使うスレッド・プロセス数
+            max_pending_render: 描画待ちにできるスナップショット数の上限
+            output: 保存する内容
+                "png"        -> スナップショットの画像（従来通り）
+                "trajectory" -> chenu_map, trail_map, エージェントの状態を
+                                figure_foldername/trajectory に軌跡ファイルとして保存する (lib/trajectory.py を参照)
+                "both"       -> 両方
+            trajectory_options: TrajectoryWriterに与える引数 (chunk_bytes, field_dtype, compress)
+            checkpoint_interval: チェックポイントを保存する間隔（ステップ）。Noneの場合は保存しない
+                                 figure_foldername/checkpoint にチェックポイントがあれば、
+                                 start() は最新のチェックポイントから再開する
+            keep_checkpoints: 残しておくチェックポイントの数
+            image_format: スナップショットの画像の形式
+                "matplotlib" -> render_snapshot (seaborn) で step_{ステップ}.png を保存する（従来通り）
+                "png", "apng", "gif", "raw" -> lib/frame.py の FrameRenderer で描画する
+                    （matplotlibを使わないため1枚数ミリ秒で描画できる。フレームの順序を保つため
+                      描画は1スレッドで行い、renderer="process" はスレッドとして扱う）
+            frame_options: FrameRenderer に与える引数（FRAME_PARAM の値を上書きする）
+        """
+        if output not in ("png", "trajectory", "both"):
+            raise ValueError("output must be 'png', 'trajectory' or 'both': {}".format(output))
+        if image_format != "matplotlib" and image_format not in FRAME_FORMATS:
+            raise ValueError("image_format must be 'matplotlib' or one of {}: {}".format(FRAME_FORMATS, image_format))
         self.model = model(
             datapoint_filename=datapoint_filename,
             seed=seed,
+            **(model_params or {}),
         )
         self.datapoint_filename = datapoint_filename
         self.figdir_name = figure_foldername
         self.metadir_name = meta_foldername
         self.max_iter = max_iteration
         self.interval = record_interval
+        self.progress = progress
+        self.output = output
+        self.trajectory_options = trajectory_options or {}
+        self.trajectory = None
+        self.checkpoint_interval = checkpoint_interval
+        self.keep_checkpoints = keep_checkpoints
+        self.checkpoint_dir = os.path.join(figure_foldername, "checkpoint")
+        self.image_format = image_format
+        self.frame_renderer = None
+        self.frame_writer = None
+        if image_format == "matplotlib":
+            self.renderer = SnapshotRenderer(
+                mode=renderer,
+                workers=render_workers,
+                max_pending=max_pending_render,
+            )
+        else:
+            self.frame_renderer = FrameRenderer(**(frame_options or {}))
+            self.renderer = SnapshotRenderer(
+                mode="sync" if renderer == "sync" else "thread",
+                workers=1,
+                max_pending=max_pending_render,
+                render=self.__writeFrame,
+            )
         self.start_time = None
 
     def __startTimer(self):
@@ -64,65 +151,138 @@ class ModelRecorder:
 
     def __makeMetaDir(self):
         os.makedirs(self.metadir_name, exist_ok=True)
-        os.path.join(path, 'resource', self.datapoint_filename)
-        shutil.copy(os.path.join(path, 'resource', self.datapoint_filename), self.metadir_name)  # データポイントファイルの保存
-        shutil.copy(os.path.join(path, 'lib', 'setting.py'), self.metadir_name)
-        shutil.copy(os.path.join(path, 'agent.py'), self.metadir_name)
-        shutil.copy(os.path.join(path, 'model.py'), self.metadir_name)
+        atomic_copy(os.path.join(path, 'resource', self.datapoint_filename), self.metadir_name)  # データポイントファイルの保存
+        atomic_copy(os.path.join(path, 'lib', 'setting.py'), self.metadir_name)
+        atomic_copy(os.path.join(path, 'agent.py'), self.metadir_name)
+        atomic_copy(os.path.join(path, 'vector_agent.py'), self.metadir_name)
+        atomic_copy(os.path.join(path, 'model.py'), self.metadir_name)
+
+    @property
+    def is_completed(self):
+        return os.path.exists(os.path.join(self.figdir_name, COMPLETED_MARKER))
+
+    def __markCompleted(self):
+        monitor = self.model.convergence_monitor
+        analyzer = getattr(self.model, "network_analyzer", None)
+        if analyzer is not None:
+            # 解の質の時間変化を保存する
+            analyzer.dump_csv(os.path.join(self.figdir_name, "network.csv"))
+        with open(os.path.join(self.figdir_name, COMPLETED_MARKER), "w") as f:
+            json.dump({
+                "steps": self.model.schedule.steps,
+                "stop_step": monitor.stop_step if monitor is not None else None,
+                "stop_reason": monitor.stop_reason if monitor is not None else None,
+                "network": analyzer.history[-1] if analyzer is not None and analyzer.history else None,
+            }, f, indent=4)
+
+    def __openTrajectory(self, resume_step):
+        if self.output in ("trajectory", "both"):
+            self.trajectory = TrajectoryWriter(
+                os.path.join(self.figdir_name, "trajectory"),
+                width=self.model.chenu_map.shape[0],
+                height=self.model.chenu_map.shape[1],
+                resume_step=resume_step,
+                **self.trajectory_options,
+            )
+
+    def __openFrameWriter(self, resume_step):
+        if self.frame_renderer is not None and self.output in ("png", "both"):
+            self.frame_writer = create_frame_writer(
+                self.image_format,
+                self.figdir_name,
+                self.frame_renderer.palette,
+                fps=self.frame_renderer.params["fps"],
+                compress_level=self.frame_renderer.params["compress_level"],
+                resume_step=resume_step,
+            )
+
+    def __writeFrame(self, step, arr, chenu_map, trail_map):
+        self.frame_writer.write(step, self.frame_renderer.render(arr, chenu_map, trail_map))
+
+    def __resumeFromCheckpoint(self):
+        """
+        最新のチェックポイントがあればモデルを復元し、再開するステップを返す
+        """
+        if self.checkpoint_interval is None:
+            return None
+        filename = latest_checkpoint(self.checkpoint_dir)
+        if filename is None:
+            return None
+        self.model.load_checkpoint(filename)
+        print("チェックポイントから再開: {}".format(filename))
+        return self.model.schedule.steps
+
+    def __saveCheckpoint(self):
+        # チェックポイントより前の出力が欠けないよう、描画と軌跡の書き込みを済ませてから保存する
+        self.renderer.flush()
+        if self.frame_writer is not None:
+            self.frame_writer.flush()
+        if self.trajectory is not None:
+            self.trajectory.flush()
+        self.model.save_checkpoint(checkpoint_filename(self.checkpoint_dir, self.model.schedule.steps))
+        prune_checkpoints(self.checkpoint_dir, self.keep_checkpoints)
+
+    def __record(self):
+        if self.output in ("png", "both"):
+            # 状態をコピーして描画を依頼し、描画の完了を待たずにシミュレーションを進める
+            if self.frame_writer is not None:
+                self.renderer.submit(self.model.schedule.steps, *snapshot_arrays(self.model))
+            else:
+                self.renderer.submit(
+                    "{}/step_{}.png".format(self.figdir_name, self.model.schedule.steps),
+                    *snapshot_arrays(self.model),
+                )
+        if self.trajectory is not None:
+            self.trajectory.write(
+                self.model.schedule.steps,
+                self.model.chenu_map,
+                self.model.trail_map,
+                self.model.agent_state(),
+            )
 
     def start(self):
         self.__makeFigDir()
         self.__makeMetaDir()
+        resume_step = self.__resumeFromCheckpoint()
+        self.__openTrajectory(resume_step)
+        self.__openFrameWriter(resume_step)
         self.__startTimer()
 
-        for step in range(self.max_iter + 1):
+        for step in range(resume_step or 0, self.max_iter + 1):
+            if self.checkpoint_interval is not None and step % self.checkpoint_interval == 0 \
+                    and step != resume_step:
+                self.__saveCheckpoint()
+
             if step % self.interval == 0:
-                """
-                arr配列の各値の割り当て
-
-                datapoint       -> 2
-                非datapoint     -> 1
-                モジホコリセル  -> 0
-                """
-                arr = np.array(
-                    [[self.model.grid.grid[i][j] is None for j in range(MODEL_PARAM["height"])] for i in
-                     range(MODEL_PARAM["width"])]
-                )
-                arr = np.maximum(arr, self.model.datapoint_region * 2)
-
-                fig, ((phys, _), (chenu, trail)) = plt.subplots(2, 2, sharex=True, sharey=True)
-                sns.heatmap(
-                    arr.T,
-                    square=True,
-                    cmap="viridis",
-                    ax=phys
-                ).invert_yaxis()
-                sns.heatmap(
-                    self.model.chenu_map.T,
-                    cbar=True,
-                    square=True,
-                    cmap="viridis",
-                    ax=chenu
-                ).invert_yaxis()
-                sns.heatmap(
-                    self.model.trail_map.T,
-                    cbar=True,
-                    square=True,
-                    cmap="viridis",
-                    vmin=0,
-                    vmax=12,
-                    ax=trail
-                ).invert_yaxis()
-                phys.set_title("physarum & datapoint map")
-                chenu.set_title("chemo nutrient map")
-                trail.set_title("trail map")
-
-                fig.savefig("{}/step_{}.png".format(self.figdir_name, self.model.schedule.steps))
-                plt.clf()
-                plt.close()
+                profiler = self.model.profiler
+                if profiler is None:
+                    self.__record()
+                else:
+                    t_start = profiler.now()
+                    self.__record()
+                    profiler.add_time("record", profiler.now() - t_start)
 
             t = time.time() - self.start_time
-            print("\r{}/{} step ({:.2f} sec)".format(step, self.max_iter, t), end="")
+            if self.progress is None:
+                print("\r{}/{} step ({:.2f} sec)".format(step, self.max_iter, t), end="")
+            else:
+                self.progress(step, self.max_iter, t)
 
             self.model.step()
-        print("")
+
+            # モデルが収束した場合は、最後の状態を記録して終了する
+            if not self.model.running:
+                # このステップ後の状態はまだ記録していない（ループの先頭の記録は model.step() の前）
+                self.__record()
+                monitor = self.model.convergence_monitor
+                if monitor is not None and monitor.is_converged:
+                    print("\n{} stepで収束: {}".format(monitor.stop_step, monitor.stop_reason))
+                break
+        self.renderer.close()
+        if self.frame_writer is not None:
+            self.frame_writer.close()
+        if self.trajectory is not None:
+            self.trajectory.close()
+        if self.progress is None:
+            print("")
+        self.__markCompleted()
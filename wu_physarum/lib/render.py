@@ -0,0 +1,117 @@
+"""
+ModelRecorderのスナップショット画像の描画
+
+描画はシミュレーションのループとは別のスレッド、もしくはプロセスで行うことができる。
+（pyplotのグローバルな状態を使わず、Figureを直接作るためスレッドからも安全に呼び出せる）
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+
+def render_snapshot(filename, arr, chenu_map, trail_map):
+    """
+    エージェント・データポイントの配置 arr, chenu_map, trail_map を
+    seabornのヒートマップとして1枚の画像に描画し、filenameに保存する
+    """
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    fig = Figure()
+    ((phys, _), (chenu, trail)) = fig.subplots(2, 2, sharex=True, sharey=True)
+    sns.heatmap(
+        arr.T,
+        square=True,
+        cmap="viridis",
+        ax=phys
+    ).invert_yaxis()
+    sns.heatmap(
+        chenu_map.T,
+        cbar=True,
+        square=True,
+        cmap="viridis",
+        ax=chenu
+    ).invert_yaxis()
+    sns.heatmap(
+        trail_map.T,
+        cbar=True,
+        square=True,
+        cmap="viridis",
+        vmin=0,
+        vmax=12,
+        ax=trail
+    ).invert_yaxis()
+    phys.set_title("physarum & datapoint map")
+    chenu.set_title("chemo nutrient map")
+    trail.set_title("trail map")
+
+    fig.savefig(filename)
+    return filename
+
+
+def snapshot_arrays(model):
+    """
+    描画に必要な配列をモデルからコピーする
+
+    arr配列の各値の割り当て
+
+    datapoint       -> 2
+    非datapoint     -> 1
+    モジホコリセル  -> 0
+    """
+    arr = np.maximum(~model.occupancy_map, model.datapoint_region * 2)
+    return arr, model.chenu_map.copy(), model.trail_map.copy()
+
+
+class SnapshotRenderer:
+    """
+    スナップショットの描画を受け付け、バックグラウンドで画像を保存する
+
+    mode:
+        "sync"    -> submitの呼び出し内で描画する（従来通り）
+        "thread"  -> スレッドプールで描画する
+        "process" -> プロセスプールで描画する
+    max_pending: 描画待ちのスナップショット数の上限。
+                 上限に達するとsubmitは描画が終わるまで待つため、メモリ使用量が一定以下に保たれる
+    """
+    def __init__(self, mode="thread", workers=1, max_pending=8, render=render_snapshot):
+        if mode not in ("sync", "thread", "process"):
+            raise ValueError("mode must be 'sync', 'thread' or 'process': {}".format(mode))
+        self.mode = mode
+        self.render = render
+        self.__slots = threading.BoundedSemaphore(max_pending)
+        self.__futures = []
+        self.__executor = None
+        if mode == "thread":
+            self.__executor = ThreadPoolExecutor(max_workers=workers)
+        elif mode == "process":
+            self.__executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, *args):
+        if self.__executor is None:
+            self.render(*args)
+            return
+        self.__slots.acquire()
+        future = self.__executor.submit(self.render, *args)
+        future.add_done_callback(lambda _: self.__slots.release())
+        self.__futures.append(future)
+        # 描画が終わったものは保持しない（例外はflushで送出する）
+        self.__futures = [f for f in self.__futures if not f.done() or f.exception() is not None]
+
+    def flush(self):
+        """
+        受け付けた描画がすべて終わるまで待つ。描画中に発生した例外はここで送出する
+        """
+        futures, self.__futures = self.__futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+                self.__executor = None
@@ -23,7 +23,101 @@ LATTICECELL_PARAM = {
     "filterT_height": 3,     # The height of mean filter for trail
 
     "CN": 10,                # The chemo-nutrient concentration of each Node
+    "datapoint_radius": 1,   # The radius of the region around each Node where
+                             # chemo-nutrient is added
     "dampN": 0.2,            # Diffusion damping factor of chemo-nutrient
     "filterN_width": 5,      # The width of mean filter for chemo-nutrient
     "filterN_height": 5,     # The height of mean filter for chemo-nutrient
 }
+
+CONVERGENCE_PARAM = {
+    "check_interval": 50,    # The interval (steps) between convergence checks
+    "window": 5,             # The number of consecutive checks that must satisfy
+                             # the tolerance
+    "min_steps": 500,        # Convergence is not judged before this step
+    "criteria": ("trail", "agents"),  # The statistics used for judgement
+                             # ("trail", "agents", "occupancy")
+    "tolerance": {
+        "trail": 0.01,       # The relative change of the trail_map norm
+        "agents": 0.01,      # The relative change of the agent count
+        "occupancy": 0.05,   # The fraction of occupied cells that changed
+    },
+}
+
+SPARSE_DIFFUSION_PARAM = {
+    "tile_size": 16,         # The size of each tile (cells) tracked as active
+                             # or inactive by the "sparse" diffusion backend
+    "threshold": 1e-6,       # Tiles whose max value is at most this value are
+                             # regarded as zero (0.0: same as the dense backends
+                             # up to floating point rounding)
+}
+
+CHENU_CACHE_PARAM = {
+    "dirname": None,         # The cache directory (None: ~/.cache/wu_physarum/chenu)
+    "max_bytes": 1 << 30,    # The total size of cached files; the least
+                             # recently used entries are evicted beyond this
+    "max_transient_bytes": 256 << 20,  # The transient chenu_map series is
+                             # cached only if it fits in this size
+    "max_steps": 2000,       # The chenu_map is regarded as steady after this
+                             # step even if it has not reached a fixed point
+    "tolerance": 0.0,        # The max change of chenu_map regarded as steady
+                             # (0.0: exact fixed point)
+}
+
+DATAPOINT_PARAM = {
+    "cache": True,           # Whether parsed JSON/CSV datapoint files are cached
+                             # as .npy files keyed by the hash of the file
+    "cache_dirname": None,   # The cache directory (None: ~/.cache/wu_physarum/datapoint)
+}
+
+NETWORK_PARAM = {
+    "interval": 100,         # The interval (steps) between network analyses
+    "threshold": 3.0,        # The trail value regarded as a part of the network
+    "use_occupancy": False,  # Whether cells occupied by agents are also
+                             # regarded as a part of the network
+    "node_radius": 3,        # The radius of the region around each datapoint
+                             # regarded as the node of the network
+    "exact_tour_limit": 12,  # The max number of datapoints for which the
+                             # optimal tour is solved exactly (Held-Karp)
+    "heuristic_tour_limit": 2000,  # The max number of datapoints for which a
+                             # 2-opt tour is used instead (above: no tour_ratio)
+}
+
+KNAPSACK_PARAM = {
+    # The knapsack problem solved on each datapoint file (same as solver.py).
+    # The datapoint `root` is the center of the star stage, and the other
+    # datapoints are the items in order.
+    "knapsack6_R5_center8.json": {
+        "root": 0,
+        "weights": [10, 12, 7, 9, 21, 16],
+        "values": [120, 130, 80, 100, 250, 185],
+        "capacity": 60,
+    },
+}
+
+STREAM_PARAM = {
+    "fields": ("occupancy", "trail", "chenu"),  # The maps sent to the browser
+    "downsample": 1,         # Each block of downsample x downsample cells is
+                             # sent as one pixel (occupancy: any, maps: mean)
+    "trail_vmax": 12.0,      # The trail value shown as the brightest color
+    "chenu_vmax": None,      # The chenu value shown as the brightest color
+                             # (None: the max of each frame)
+    "compress_level": 1,     # The PNG compression level (0-9)
+    "max_fps": 10,           # The max number of frames sent per second
+    "max_steps_per_frame": 50,  # The max number of steps between two frames
+    "canvas_size": 500,      # The size of each canvas in the browser (pixel)
+}
+
+FRAME_PARAM = {
+    "fields": ("occupancy", "chenu", "trail"),  # The maps drawn in each frame
+    "columns": 3,            # The number of maps in a row of the frame
+    "scale": 2,              # Each cell is drawn as scale x scale pixels
+    "padding": 4,            # The space between the maps (pixel)
+    "colormap": "viridis",   # The colormap ("viridis", "gray" or a matplotlib one)
+    "background": (255, 255, 255),  # The color of the space between the maps
+    "chenu_vmax": None,      # The chenu value shown as the brightest color
+                             # (None: the max of each frame)
+    "trail_vmax": 12.0,      # The trail value shown as the brightest color
+    "fps": 10,               # The frame rate of the animation (apng, gif, raw)
+    "compress_level": 1,     # The PNG compression level (0-9)
+}
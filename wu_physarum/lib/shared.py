@@ -0,0 +1,110 @@
+"""
+プロセス間で共有するndarray
+
+- SharedArrays:   名前付きの共有メモリ上のndarrayの組（WuPhysarumTiled のワーカー間の共有に使う）
+- SharedArrayRef: 共有メモリ上（もしくはメモリマップしたファイル上）の配列への参照
+                  pickleすると配列の中身ではなく参照先だけを送り、unpickleした側では同じメモリを
+                  読み取り専用の配列として開く（WuPhysarumPrototype.share を参照）
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+    """
+    名前付きの共有メモリ上のndarrayの組
+
+    親プロセスは create=True で確保し、ワーカーは spec (名前, shape, dtype) から同じ配列を開く。
+    """
+    def __init__(self, spec, create=False):
+        self.spec = spec
+        self.__blocks = {}
+        self.arrays = {}
+        for name, (shm_name, shape, dtype) in spec.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if create:
+                block = shared_memory.SharedMemory(create=True, size=size)
+                self.spec[name] = (block.name, shape, dtype)
+            else:
+                block = shared_memory.SharedMemory(name=shm_name)
+            self.__blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            if create:
+                self.arrays[name][...] = 0
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self, unlink=False):
+        self.arrays.clear()
+        for block in self.__blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # 呼び出し側がまだビューを持っている場合は、解放時に閉じられる
+                pass
+            if unlink:
+                block.unlink()
+        self.__blocks.clear()
+
+
+# このプロセスで開いた共有メモリ・メモリマップ（開いた配列が使われている間は閉じない）
+_ATTACHED = {}
+
+
+def _open_source(source):
+    """
+    sourceのバイト列を uint8 の1次元配列として開く
+    """
+    if source not in _ATTACHED:
+        if source[0] == "shm":
+            _, shm_name, size = source
+            block = shared_memory.SharedMemory(name=shm_name)
+            _ATTACHED[source] = (block, np.ndarray((size,), dtype=np.uint8, buffer=block.buf))
+        else:
+            _, filename, offset, size = source
+            _ATTACHED[source] = (None, np.memmap(filename, dtype=np.uint8, mode="r", offset=offset, shape=(size,)))
+    return _ATTACHED[source][1]
+
+
+def attach_shared_array(source, shape, dtype, offset, strides):
+    """
+    SharedArrayRef の参照先を読み取り専用の配列として開く
+    """
+    array = np.ndarray(shape, dtype=dtype, buffer=_open_source(source), offset=offset, strides=strides)
+    array.setflags(write=False)
+    return array
+
+
+class SharedArrayRef:
+    """
+    source 上に置いた配列 root のうち、arrayが指す部分への参照
+
+    source: rootのバイト列の置き場所
+            ("shm", 共有メモリの名前, バイト数) もしくは ("file", ファイル名, ファイル内のオフセット, バイト数)
+    """
+    def __init__(self, source, root, array):
+        self.source = source
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.offset = array.__array_interface__["data"][0] - root.__array_interface__["data"][0]
+        self.strides = array.strides
+
+    def __reduce__(self):
+        return attach_shared_array, (self.source, self.shape, self.dtype, self.offset, self.strides)
+
+
+def write_raw(array, buffer):
+    """
+    メモリ上で連続した配列（ビューでない配列）を、メモリ上と同じバイト列の並びで buffer に書き込む
+    """
+    np.ndarray(array.shape, dtype=array.dtype, buffer=buffer, strides=array.strides)[...] = array
+
+
+def file_source(array):
+    """
+    メモリマップした配列 (np.memmap) のバイト列の置き場所を返す
+    """
+    return ("file", array.filename, array.offset, array.nbytes)
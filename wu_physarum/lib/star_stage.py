@@ -1,17 +1,22 @@
 from operator import add
 from math import sin, cos, radians
 
-from .convex_stage import convex_hull_inner
+import numpy as np
+
+from .convex_stage import convex_hull_mask
 
 
 class StarStage:
     """
     スター型のステージを作るための自作ライブラリ
+
+    ステージは (width, height) のnumpy.ndarrayとして保持し、
+    図形ごとにマスクを計算してまとめて書き込む
     """
     def __init__(self, width, height) -> None:
         self.width = width
         self.height = height
-        self.__stage = [[0 for j in range(self.height)] for i in range(self.width)]
+        self.__stage = np.zeros((self.width, self.height), dtype=np.uint8)
 
     def select(self, x: int, y: int) -> None:
         """
@@ -19,21 +24,24 @@ class StarStage:
         """
         self.__stage[x][y] = 1
 
-    def draw_circle(self, x: int, y: int, radius: int) -> None:
+    def select_mask(self, mask) -> None:
         """
-        (x, y) を中心とした半径 radius の円の領域内の値を1にセットする
+        maskが真となるセルの値を1にセットする
         """
-        for i in range(self.width):
-            for j in range(self.height):
-                if (i - x)**2 + (j - y)**2 <= radius**2:
-                    self.select(i, j)
+        self.__stage[np.asarray(mask, dtype=bool)] = 1
 
-    def draw_rect(self, x: int, y: int, offset: float, width: float, height: float, degree: float):
+    def circle_mask(self, x: int, y: int, radius: int):
         """
-        (x, y)を起点とし、そこから(r, θ) = (offset, degree)離れた場所を
-        最近接辺の中心とする幅width, 高さheightの長方形を作る
+        (x, y) を中心とした半径 radius の円の内部を真とするマスクを返す
         """
+        i, j = np.ogrid[:self.width, :self.height]
+        return (i - x)**2 + (j - y)**2 <= radius**2
 
+    def rect_mask(self, x: int, y: int, offset: float, width: float, height: float, degree: float):
+        """
+        (x, y)を起点とし、そこから(r, θ) = (offset, degree)離れた場所を
+        最近接辺の中心とする幅width, 高さheightの長方形の内部を真とするマスクを返す
+        """
         rad = radians(degree)
         midpoint = (x + offset * cos(rad), y + offset * sin(rad))
         vertex = [
@@ -44,14 +52,72 @@ class StarStage:
         ]
         # 整数化とタプル化
         vertex = tuple([tuple(map(round, v)) for v in vertex])
-        # vertexを反時計回りに並べ替える
-        inner_point = convex_hull_inner(vertex)
-        for i, j in inner_point:
-            self.select(i, j)
+        return convex_hull_mask(vertex, self.width, self.height)
+
+    def polygon_mask(self, vertex):
+        """
+        頂点 ((x_1, y_1), (x_2, y_2), ...) を順に結んだ多角形（凹多角形も可）の
+        内部を真とするマスクを返す（偶奇規則で判定し、辺上の格子点も含む）
+        """
+        vertex = np.asarray(vertex, dtype=np.float64).reshape(-1, 2)
+        i, j = np.ogrid[:self.width, :self.height]
+        inside = np.zeros((self.width, self.height), dtype=bool)
+        on_edge = np.zeros((self.width, self.height), dtype=bool)
+        for (x_1, y_1), (x_2, y_2) in zip(vertex, np.roll(vertex, -1, axis=0)):
+            # (i, j) から +x 方向に伸ばした半直線が辺と交わるか
+            crosses_y = (y_1 > j) != (y_2 > j)
+            if y_1 != y_2:
+                x_cross = x_1 + (j - y_1) * (x_2 - x_1) / (y_2 - y_1)
+                inside ^= crosses_y & (i < x_cross)
+            # 辺上の格子点
+            cross = (x_2 - x_1) * (j - y_1) - (y_2 - y_1) * (i - x_1)
+            on_edge |= (cross == 0) \
+                & (min(x_1, x_2) <= i) & (i <= max(x_1, x_2)) \
+                & (min(y_1, y_2) <= j) & (j <= max(y_1, y_2))
+        return inside | on_edge
+
+    def draw_circle(self, x: int, y: int, radius: int) -> None:
+        """
+        (x, y) を中心とした半径 radius の円の領域内の値を1にセットする
+        """
+        self.select_mask(self.circle_mask(x, y, radius))
+
+    def draw_rect(self, x: int, y: int, offset: float, width: float, height: float, degree: float):
+        """
+        (x, y)を起点とし、そこから(r, θ) = (offset, degree)離れた場所を
+        最近接辺の中心とする幅width, 高さheightの長方形を作る
+        """
+        self.select_mask(self.rect_mask(x, y, offset, width, height, degree))
+
+    def draw_polygon(self, vertex) -> None:
+        """
+        頂点 ((x_1, y_1), (x_2, y_2), ...) を順に結んだ多角形の領域内の値を1にセットする
+        """
+        self.select_mask(self.polygon_mask(vertex))
+
+    def union(self, other) -> "StarStage":
+        """
+        other (StarStage もしくは (width, height) の配列) の領域を加える
+        """
+        self.select_mask(self.__as_mask(other))
+        return self
+
+    def difference(self, other) -> "StarStage":
+        """
+        other (StarStage もしくは (width, height) の配列) の領域を取り除く
+        """
+        self.__stage[self.__as_mask(other)] = 0
+        return self
+
+    @staticmethod
+    def __as_mask(other):
+        if isinstance(other, StarStage):
+            other = other.stage_region
+        return np.asarray(other) != 0
 
     def __str__(self):
         print("cells are indexed by [x][y]")
-        return "\n".join(map(str, self.__stage))
+        return "\n".join(map(str, self.__stage.tolist()))
 
     @property
     def stage_region(self):
@@ -59,6 +125,6 @@ class StarStage:
         エージェント・誘因力の存在可能部分のみ1にマスクされた
         二次元配列を返す
 
-        return: self.__stage (list[int][int])
+        return: self.__stage (numpy.ndarray[width, height])
         """
         return self.__stage
@@ -0,0 +1,161 @@
+"""
+mesaの可視化サーバ向けのフレーム配信
+
+CanvasGrid はエージェントごとにJSONのdictを作って送るため、エージェント数が数万になると
+サーバ・ブラウザともに追いつかず、chenu_map, trail_map も表示できない。
+FrameStreamElement は occupancy, trail_map, chenu_map を uint8 の画像として（縮小したうえで）
+PNGに圧縮し、base64のデータURLとしてwebsocketで送る。
+
+FrameStreamServer はブラウザからステップを要求されるたびに、
+前回のフレームから 1 / max_fps 秒経つまで（最大 max_steps_per_frame ステップ）モデルを進めてから
+1フレームを送る。描画の頻度を抑えつつ、描画と独立にシミュレーションを進めることができる。
+
+# 使用例 (server.py を参照)
+server = FrameStreamServer(
+    model_cls=WuPhysarum,
+    visualization_elements=[FrameStreamElement()],
+    name="Wu's Physarum Model",
+    model_params={"datapoint_filename": "demo.json", "seed": 1},
+)
+server.launch()
+"""
+
+import io
+import os
+import json
+import time
+import base64
+
+import numpy as np
+import tornado.escape
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler, VisualizationElement
+
+from .setting import STREAM_PARAM
+
+
+JS_FILENAME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "js", "FrameStreamModule.js")
+
+
+def downsample(arr, factor, reduce=np.mean):
+    """
+    factor × factor セルごとにreduceでまとめた配列を返す（割り切れない端のセルは捨てる）
+    """
+    if factor == 1:
+        return arr
+    width, height = arr.shape[0] // factor, arr.shape[1] // factor
+    blocks = arr[:width * factor, :height * factor].reshape(width, factor, height, factor)
+    return reduce(blocks, axis=(1, 3))
+
+
+def to_uint8(arr, vmax=None):
+    """
+    0〜vmax (省略時は最大値) を 0〜255 に割り当てる
+    """
+    arr = np.asarray(arr, dtype=np.float64)
+    vmax = vmax if vmax is not None else arr.max()
+    if vmax <= 0:
+        return np.zeros(arr.shape, dtype=np.uint8)
+    return (np.clip(arr / vmax, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def encode_png(arr, compress_level=1):
+    """
+    [x, y] の配列を、左下を原点とするグレースケールのPNGのデータURLにする
+    """
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(np.flipud(arr.T))).save(buffer, format="PNG", compress_level=compress_level)
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def field_images(model, params):
+    """
+    params["fields"] の各マップを uint8 の配列にする
+
+    occupancy: モジホコリセル -> 255, データポイント -> 128, それ以外 -> 0
+    """
+    factor = params["downsample"]
+    images = {}
+    for field in params["fields"]:
+        if field == "occupancy":
+            arr = np.maximum(np.asarray(model.occupancy_map, dtype=np.uint8) * 255,
+                             np.asarray(model.datapoint_region, dtype=np.uint8) * 128)
+            images[field] = downsample(arr, factor, reduce=np.max).astype(np.uint8)
+        elif field == "trail":
+            images[field] = to_uint8(downsample(model.trail_map, factor), params["trail_vmax"])
+        elif field == "chenu":
+            images[field] = to_uint8(downsample(model.chenu_map, factor), params["chenu_vmax"])
+        else:
+            raise ValueError("unknown stream field: {}".format(field))
+    return images
+
+
+class FrameStreamElement(VisualizationElement):
+    local_includes = [os.path.relpath(JS_FILENAME)]
+
+    def __init__(self, **params):
+        """
+        Args:
+            params: STREAM_PARAM の値を上書きする
+        """
+        super().__init__()
+        unknown = set(params) - set(STREAM_PARAM)
+        if unknown:
+            raise ValueError("unknown stream parameter: {}".format(sorted(unknown)))
+        self.params = dict(STREAM_PARAM, **params)
+        self.js_code = "elements.push(new FrameStreamModule({}, {}));".format(
+            json.dumps(list(self.params["fields"])), self.params["canvas_size"])
+        self.steps_per_frame = None         # 直前のフレームまでに進めたステップ数（FrameStreamServerが設定する）
+
+    def render(self, model):
+        images = field_images(model, self.params)
+        return {
+            "step": model.schedule.steps,
+            "agents": model.agent_count,
+            "steps_per_frame": self.steps_per_frame,
+            "images": {field: encode_png(image, self.params["compress_level"]) for field, image in images.items()},
+        }
+
+
+class FrameStreamSocketHandler(SocketHandler):
+    def on_message(self, message):
+        """
+        get_step のみ、フレームの間隔に達するまで複数ステップ進めてから描画する
+        """
+        if tornado.escape.json_decode(message)["type"] != "get_step":
+            return super().on_message(message)
+        application = self.application
+        model = application.model
+        if not model.running:
+            self.write_message({"type": "end"})
+            return
+
+        interval = 1.0 / application.max_fps
+        steps = 0
+        while model.running and steps < application.max_steps_per_frame:
+            model.step()
+            steps += 1
+            if time.perf_counter() - application.last_frame_time >= interval:
+                break
+        for element in application.visualization_elements:
+            if isinstance(element, FrameStreamElement):
+                element.steps_per_frame = steps
+        self.write_message(self.viz_state_message)
+        application.last_frame_time = time.perf_counter()
+
+
+class FrameStreamServer(ModularServer):
+    socket_handler = (r"/ws", FrameStreamSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler, ModularServer.static_handler, ModularServer.local_handler]
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model", model_params={},
+                 max_fps=None, max_steps_per_frame=None):
+        """
+        Args:
+            max_fps, max_steps_per_frame: STREAM_PARAM の値を上書きする
+        """
+        self.max_fps = max_fps or STREAM_PARAM["max_fps"]
+        self.max_steps_per_frame = max_steps_per_frame or STREAM_PARAM["max_steps_per_frame"]
+        self.last_frame_time = time.perf_counter()
+        super().__init__(model_cls, visualization_elements, name=name, model_params=model_params)
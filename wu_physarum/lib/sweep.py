@@ -0,0 +1,178 @@
+"""
+パラメータスイープ
+
+PHYSARUM_PARAM, LATTICECELL_PARAM, MODEL_PARAM の値の組（設計点）とシード値の全組み合わせについて
+WuPhysarum を実行し、評価値を1つの表（辞書のリスト）にまとめる。
+各モデルには ModelParams (lib/params.py) を与えるため、lib/setting.py の書き換えやプロセスの再起動は不要である。
+
+- 設計点はステージのパラメータ (STAGE_KEYS) ごとにまとめ、WuPhysarumPrototype を1つずつ作って共有する
+  （エージェントのパラメータのみが異なる設計点・シード値では、ステージと拡散処理の前計算を作り直さない）
+- workers が2以上の場合はプロセスプールで並列に実行し、プロトタイプは share() で共有メモリに置く
+  ワーカープロセスは全ジョブで使い回すため、import や numba のコンパイルはプロセスごとに1度だけ行う
+- あるジョブで例外が発生しても、他のジョブは実行を続ける（行のstatusが"failed"になる）
+
+# 使用例
+design = grid_design({"WT": [0.2, 0.4, 0.6], "RT": [10, 15, 20]})
+design += random_design({"dampN": (0.1, 0.3), "filterN_width": [3, 5, 7]}, n=10, seed=0)
+rows = run_sweep("demo.json", design, seeds=[0, 1, 2], steps=500, workers=4)
+write_table(rows, "sweep.csv")
+"""
+
+import csv
+import time
+import random
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .params import ModelParams
+
+
+def grid_design(space):
+    """
+    各パラメータの値のリストの全組み合わせを設計点とする
+
+    入力：{"WT": [0.2, 0.4], "RT": [10, 20]}
+    出力：[{"WT": 0.2, "RT": 10}, {"WT": 0.2, "RT": 20}, {"WT": 0.4, "RT": 10}, {"WT": 0.4, "RT": 20}]
+    """
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_design(space, n, seed=None):
+    """
+    各パラメータの値をランダムに選んだ設計点をn個作る
+
+    space の値は
+        リスト         -> その中から1つ選ぶ
+        (下限, 上限)   -> 範囲から一様に選ぶ（両方がintの場合は上限を含む整数）
+    """
+    rng = random.Random(seed)
+    for name, values in space.items():
+        if isinstance(values, tuple) and len(values) != 2:
+            raise ValueError("range of {} must be (low, high): {}".format(name, values))
+    design = []
+    for _ in range(n):
+        point = {}
+        for name, values in space.items():
+            if not isinstance(values, tuple):
+                point[name] = rng.choice(values)
+            elif all(isinstance(value, int) for value in values):
+                point[name] = rng.randint(*values)
+            else:
+                point[name] = rng.uniform(*values)
+        design.append(point)
+    return design
+
+
+def default_metrics(model):
+    """
+    最終ステップのモデルの評価値
+    （エージェント数, trail_mapの平均・最大, ステージのうちエージェントがいるセルの割合）
+    """
+    stage = np.asarray(model.stage_region) != 0
+    return {
+        "agents": model.agent_count,
+        "trail_mean": float(model.trail_map.mean()),
+        "trail_max": float(model.trail_map.max()),
+        "occupancy": float(np.asarray(model.occupancy_map)[stage].mean()),
+    }
+
+
+def _run_point(prototype, params, seed, steps, engine, model_params, metrics):
+    """
+    1つの (設計点, シード値) を実行する
+    例外はワーカーの外に伝播させず、結果として返す
+    """
+    start = time.time()
+    try:
+        model = prototype.fork(seed, engine=engine, params=params, **(model_params or {}))
+        while model.running and model.schedule.steps < steps:
+            model.step()
+        return {"status": "done", "error": None, "elapsed": time.time() - start,
+                "steps": model.schedule.steps, **metrics(model)}
+    except Exception:
+        return {"status": "failed", "error": traceback.format_exc(), "elapsed": time.time() - start}
+
+
+def run_sweep(datapoint_filename, design, seeds=(0,), steps=1000, engine="vector", diffusion="box",
+              precision="float64", chenu_cache=None, model_params=None, base=None, workers=None,
+              metrics=default_metrics):
+    """
+    design の各設計点と seeds の各シード値の組み合わせを steps ステップずつ実行する
+
+    Args:
+        datapoint_filename: データポイントを表したファイル
+        design: 設計点（パラメータ名と値の辞書）のリスト（grid_design, random_design を参照）
+        seeds: 各設計点で実行するシード値のリスト
+        steps: 実行するステップ数（収束判定で running が False になった場合はそこで止める）
+        engine, diffusion, precision, chenu_cache: WuPhysarum と同じ
+        model_params: WuPhysarum に与える追加の引数 (dict, convergence, network など)
+        base: 設計点で上書きする前のパラメータ（省略時は lib/setting.py の値）
+        workers: プロセス数（1以下の場合はこのプロセスで順に実行する、省略時はCPUコア数）
+        metrics: 最終ステップのモデルから評価値の辞書を返す関数（プロセスプールではpickleできること）
+    Returns:
+        (設計点, シード値) ごとの行 {"point", 設計点の値, "seed", "status", "error", "elapsed", "steps", 評価値}
+        のリスト（design, seeds の順）。status は "done", "failed" のいずれか
+    """
+    from wu_physarum.model import WuPhysarumPrototype
+
+    base = ModelParams() if base is None else base
+    points = [base.replace(**point) for point in design]
+
+    # ステージのパラメータが同じ設計点でプロトタイプを共有する
+    prototypes = {}
+    for params in points:
+        key = params.stage_key()
+        if key not in prototypes:
+            prototypes[key] = WuPhysarumPrototype(
+                datapoint_filename, diffusion, chenu_cache, precision, params=params)
+    jobs = [(i, seed) for i in range(len(points)) for seed in seeds]
+
+    def arguments(i, seed):
+        params = points[i]
+        return prototypes[params.stage_key()], params, seed, steps, engine, model_params, metrics
+
+    rows = [None] * len(jobs)
+
+    def report(k, result):
+        i, seed = jobs[k]
+        rows[k] = {"point": i, **design[i], "seed": seed, **result}
+        print("[point {} seed {}] {}".format(i, seed, result["status"]), flush=True)
+        if result["error"] is not None:
+            print(result["error"], flush=True)
+
+    if workers is not None and workers <= 1:
+        for k, (i, seed) in enumerate(jobs):
+            report(k, _run_point(*arguments(i, seed)))
+        return rows
+
+    try:
+        for prototype in prototypes.values():
+            prototype.share()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_run_point, *arguments(i, seed)): k for k, (i, seed) in enumerate(jobs)}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception:
+                    # ワーカープロセス自体が異常終了した場合
+                    result = {"status": "failed", "error": traceback.format_exc(), "elapsed": None}
+                report(futures[future], result)
+    finally:
+        for prototype in prototypes.values():
+            prototype.close()
+    return rows
+
+
+def write_table(rows, filename):
+    """
+    run_sweep の結果をCSVファイルに書き込む（列は全ての行に現れたキーを出現順に並べる）
+    """
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
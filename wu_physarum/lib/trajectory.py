@@ -0,0 +1,286 @@
+"""
+シミュレーションの状態（chenu_map, trail_map, エージェント）をステップごとに保存する軌跡ファイル
+
+# ディレクトリ構成
+trajectory/
+    meta.json                   # グリッドサイズ、保存形式など
+    index.dat                   # ステップごとの索引（INDEX_DTYPE の行を追記していく）
+    chunk_000000.npz            # 約chunk_bytesバイト分のスナップショットをまとめたもの（compress=True）
+    chunk_000000/*.npy          # 同上（compress=False, メモリマップで読み込める）
+
+各チャンクはスナップショットごとに以下の配列を持つ（{k} はチャンク内で何番目のスナップショットか）
+    chenu_{k}, trail_{k}: shape (width, height) のfield_dtypeの配列
+    agents_{k}:           AGENT_DTYPEの配列
+圧縮したチャンクでも、読み込むステップの配列のみを展開する。
+書き込み中に保持するのは書き出していないチャンク（約chunk_bytesバイト）のみである。
+
+FORMAT_VERSION 1 の軌跡（index.npy, チャンクごとに chenu, trail, agents をまとめた配列）も読み込める。
+
+# 使用例
+writer = TrajectoryWriter("output/trajectory", width=200, height=200, field_dtype="uint8")
+writer.write(model.schedule.steps, model.chenu_map, model.trail_map, model.agent_state())
+writer.close()
+
+reader = TrajectoryReader("output/trajectory")
+snapshot = reader[1000]   # ステップ1000の状態（そのステップの配列のみ読み込む）
+"""
+
+import os
+import json
+
+import numpy as np
+
+
+FORMAT_VERSION = 2
+
+# エージェント1体あたり固定長（9 byte）で保存する
+AGENT_DTYPE = np.dtype([
+    ("x", "<u2"),
+    ("y", "<u2"),
+    ("dir_id", "u1"),
+    ("motion_counter", "<i4"),
+])
+
+INDEX_DTYPE = np.dtype([
+    ("step", "<i8"),
+    ("chunk", "<i4"),
+    ("offset", "<i4"),          # チャンク内で何番目のスナップショットか
+    ("agent_start", "<i8"),     # チャンク内のagents配列での開始位置（FORMAT_VERSION 1 のみ、2 では0）
+    ("agent_count", "<i8"),
+    ("chenu_scale", "<f8"),     # uint8で保存した場合の 値 = 保存値 * scale
+    ("trail_scale", "<f8"),
+])
+
+FIELD_DTYPES = ("float64", "float32", "uint8")
+
+INDEX_FILENAME = "index.dat"
+LEGACY_INDEX_FILENAME = "index.npy"     # FORMAT_VERSION 1
+
+
+def agents_to_records(x, y, dir_id, motion_counter):
+    records = np.zeros(len(x), dtype=AGENT_DTYPE)
+    records["x"], records["y"] = x, y
+    records["dir_id"], records["motion_counter"] = dir_id, motion_counter
+    return records
+
+
+def read_index(dirname):
+    """
+    軌跡の索引（INDEX_DTYPE の配列）を読み込む（書きかけの行は除く）
+    """
+    filename = os.path.join(dirname, INDEX_FILENAME)
+    if not os.path.exists(filename):
+        legacy_filename = os.path.join(dirname, LEGACY_INDEX_FILENAME)
+        if os.path.exists(legacy_filename):
+            return np.load(legacy_filename)
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    rows = os.path.getsize(filename) // INDEX_DTYPE.itemsize
+    return np.fromfile(filename, dtype=INDEX_DTYPE, count=rows)
+
+
+class TrajectoryWriter:
+    """
+    スナップショットを約chunk_bytesバイトずつチャンクにまとめて保存する
+
+    field_dtype:
+        "float64" -> そのまま保存する
+        "float32" -> 単精度に丸めて保存する
+        "uint8"   -> スナップショットごとの最大値で0~255に量子化して保存する
+    compress: Trueのときチャンクを圧縮したnpzで、Falseのときメモリマップ可能なnpyで保存する
+    chunk_bytes: 書き出していないスナップショットの合計がこのバイト数以上になったらチャンクを書き出す
+                 （グリッドサイズによらず、書き込み中のメモリ使用量はおよそchunk_bytesに収まる）
+    """
+    def __init__(self, dirname, width, height, chunk_bytes=64 * 1024 ** 2, field_dtype="float32", compress=True,
+                 resume_step=None):
+        """
+        resume_stepを指定すると、既存の軌跡のうちresume_step未満のステップを残して続きから書き込む
+        （チェックポイントから再開する場合に使う）
+        """
+        if field_dtype not in FIELD_DTYPES:
+            raise ValueError("field_dtype must be one of {}: {}".format(FIELD_DTYPES, field_dtype))
+        self.dirname = dirname
+        self.width, self.height = width, height
+        self.chunk_bytes = chunk_bytes
+        self.field_dtype = np.dtype(field_dtype)
+        self.compress = compress
+
+        os.makedirs(dirname, exist_ok=True)
+        self.__chunk_id = 0
+        index = read_index(dirname) if resume_step is not None else np.zeros(0, dtype=INDEX_DTYPE)
+        if len(index) > 0:
+            # 新しいチャンクは既存のチャンクの後ろに書く
+            self.__chunk_id = int(index["chunk"].max()) + 1
+        # resume_step以降の行は捨てる（FORMAT_VERSION 1 の索引は index.dat に移す）
+        index = index[index["step"] < resume_step] if len(index) > 0 else index
+        index.astype(INDEX_DTYPE).tofile(os.path.join(dirname, INDEX_FILENAME))
+        legacy_filename = os.path.join(dirname, LEGACY_INDEX_FILENAME)
+        if os.path.exists(legacy_filename):
+            os.remove(legacy_filename)
+
+        with open(os.path.join(dirname, "meta.json"), "w") as f:
+            json.dump({
+                "version": FORMAT_VERSION,
+                "width": width,
+                "height": height,
+                "chunk_bytes": chunk_bytes,
+                "field_dtype": field_dtype,
+                "compress": compress,
+            }, f, indent=4)
+
+        self.__rows = []                    # 書き出していないスナップショットの索引の行
+        self.__arrays = {}                  # 書き出していないスナップショットの配列
+        self.__pending_bytes = 0
+
+    def __quantize(self, field):
+        if self.field_dtype != np.uint8:
+            return np.array(field, dtype=self.field_dtype), 1.0
+        vmax = float(np.max(field, initial=0.0))
+        scale = vmax / 255 if vmax > 0 else 1.0
+        out = np.empty(np.shape(field), dtype=np.uint8)
+        np.rint(np.clip(field, 0, None) / scale, out=out, casting="unsafe")
+        return out, scale
+
+    def write(self, step, chenu_map, trail_map, agents):
+        """
+        Args:
+            step: ステップ数
+            chenu_map, trail_map: (width, height) の配列
+            agents: (x, y, dir_id, motion_counter) の配列の組
+        """
+        records = agents_to_records(*agents)
+        chenu, chenu_scale = self.__quantize(chenu_map)
+        trail, trail_scale = self.__quantize(trail_map)
+        offset = len(self.__rows)
+        self.__rows.append((step, self.__chunk_id, offset, 0, len(records), chenu_scale, trail_scale))
+        self.__arrays.update({
+            "chenu_{}".format(offset): chenu,
+            "trail_{}".format(offset): trail,
+            "agents_{}".format(offset): records,
+        })
+        self.__pending_bytes += chenu.nbytes + trail.nbytes + records.nbytes
+        if self.__pending_bytes >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        書きかけのチャンクをファイルに書き出し、索引に追記する
+        """
+        if not self.__rows:
+            return
+        name = os.path.join(self.dirname, "chunk_{:06d}".format(self.__chunk_id))
+        if self.compress:
+            np.savez_compressed(name + ".npz", **self.__arrays)
+        else:
+            os.makedirs(name, exist_ok=True)
+            for key, array in self.__arrays.items():
+                np.save(os.path.join(name, key + ".npy"), array)
+        # チャンクを書き終えてから索引に追記する（索引の行は常に書き終えたチャンクを指す）
+        with open(os.path.join(self.dirname, INDEX_FILENAME), "ab") as f:
+            f.write(np.array(self.__rows, dtype=INDEX_DTYPE).tobytes())
+
+        self.__chunk_id += 1
+        self.__rows = []
+        self.__arrays = {}
+        self.__pending_bytes = 0
+
+    def close(self):
+        self.flush()
+
+
+class TrajectoryReader:
+    """
+    TrajectoryWriterで保存した軌跡を読み込む
+
+    指定したステップの配列のみを読み込む（compress=Falseの場合はメモリマップする）
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(os.path.join(dirname, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.index = read_index(dirname)
+        self.__step_to_row = {int(step): i for i, step in enumerate(self.index["step"])}
+        self.__chunk_id = None
+        self.__chunk = None
+        self.__legacy_chunk = None
+
+    @property
+    def steps(self):
+        return self.index["step"]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, step):
+        return step in self.__step_to_row
+
+    def __open(self, chunk_id):
+        """
+        圧縮したチャンクを開く（npzは配列ごとに展開できるため、開いたままにして必要な配列のみ読む）
+        """
+        if self.__chunk_id != chunk_id:
+            self.close()
+            self.__chunk = np.load(os.path.join(self.dirname, "chunk_{:06d}.npz".format(chunk_id)))
+            self.__chunk_id = chunk_id
+        return self.__chunk
+
+    def __load(self, chunk_id, key):
+        """
+        チャンク chunk_id の配列 key を読み込む（key がなければ None）
+        """
+        if self.meta["compress"]:
+            chunk = self.__open(chunk_id)
+            return chunk[key] if key in chunk.files else None
+        filename = os.path.join(self.dirname, "chunk_{:06d}".format(chunk_id), key + ".npy")
+        return np.load(filename, mmap_mode="r") if os.path.exists(filename) else None
+
+    def __load_legacy(self, chunk_id, row):
+        """
+        FORMAT_VERSION 1 のチャンク（chenu, trail, agents をまとめた配列）から row のスナップショットを取り出す
+        """
+        if self.__legacy_chunk is None or self.__legacy_chunk[0] != chunk_id:
+            self.__legacy_chunk = chunk_id, {key: self.__load(chunk_id, key) for key in ("chenu", "trail", "agents")}
+        chunk = self.__legacy_chunk[1]
+        offset, agent_start = int(row["offset"]), int(row["agent_start"])
+        return chunk["chenu"][offset], chunk["trail"][offset], \
+            chunk["agents"][agent_start:agent_start + int(row["agent_count"])]
+
+    def __getitem__(self, step):
+        """
+        stepの状態を {"step", "chenu_map", "trail_map", "agents"} として返す
+        （chenu_map, trail_mapは量子化を戻したfloat64の配列、agentsはAGENT_DTYPEの配列）
+        """
+        if step not in self.__step_to_row:
+            raise KeyError("step {} is not recorded".format(step))
+        row = self.index[self.__step_to_row[step]]
+        chunk_id, offset = int(row["chunk"]), int(row["offset"])
+        chenu = self.__load(chunk_id, "chenu_{}".format(offset))
+        if chenu is None:
+            # FORMAT_VERSION 1 で書いたチャンク（version 1 の軌跡を続きから書いた場合は混在する）
+            chenu, trail, agents = self.__load_legacy(chunk_id, row)
+        else:
+            trail = self.__load(chunk_id, "trail_{}".format(offset))
+            agents = self.__load(chunk_id, "agents_{}".format(offset))
+        return {
+            "step": int(row["step"]),
+            "chenu_map": chenu.astype(np.float64) * row["chenu_scale"],
+            "trail_map": trail.astype(np.float64) * row["trail_scale"],
+            "agents": agents,
+        }
+
+    def close(self):
+        if self.__chunk is not None:
+            self.__chunk.close()
+            self.__chunk = self.__chunk_id = None
+
+    def occupancy_map(self, step):
+        """
+        stepでエージェントが存在するセルをTrueとする二次元配列を返す
+        """
+        agents = self[step]["agents"]
+        occupancy = np.zeros((self.meta["width"], self.meta["height"]), dtype=bool)
+        occupancy[agents["x"], agents["y"]] = True
+        return occupancy
+
+    def __iter__(self):
+        for step in self.steps:
+            yield self[int(step)]
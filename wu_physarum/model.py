@@ -1,36 +1,280 @@
 import sys
-from itertools import product
+import copy
+import random
 
 from mesa import Model
 from mesa.time import RandomActivation
-from mesa.space import SingleGrid
 import numpy as np
-from scipy import signal
 
-from .agent import Physarum
-from .lib.jsondeal import jsonreader
-from .lib.setting import MODEL_PARAM, LATTICECELL_PARAM
+from .agent import PhysarumPool
+from .jit_agent import KernelPhysarum
+from .vector_agent import VectorizedPhysarum
+from .lib.checkpoint import read_checkpoint, write_checkpoint
+from .lib.chenu_cache import CachedChenuDiffusion, ChenuCache, create_cached_diffusion
+from .lib.convergence import ConvergenceMonitor
+from .lib.datapoint import read_datapoints
+from .lib.diffusion import SparseDiffusion, create_diffusion
+from .lib.jit import kernel_available
+from .lib.memory import is_mapped, iter_arrays, memory_report, precision_dtypes, root_array
+from .lib.network import TrailNetworkAnalyzer
+from .lib.occupancy import OccupancyGrid
+from .lib.params import ModelParams
+from .lib.profiler import StepProfiler
+from .lib.rasterize import coords2ndarray, datapoint_intensity, datapoint_region  # noqa: F401
+from .lib.setting import MODEL_PARAM
+from .lib.shared import SharedArrayRef, SharedArrays, file_source, write_raw
 
 
-def all_zero_stage():
-    return np.zeros((MODEL_PARAM["width"], MODEL_PARAM["height"]))
+def all_zero_stage(dtype=np.float64, params=None):
+    model_param = MODEL_PARAM if params is None else params.model
+    return np.zeros((model_param["width"], model_param["height"]), dtype=dtype)
 
 
-def all_one_stage():
-    return np.ones((MODEL_PARAM["width"], MODEL_PARAM["height"]))
+def all_one_stage(dtype=np.float64, params=None):
+    model_param = MODEL_PARAM if params is None else params.model
+    return np.ones((model_param["width"], model_param["height"]), dtype=dtype)
 
 
-def coords2ndarray(coords):
+def create_stage(datapoint_pos, precision="float64", params=None):
     """
-    プロットされる点の座標のみが入っている二次元配列を、
-    プロットされる点の座標の要素が1となっている二次元配列に変換する
+    データポイントの座標から、乱数によらないステージの配列を作成する
+    （WuPhysarum, WuPhysarumEnsemble で共通）
 
-    入力：((0, 0), (1, 1)) ※1に指定されている座標が(0, 0)と(1, 1)だと解釈
-    出力：np.array([[1, 0],
-                    [0, 1]])
+    precision: 配列の精度（lib/memory.py を参照）
+        "float64" -> マスク・強度マップともに float64（従来通り）
+        "float32" -> マスクを uint8 (create_physarum_region は bool)、強度マップを float32 で作る
+    params: グリッドのサイズ・データポイント周辺の半径と強度に使う ModelParams
+            （Noneの場合は lib/setting.py の値）
+
+    出力：{"star_stage", "create_physarum_region", "stage_region",
+           "chenu_adding_region", "chenu_adding_intensity"}
+    """
+    dtypes = precision_dtypes(precision)
+    if params is None:
+        params = ModelParams()
+
+    # create masked stage
+    from .lib.star_stage import StarStage
+    star_stage = StarStage(params.model["width"], params.model["height"])
+    pivot = (100, 120)
+    R = 5
+    W = 5
+    star_stage.draw_rect(pivot[0], pivot[1], 0, W, 10 * R, 0)      # 品物a
+    star_stage.draw_rect(pivot[0], pivot[1], 0, W, 12 * R, 60)     # 品物b
+    star_stage.draw_rect(pivot[0], pivot[1], 0, W,  7 * R, 120)    # 品物c
+    star_stage.draw_rect(pivot[0], pivot[1], 0, W,  9 * R, 180)    # 品物d
+    star_stage.draw_rect(pivot[0], pivot[1], 0, W, 21 * R, 240)    # 品物e
+    star_stage.draw_rect(pivot[0], pivot[1], 0, W, 16 * R, 300)    # 品物f
+
+    # create stage including Lattice Cells function
+    return {
+        "star_stage": star_stage,
+        "create_physarum_region": all_one_stage(dtypes["region"], params),               # モジホコリが生成されうる区域
+        "stage_region": all_one_stage(dtypes["mask"], params),                           # ステージの区域
+        "chenu_adding_region":                                                           # chenuが追加される区域（データポイント周辺）
+            create_chenu_adding_region(datapoint_pos, params).astype(dtypes["mask"], copy=False),
+        "chenu_adding_intensity":                                                        # 追加されるchenuの強度マップ
+            create_chenu_adding_intensity(datapoint_pos, params).astype(dtypes["field"], copy=False),
+    }
+
+
+def create_chenu_adding_region(pos, params=None):
+    """
+    ステップごとにchenuが追加される区域を作成する。
+    返り値は追加される座標を1、そうでない座標を0とする2次元配列とする。
+    """
+    if params is None:
+        params = ModelParams()
+    return datapoint_region(pos, params.model["width"], params.model["height"],
+                            radius=params.lattice["datapoint_radius"])
+
+
+def create_chenu_adding_intensity(pos, params=None):
+    """
+    ステップごとにどの座標にいくらの強度のchenuが追加されるかのマップを作成する。
+    (create_chenu_adding_regionとは違い、出力されるマップには0, 1以外の値も含む)
+    """
+    if not isinstance(pos, np.ndarray) and len({len(p) for p in pos}) > 1:
+        print("エラー：座標によってintensityの設定が異なります")
+        sys.exit()
+    if params is None:
+        params = ModelParams()
+    # 強度を持たない座標には CN を追加する
+    intensity = None if len(pos) and len(pos[0]) >= 3 else params.lattice["CN"]
+    return datapoint_intensity(pos, params.model["width"], params.model["height"],
+                               radius=params.lattice["datapoint_radius"], intensity=intensity)
+
+
+# プロトタイプが持つ配列をたどる深さ（プロトタイプ → キャッシュ → 拡散処理 → BoxSum, SparseField）
+PROTOTYPE_DEPTH = 4
+
+
+class WuPhysarumPrototype:
+    """
+    乱数によらないモデルの構築を1度だけ行い、シード値ごとのWuPhysarumを作るためのひな形
+
+    WuPhysarumの生成で行うデータポイントの読み込み (read_datapoints), ステージの作成 (create_stage),
+    拡散処理の前計算（周辺ステージセル数の convolve2d, 係数）はシード値によらない。
+    プロトタイプはこれらを1度だけ行い、fork(seed) で作るモデルは
+    - ステージ・データポイント周辺の配列と拡散処理の定数部分: コピーせずに共有する（読み取り専用）
+    - chenu_map, trail_map, 拡散処理のバッファ, エージェント: モデルごとに作る
+    ため、モデルごとの生成はほぼエージェントの配置のみになる。
+    fork(seed) のモデルは、同じ引数で WuPhysarum を作った場合と完全に一致する。
+    乱数生成器 (random) はモデルごとに持つため、複数のモデルを作って交互に実行しても結果は変わらない
+    （debug_fork_compare.py を参照）。
+    プロトタイプを共有できるのは、ステージのパラメータ (ModelParams.stage_key) が同じモデルのみで、
+    エージェントのパラメータ (PHYSARUM_PARAM, density) は fork(seed, params=...) でモデルごとに変えられる。
+
+    # プロセス間での共有
+    - fork で起動したプロセス（Linuxの multiprocessing の既定）には、親プロセスで作ったプロトタイプの配列が
+      コピーされずに引き継がれる（読み取り専用なので copy-on-write のコピーも起きない）
+    - share() を呼ぶと配列を共有メモリに写し、以降pickleしたプロトタイプは配列の中身ではなく
+      共有メモリの名前（メモリマップした配列はファイル名）のみを送る。
+      ProcessPoolExecutor のジョブの引数や spawn で起動したプロセスでも配列はコピーされない。
+      共有メモリは close() （もしくは with 文の終了時）に解放する
+
+    # 使用例
+    with WuPhysarumPrototype(datapoint_filename="demo.json", diffusion="box").share() as prototype:
+        models = [prototype.fork(seed, engine="vector") for seed in range(10)]
+        jobs = [ExperimentJob(..., seed=seed, model_params={"prototype": prototype}) for seed in range(10)]
+        run_experiments(jobs)
     """
-    array = [[(i, j) in coords for j in range(MODEL_PARAM["height"])] for i in range(MODEL_PARAM["width"])]
-    return np.array(array)
+    def __init__(self, datapoint_filename, diffusion="convolve", chenu_cache=None, precision="float64",
+                 params=None):
+        """
+        Args:
+            datapoint_filename, diffusion, chenu_cache, precision: WuPhysarum と同じ
+            params: ステージ・拡散処理に使う ModelParams（Noneの場合は lib/setting.py の値）
+                    fork で params を省略したモデルはこれを使う
+        """
+        self.datapoint_filename = datapoint_filename
+        self.diffusion_backend = diffusion
+        self.precision = precision
+        self.params = ModelParams() if params is None else params
+        field_dtype = precision_dtypes(precision)["field"]
+        self.torus = False
+
+        # read datapoint position and create stage
+        self.datapoint_pos = read_datapoints(datapoint_filename)
+        stage = create_stage(self.datapoint_pos, precision, self.params)
+        self.star_stage             = stage["star_stage"]
+        self.create_physarum_region = stage["create_physarum_region"]
+        self.stage_region           = stage["stage_region"]
+        self.chenu_adding_region    = stage["chenu_adding_region"]
+        self.chenu_adding_intensity = stage["chenu_adding_intensity"]
+
+        # create lattice cell updater (adjacent cell map for adjusting the magnification is also created)
+        self.diffusion = create_diffusion(
+            diffusion,
+            self.stage_region,
+            self.chenu_adding_region,
+            self.chenu_adding_intensity,
+            self.torus,
+            dtype=field_dtype,
+            lattice=self.params.lattice,
+        )
+        if chenu_cache is True:
+            chenu_cache = ChenuCache()
+        self.chenu_cache = chenu_cache or None
+        if self.chenu_cache is not None:
+            # 定常状態に達した後は trail_map のみを拡散する
+            self.diffusion = create_cached_diffusion(
+                self.chenu_cache,
+                self.diffusion,
+                diffusion,
+                self.stage_region,
+                self.chenu_adding_region,
+                self.chenu_adding_intensity,
+                self.torus,
+                dtype=field_dtype,
+                lattice=self.params.lattice,
+            )
+
+        self.__frozen = False
+        self.__shared = None                # share() で確保した共有メモリ (SharedArrays)
+        self.__refs = {}                    # id(配列) -> (配列, SharedArrayRef)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __freeze(self):
+        """
+        プロトタイプの配列を読み取り専用にする（モデルから書き込まれないことを保証する）
+        拡散処理のバッファはモデルごとに確保するので、プロトタイプのものは解放する
+        """
+        if not self.__frozen:
+            self.diffusion.release()
+            for _, array in iter_arrays(self, PROTOTYPE_DEPTH):
+                array.setflags(write=False)
+            self.__frozen = True
+
+    def fork_diffusion(self):
+        """
+        定数部分の配列をプロトタイプと共有し、バッファのみをモデルごとに確保した拡散処理を返す
+        """
+        self.__freeze()
+        return self.diffusion.fork()
+
+    def fork(self, seed, **kwargs):
+        """
+        シード値seedのWuPhysarumを作る
+
+        Args:
+            kwargs: WuPhysarum に与えるその他の引数 (engine, convergence, profiler, network, params)
+        """
+        return WuPhysarum(self.datapoint_filename, seed=seed, prototype=self, **kwargs)
+
+    def share(self):
+        """
+        配列を共有メモリに写し、pickleした場合に配列の中身ではなく参照を送るようにする
+        （メモリマップした配列は共有メモリに写さず、ファイルを開き直す）
+        """
+        self.__freeze()
+        if self.__shared is not None:
+            return self
+        arrays = [array for _, array in iter_arrays(self, PROTOTYPE_DEPTH)]
+        roots = {}
+        for array in arrays:
+            root = root_array(array)
+            roots.setdefault(id(root), root)
+        owned = [root for root in roots.values() if not is_mapped(root)]
+        self.__shared = SharedArrays(
+            {str(i): (None, (root.nbytes,), np.uint8) for i, root in enumerate(owned)}, create=True)
+        sources = {}
+        for i, root in enumerate(owned):
+            write_raw(root, self.__shared[str(i)])
+            shm_name, _, _ = self.__shared.spec[str(i)]
+            sources[id(root)] = ("shm", shm_name, root.nbytes)
+        for root in roots.values():
+            if is_mapped(root):
+                sources[id(root)] = file_source(root)
+        for array in arrays:
+            root = root_array(array)
+            self.__refs[id(array)] = (array, SharedArrayRef(sources[id(root)], root, array))
+        return self
+
+    def close(self):
+        """
+        share() で確保した共有メモリを解放する（共有メモリを開いたプロセスのモデルは使えなくなる）
+        """
+        if self.__shared is not None:
+            self.__shared.close(unlink=True)
+            self.__shared = None
+            self.__refs = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        refs = state["_WuPhysarumPrototype__refs"]
+        state["_WuPhysarumPrototype__shared"] = None
+        state["_WuPhysarumPrototype__refs"] = {}
+        if not refs:
+            return state
+        # 共有した配列を参照に置き換えた状態をpickleする
+        memo = {key: ref for key, (_, ref) in refs.items()}
+        return copy.deepcopy(state, memo)
 
 
 class WuPhysarum(Model):
@@ -41,6 +285,15 @@ class WuPhysarum(Model):
         self,
         datapoint_filename,
         seed,
+        engine="mesa",
+        diffusion=None,
+        convergence=None,
+        profiler=None,
+        chenu_cache=None,
+        network=None,
+        precision=None,
+        prototype=None,
+        params=None,
     ):
         """
         新しいTSPソルバを作る
@@ -48,170 +301,345 @@ class WuPhysarum(Model):
         Args:
             height, width: 空間のサイズ(pixel)
             density: モジホコリエージェントの発生密度(0~1.0)
-            datapoint_filename: データポイントを表したファイル
+            datapoint_filename: データポイントを表したファイル（JSON, CSV, NPY, NPZ, バイナリ、lib/datapoint.py を参照）
             seed: 乱数のシード値
+            engine: エージェントの処理方法
+                "mesa"   -> Physarumをエージェントごとに処理する（従来通り）
+                "vector" -> VectorizedPhysarumで全エージェントを配列として一括処理する
+                "jit"    -> KernelPhysarumで全エージェントを配列として保持し、コンパイルしたカーネルで
+                            1体ずつ処理する（"mesa" と完全に同じ結果になる。lib/jit.py を参照）
+                            numbaがない場合は "mesa" で実行する
+            diffusion: 格子セルの拡散処理のバックエンド（省略時は "convolve"）
+                "convolve" -> scipy.signal.convolve2d（従来通り）
+                "box"      -> 累積和による箱型フィルタ（確保済みバッファ上で計算）
+                "fft"      -> FFTによる畳み込み（フィルタが大きい場合向け）
+                "sparse"   -> 値のあるタイルとエージェントのいるタイルの周辺のみを更新する
+                              （SPARSE_DIFFUSION_PARAM を参照）
+            convergence: 収束判定（lib/convergence.py を参照）
+                None, False -> 判定しない
+                True        -> CONVERGENCE_PARAM の設定で判定する
+                ConvergenceMonitor -> 与えたものを使う
+            profiler: ステップ処理の計測（lib/profiler.py を参照）
+                None, False -> 計測しない
+                True        -> StepProfilerを作って計測する
+                StepProfiler -> 与えたものを使う
+            chenu_cache: chenu_mapの定常状態のキャッシュ（lib/chenu_cache.py を参照）
+                None, False -> 使わない（chenu_mapを毎ステップ拡散する）
+                True        -> CHENU_CACHE_PARAM の設定で使う
+                ChenuCache  -> 与えたものを使う
+            network: trail_mapからのネットワーク抽出と解の評価（lib/network.py を参照）
+                None, False -> 行わない
+                True        -> NETWORK_PARAM の設定で行う
+                TrailNetworkAnalyzer -> 与えたものを使う
+            precision: chenu_map, trail_map とステージのマスクの精度（lib/memory.py を参照、省略時は "float64"）
+                "float64" -> 場・マスクともに float64（従来通り）
+                "float32" -> 場を float32、マスクを uint8 で持ち、拡散処理も float32 で行う
+            prototype: 乱数によらない構築を共有するひな形（WuPhysarumPrototype を参照）
+                None -> このモデルだけで使うものを作る
+                WuPhysarumPrototype -> ステージ・拡散処理の定数部分を共有する
+                    diffusion, chenu_cache, precision はプロトタイプのものを使う
+                    （指定する場合はプロトタイプと同じにすること）
+            params: モデルのパラメータ（lib/params.py を参照）
+                None -> プロトタイプのもの（プロトタイプもない場合は lib/setting.py の値）
+                ModelParams -> 与えたものを使う
+                    プロトタイプを与える場合、ステージのパラメータ (stage_key) はプロトタイプと同じにすること
         """
-        # read datapoint position
-        self.__datapoint_pos = jsonreader(datapoint_filename)
-
-        # create masked stage
-        from .lib.star_stage import StarStage
-        self.star_stage = StarStage(MODEL_PARAM["width"], MODEL_PARAM["height"])
-        pivot = (100, 120)
-        R = 5
-        W = 5
-        self.star_stage.draw_rect(pivot[0], pivot[1], 0, W, 10 * R, 0)      # 品物a
-        self.star_stage.draw_rect(pivot[0], pivot[1], 0, W, 12 * R, 60)     # 品物b
-        self.star_stage.draw_rect(pivot[0], pivot[1], 0, W,  7 * R, 120)    # 品物c
-        self.star_stage.draw_rect(pivot[0], pivot[1], 0, W,  9 * R, 180)    # 品物d
-        self.star_stage.draw_rect(pivot[0], pivot[1], 0, W, 21 * R, 240)    # 品物e
-        self.star_stage.draw_rect(pivot[0], pivot[1], 0, W, 16 * R, 300)    # 品物f
-
-        # create stage including Lattice Cells function
-        self.create_physarum_region   = all_one_stage()                                             # モジホコリが生成されうる区域
-        self.stage_region             = all_one_stage()                                             # ステージの区域
-        self.__chenu_adding_region    = self.__create_chenu_adding_region(self.__datapoint_pos)     # chenuが追加される区域（データポイント周辺）
-        self.__chenu_adding_intensity = self.__create_chenu_adding_intensity(self.__datapoint_pos)  # 追加されるchenuの強度マップ
-        self.chenu_map                = all_zero_stage()                                            # chenuの強度マップ（基本的には変更不要）
-        self.trail_map                = all_zero_stage()                                            # trailの強度マップ（基本的には変更不要）
+        if engine not in ("mesa", "vector", "jit"):
+            raise ValueError("engine must be 'mesa', 'vector' or 'jit': {}".format(engine))
+        if engine == "jit" and not kernel_available():
+            print("numbaがインストールされていないため、engine='mesa' で実行します")
+            engine = "mesa"
+        self.engine = engine
+        # mesa.Model.__new__ は乱数をクラス属性 (cls.random) に作るため、そのままでは
+        # 同じプロセスのWuPhysarumがすべて最後に作ったモデルの乱数を共有してしまう。モデルごとに作り直す
+        self._seed = seed
+        self.random = random.Random(seed)
+        if profiler is True:
+            profiler = StepProfiler()
+        self.profiler = profiler or None
+        if prototype is None:
+            prototype = WuPhysarumPrototype(
+                datapoint_filename, diffusion or "convolve", chenu_cache, precision or "float64", params)
+            # このモデルだけで使うので、拡散処理はそのまま使う
+            diffusion_updater = prototype.diffusion
+        else:
+            for key, value, expected in (
+                    ("datapoint_filename", datapoint_filename, prototype.datapoint_filename),
+                    ("diffusion", diffusion, prototype.diffusion_backend),
+                    ("precision", precision, prototype.precision)):
+                if value is not None and value != expected:
+                    raise ValueError("prototype {} mismatch: {} != {}".format(key, value, expected))
+            if chenu_cache:
+                raise ValueError("chenu_cache must be given to the prototype")
+            if params is not None and params.stage_key() != prototype.params.stage_key():
+                raise ValueError("prototype params mismatch: {} != {}".format(params, prototype.params))
+            diffusion_updater = prototype.fork_diffusion()
+        self.params = prototype.params if params is None else params
+        self.datapoint_filename = prototype.datapoint_filename
+        self.diffusion_backend = prototype.diffusion_backend
+        self.precision = prototype.precision
+        field_dtype = precision_dtypes(self.precision)["field"]
+
+        # datapoint position and stage (プロトタイプで作成したものを共有する)
+        self.__datapoint_pos          = prototype.datapoint_pos
+        self.star_stage               = prototype.star_stage
+        self.create_physarum_region   = prototype.create_physarum_region   # モジホコリが生成されうる区域
+        self.stage_region             = prototype.stage_region             # ステージの区域
+        self.__chenu_adding_region    = prototype.chenu_adding_region      # chenuが追加される区域（データポイント周辺）
+        self.__chenu_adding_intensity = prototype.chenu_adding_intensity   # 追加されるchenuの強度マップ
+        self.chenu_map                = all_zero_stage(field_dtype, self.params)  # chenuの強度マップ（基本的には変更不要）
+        self.trail_map                = all_zero_stage(field_dtype, self.params)  # trailの強度マップ（基本的には変更不要）
 
         # create physarum agents
-        self.torus = False
-        self.grid = SingleGrid(
-            width=MODEL_PARAM["width"],
-            height=MODEL_PARAM["height"],
+        self.torus = prototype.torus
+        self.grid = OccupancyGrid(
+            width=self.params.model["width"],
+            height=self.params.model["height"],
             torus=self.torus,
         )
         self.schedule = RandomActivation(self)
-        for x, _row in enumerate(self.create_physarum_region):
-            for y, create_region in enumerate(_row):
-                if create_region and self.random.random() < MODEL_PARAM["density"]:
-                    phy = Physarum(
-                        pos=(x, y),
-                        model=self,
-                    )
-                    self.grid.place_agent(phy, (x, y))
-                    self.schedule.add(phy)
-
-        # create adjacent cell map for adjusting the magnification
-        boundary = "wrap" if self.torus else "fill"
-        cnf_w, cnf_h, trf_w, trf_h = (
-            LATTICECELL_PARAM["filterN_width"],
-            LATTICECELL_PARAM["filterN_height"],
-            LATTICECELL_PARAM["filterT_width"],
-            LATTICECELL_PARAM["filterT_height"],
-        )
+        self.physarum_pool = PhysarumPool(self)
+        self.vectorized_agents = None
+        if self.engine == "vector":
+            # エージェントはgrid, scheduleに登録せず配列として保持する
+            self.vectorized_agents = VectorizedPhysarum(self, seed)
+            self.vectorized_agents.seed_agents(self.create_physarum_region, self.params.model["density"])
+        elif self.engine == "jit":
+            # 乱数・IDの割り当ては "mesa" と同じで、エージェントを配列として保持する
+            self.vectorized_agents = KernelPhysarum(self)
+            self.vectorized_agents.seed_agents(self.create_physarum_region, self.params.model["density"])
+        else:
+            for x, _row in enumerate(self.create_physarum_region):
+                for y, create_region in enumerate(_row):
+                    if create_region and self.random.random() < self.params.model["density"]:
+                        phy = self.physarum_pool.acquire((x, y))
+                        self.grid.place_agent(phy, (x, y))
+                        self.schedule.add(phy)
 
-        adjacent_stage_region_cell_num_on_chenu_map = \
-            signal.convolve2d(
-                self.stage_region, np.ones((cnf_w, cnf_h)), mode="same", boundary=boundary
-            )
+        # lattice cell updater (adjacent cell map for adjusting the magnification is created in the prototype)
+        self.diffusion = diffusion_updater
+        self.chenu_cache = prototype.chenu_cache
+        self.__track_occupancy()
         self.fixed_adjacent_stage_region_cell_num_on_chenu_map = \
-            np.maximum(
-                adjacent_stage_region_cell_num_on_chenu_map,
-                np.ones((MODEL_PARAM["width"], MODEL_PARAM["height"]))
-            )
-        adjacent_stage_region_cell_num_on_trail_map = \
-            signal.convolve2d(
-                self.stage_region, np.ones((trf_w, trf_h)), mode="same", boundary=boundary
-            )
+            self.diffusion.fixed_adjacent_stage_region_cell_num_on_chenu_map
         self.fixed_adjacent_stage_region_cell_num_on_trail_map = \
-            np.maximum(
-                adjacent_stage_region_cell_num_on_trail_map,
-                np.ones((MODEL_PARAM["width"], MODEL_PARAM["height"]))
-            )
+            self.diffusion.fixed_adjacent_stage_region_cell_num_on_trail_map
+
+        # create convergence monitor
+        if convergence is True:
+            convergence = ConvergenceMonitor()
+        self.convergence_monitor = convergence or None
+
+        # create trail network analyzer
+        if network is True:
+            network = TrailNetworkAnalyzer()
+        self.network_analyzer = network or None
 
         # start simulation
-        print("初期配置エージェント数: {}".format(len(self.schedule.agents)))
+        print("初期配置エージェント数: {}".format(self.agent_count))
         self.running = True
 
-    def __create_chenu_adding_region(self, pos):
+    def __track_occupancy(self):
         """
-        ステップごとにchenuが追加される区域を作成する。
-        返り値は追加される座標を1、そうでない座標を0とする2次元配列とする。
+        "sparse" の拡散処理にエージェントの占有マップを渡す（trailが付着しうるタイルを有効にするため）
         """
-        datapoint_pos = []
-        for p in pos:
-            for i, j in product(range(-1, 2), range(-1, 2)):
-                _p = (p[0] + i, p[1] + j)
-                if 0 <= _p[0] < MODEL_PARAM["width"] and 0 <= _p[1] < MODEL_PARAM["height"]:
-                    datapoint_pos.append(_p)
-        datapoint_region = coords2ndarray(tuple(datapoint_pos))
-        return datapoint_region
+        diffusion = self.diffusion
+        if isinstance(diffusion, CachedChenuDiffusion):
+            diffusion = diffusion.diffusion
+        if isinstance(diffusion, SparseDiffusion):
+            diffusion.track_occupancy(self.occupancy_map)
 
-    def __create_chenu_adding_intensity(self, pos):
+    def __update_map(self, chenu_map, trail_map):
         """
-        ステップごとにどの座標にいくらの強度のchenuが追加されるかのマップを作成する。
-        (__create_chenu_adding_regionとは違い、出力されるマップには0, 1以外の値も含む)
+        chenu_map, trail_mapの更新を行う
+        (計算の詳細は lib/diffusion.py を参照)
         """
-        chenu_map = np.zeros((MODEL_PARAM["width"], MODEL_PARAM["height"]))
-        is_intensity_settled = len(pos[0]) == 3
+        return self.diffusion.update(chenu_map, trail_map)
 
-        for p in pos:
-            if len(p) != 2 + is_intensity_settled:
-                print("エラー：座標によってintensityの設定が異なります")
-                sys.exit()
-            for i, j in product(range(-1, 2), range(-1, 2)):
-                _p = (p[0] + i, p[1] + j)
-                if 0 <= _p[0] < MODEL_PARAM["width"] and 0 <= _p[1] < MODEL_PARAM["height"]:
-                    chenu_map[_p[0]][_p[1]] = p[2] if is_intensity_settled else LATTICECELL_PARAM["CN"]
-        return chenu_map
+    @property
+    def datapoint_region(self):
+        return self.__chenu_adding_region
 
-    def __update_map(self, chenu_map, trail_map):
+    @property
+    def datapoint_pos(self):
+        return self.__datapoint_pos
+
+    @property
+    def agent_count(self):
+        if self.vectorized_agents is not None:
+            return len(self.vectorized_agents)
+        return self.schedule.get_agent_count()
+
+    @property
+    def occupancy_map(self):
         """
-        chenu_map, trail_mapの更新を行う
+        モジホコリエージェントが存在するセルをTrueとする二次元配列を返す
+        （読み取り専用のビューで、以降のステップの変更が反映される。保持する場合はコピーすること）
         """
-        boundary = "wrap" if self.torus else "fill"
+        if self.vectorized_agents is not None:
+            view = self.vectorized_agents.occupied.view()
+            view.flags.writeable = False
+            return view
+        return self.grid.occupancy_view()
 
+    def memory_report(self):
         """
-        Applying average filter
+        モデルが保持する配列ごとのメモリ使用量を返す（lib/memory.py を参照）
         """
-        cnf_w, cnf_h, dampN = (
-            LATTICECELL_PARAM["filterN_width"],
-            LATTICECELL_PARAM["filterN_height"],
-            LATTICECELL_PARAM["dampN"])
-        cnf = np.full((cnf_w, cnf_h), (1 - dampN) / (cnf_w * cnf_h))
-        trf_w, trf_h, dampT = (
-            LATTICECELL_PARAM["filterT_width"],
-            LATTICECELL_PARAM["filterT_height"],
-            LATTICECELL_PARAM["dampT"])
-        trf = np.full((trf_w, trf_h), (1 - dampT) / (trf_w * trf_h))
-
-        chenu_map = signal.convolve2d(chenu_map, cnf, mode="same", boundary=boundary)
-        trail_map = signal.convolve2d(trail_map, trf, mode="same", boundary=boundary)
+        return memory_report(self)
 
+    def agent_state(self):
         """
-        Adjust the magnification on trail_map, chenu_map for star_stage
-        (trail/chenu_map) .* (周辺セル数) ./ (周辺ステージセル数) .* (self.stage_region)
+        全エージェントの状態を配列の組 (x, y, dir_id, motion_counter) として返す
         """
-        chenu_map = chenu_map * (cnf_w * cnf_h)\
-            / self.fixed_adjacent_stage_region_cell_num_on_chenu_map
-        trail_map = trail_map * (trf_w * trf_h)\
-            / self.fixed_adjacent_stage_region_cell_num_on_trail_map
+        if self.vectorized_agents is not None:
+            agents = self.vectorized_agents
+            return agents.x.copy(), agents.y.copy(), agents.dir_id.copy(), agents.motion_counter.copy()
+        agents = self.schedule.agents
+        return (
+            np.array([a.pos[0] for a in agents], dtype=np.int64),
+            np.array([a.pos[1] for a in agents], dtype=np.int64),
+            np.array([a.dir_id for a in agents], dtype=np.int64),
+            np.array([a.motion_counter for a in agents], dtype=np.int64),
+        )
 
+    def save_checkpoint(self, filename):
         """
-        Exclude overhang trail and chenu
+        モデルの状態をfilenameに保存する
+
+        保存する状態：パラメータ, 乱数生成器の状態, chenu_map, trail_map, スケジュールのステップ数,
+                      全エージェント（スケジュール順の unique_id, pos, dir_id, motion_counter）,
+                      PhysarumPoolのID割り当ての状態
         """
-        chenu_map *= self.stage_region
-        trail_map *= self.stage_region
+        state = {
+            "datapoint_filename": self.datapoint_filename,
+            "engine": self.engine,
+            "diffusion": self.diffusion_backend,
+            "precision": self.precision,
+            "params": self.params.as_dict(),
+            "random": self.random.getstate(),
+            "chenu_map": self.chenu_map.copy(),
+            "trail_map": self.trail_map.copy(),
+            "steps": self.schedule.steps,
+            "time": self.schedule.time,
+            "running": self.running,
+            "physarum_pool": self.physarum_pool.get_state(),
+        }
+        if self.convergence_monitor is not None:
+            state["convergence"] = self.convergence_monitor.get_state()
+        if self.network_analyzer is not None:
+            state["network"] = self.network_analyzer.get_state()
+        if self.vectorized_agents is not None:
+            state["agents"] = self.vectorized_agents.get_state()
+        else:
+            state["agents"] = [
+                (a.unique_id, a.pos, a.dir_id, a.motion_counter) for a in self.schedule.agents
+            ]
+        write_checkpoint(filename, state)
 
+    def load_checkpoint(self, filename):
         """
-        Add chenu on datapoint
+        save_checkpointで保存した状態を復元する
+        復元後のステップ実行は、保存元のモデルを実行し続けた場合と完全に一致する
         """
-        # Exclude filter effect in datapoint region
-        chenu_map *= (1 - self.__chenu_adding_region)
-        # Add chenu on datapoint
-        chenu_map += self.__chenu_adding_intensity
+        state = read_checkpoint(filename)
+        for key, value in (
+                ("datapoint_filename", self.datapoint_filename),
+                ("engine", self.engine),
+                ("diffusion", self.diffusion_backend),
+                ("precision", self.precision)):
+            # precision を保存していないチェックポイントは float64
+            saved = state.get(key, "float64")
+            if saved != value:
+                raise ValueError("checkpoint {} mismatch: {} != {}".format(key, saved, value))
+        # params を保存していないチェックポイントは、保存時の lib/setting.py の値で実行したもの
+        if "params" in state and state["params"] != self.params.as_dict():
+            raise ValueError("checkpoint params mismatch: {} != {}".format(
+                ModelParams(**state["params"]), self.params))
 
-        return [chenu_map, trail_map]
+        self.chenu_map = state["chenu_map"].copy()
+        self.trail_map = state["trail_map"].copy()
+        self.running = state["running"]
+        if self.convergence_monitor is not None and "convergence" in state:
+            self.convergence_monitor.set_state(state["convergence"])
+        if self.network_analyzer is not None and "network" in state:
+            self.network_analyzer.set_state(state["network"])
 
-    @property
-    def datapoint_region(self):
-        return self.__chenu_adding_region
+        self.grid = OccupancyGrid(
+            width=self.params.model["width"],
+            height=self.params.model["height"],
+            torus=self.torus,
+        )
+        self.schedule = RandomActivation(self)
+        self.physarum_pool = PhysarumPool(self)
+        self.schedule.steps, self.schedule.time = state["steps"], state["time"]
+        if isinstance(self.diffusion, CachedChenuDiffusion):
+            self.diffusion.seek(state["steps"])
+        if self.vectorized_agents is not None:
+            self.vectorized_agents.set_state(state["agents"])
+        else:
+            # スケジュールへの登録順が実行順を決めるため、保存時と同じ順に登録する
+            for unique_id, pos, dir_id, motion_counter in state["agents"]:
+                phy = self.physarum_pool.acquire(pos)
+                phy.unique_id = unique_id
+                phy.dir_id = dir_id
+                phy.motion_counter = motion_counter
+                self.grid.place_agent(phy, pos)
+                self.schedule.add(phy)
+
+        self.__track_occupancy()
+
+        # エージェントの生成で乱数とIDが消費されるため、最後に復元する
+        self.physarum_pool.set_state(state["physarum_pool"])
+        self.random.setstate(state["random"])
 
     def step(self):
+        if self.profiler is not None:
+            self.__profiled_step(self.profiler)
+            return
+
         # モジホコリエージェントのステップ処理
         self.schedule.step()
+        self.physarum_pool.end_step()
+        if self.vectorized_agents is not None:
+            self.vectorized_agents.step()
 
         # 格子セルのステップ処理
         self.chenu_map, self.trail_map = self.__update_map(self.chenu_map, self.trail_map)
+
+        # 収束判定（収束した場合は self.running が False になる）
+        if self.convergence_monitor is not None:
+            self.convergence_monitor.update(self)
+
+        # ネットワーク抽出と解の評価（interval ステップごと）
+        if self.network_analyzer is not None:
+            self.network_analyzer.update(self)
+
+    def __profiled_step(self, profiler):
+        """
+        stepと同じ処理を、各処理の所要時間をprofilerに集計しながら行う
+        """
+        now = profiler.now
+        t_start = now()
+        self.schedule.step()
+        self.physarum_pool.end_step()
+        if self.vectorized_agents is not None:
+            self.vectorized_agents.step()
+        t_agents = now()
+
+        self.chenu_map, self.trail_map = self.__update_map(self.chenu_map, self.trail_map)
+        t_lattice = now()
+
+        if self.convergence_monitor is not None:
+            self.convergence_monitor.update(self)
+        t_convergence = now()
+
+        if self.network_analyzer is not None:
+            self.network_analyzer.update(self)
+        t_end = now()
+
+        profiler.add_time("agents", t_agents - t_start)
+        profiler.add_time("lattice", t_lattice - t_agents)
+        profiler.add_time("convergence", t_convergence - t_lattice)
+        profiler.add_time("network", t_end - t_convergence)
+        profiler.end_step(self.schedule.steps, self.agent_count)
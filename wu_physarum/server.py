@@ -1,34 +1,25 @@
-from mesa.visualization.modules import CanvasGrid
-from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.UserParam import UserSettableParameter
 
 from .model import WuPhysarum
-from .lib.setting import MODEL_PARAM
+from .lib.stream import FrameStreamElement, FrameStreamServer
 
 
-def agent_portrayal(agent):
-    portrayal = {
-        "Shape": "circle",
-        "Color": "red",
-        "Filled": "true",
-        "Layer": 0,
-        "r": 1
-    }
-    return portrayal
-
-
-grid = CanvasGrid(
-    portrayal_method=agent_portrayal,
-    grid_width=MODEL_PARAM["width"],
-    grid_height=MODEL_PARAM["height"],
-    canvas_width=600,
-    canvas_height=600
-)
+# occupancy, trail_map, chenu_map を画像として送る（エージェントごとの描画は行わない）
+# 送るマップや縮小率は lib/setting.py の STREAM_PARAM を参照
+frames = FrameStreamElement()
 
 seed = 1  # this seed can be changed freely
 
-server = ModularServer(
+server = FrameStreamServer(
     model_cls=WuPhysarum,
-    visualization_elements=[grid],
+    visualization_elements=[frames],
     name="Wu's Physarum Model",
-    model_params={"datapoint_filename": "demo.json", "seed": seed},
+    model_params={
+        "datapoint_filename": "demo.json",
+        "seed": seed,
+        # エージェントの処理方法 (model.py を参照)
+        "engine": UserSettableParameter("choice", "Engine", value="mesa", choices=["mesa", "vector", "jit"]),
+        # 収束したと判定した時点でシミュレーションを停止する (lib/setting.py の CONVERGENCE_PARAM を参照)
+        "convergence": UserSettableParameter("checkbox", "Stop on convergence", value=False),
+    },
 )
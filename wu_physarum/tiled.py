@@ -0,0 +1,465 @@
+import os
+import traceback
+import multiprocessing
+
+import numpy as np
+
+from .agent import NINF
+from .model import create_stage
+from .vector_agent import resolve_moves, turned_dir_id
+from .lib.datapoint import read_datapoints
+from .lib.diffusion import create_diffusion
+from .lib.params import sensor_offset_array
+from .lib.setting import LATTICECELL_PARAM, MODEL_PARAM, PHYSARUM_PARAM
+from .lib.shared import SharedArrays
+
+
+# 隣のストリップへの移動の依頼の列（移動先のx, y, 移動後のdir_id, 移動後のmotion_counter）
+REQUEST_FIELDS = 4
+LEFT, RIGHT = 0, 1
+
+
+def strip_halo():
+    """
+    各ワーカーが隣のストリップから読む行数
+
+    エージェント: センサーの位置 (sensor_arm_length // 2) と移動先 (1)
+    格子セル:     平均フィルタの半径 (filterN_width, filterT_width)
+    """
+    return max(
+        PHYSARUM_PARAM["sensor_arm_length"] // 2,
+        1,
+        LATTICECELL_PARAM["filterN_width"] // 2,
+        LATTICECELL_PARAM["filterT_width"] // 2,
+    )
+
+
+def strip_bounds(width, tiles):
+    """
+    x方向に width を tiles 個のストリップに分けた境界 [x0, x1) のリストを返す
+    """
+    edges = np.linspace(0, width, tiles + 1).astype(np.int64)
+    return [(int(x0), int(x1)) for x0, x1 in zip(edges[:-1], edges[1:])]
+
+
+class StripPhysarum:
+    """
+    1つのストリップ [x0, x1) に属するエージェント群を処理するワーカー側のエンジン
+
+    処理は VectorizedPhysarum と同じだが、共有メモリ上の配列を全ワーカーで分け合うため、
+    1ステップを以下のフェーズに分け、フェーズの間で全ワーカーを同期する。
+    どのフェーズでも書き込むのは自分のストリップのセルのみで、隣のストリップは読むだけである。
+
+    1. sense:   センシング・旋回・移動先の計算（chenu_map, trail_mapを読む）
+    2. move:    ストリップ内への移動を乱数順位で解決し、trailを付着させる
+                隣のストリップへの移動は、順位の順に依頼としてメールボックスに書く
+    3. accept:  隣のストリップからの依頼を順に処理し、移動先が空いていれば受け入れる
+                （移動元のセルはまだ空けないので、同じステップ内の立ち退きは使えない）
+    4. settle:  受け入れられた移動を確定し、増殖・消滅を行う
+    5. lattice: ストリップの格子セルを、両側 strip_halo() 行を含めて拡散し、次の面に書く
+    """
+    def __init__(self, index, bounds, shared, rng, diffusion):
+        self.index = index
+        self.tiles = len(bounds)
+        self.x0, self.x1 = bounds[index]
+        self.shared = shared
+        self.rng = rng
+        self.width, self.height = shared["occupied"].shape
+        self.current = 0                    # 現在のchenu_map, trail_mapの面
+        # センサー・移動先の位置のずれをdir_idで引ける配列 (shape: (8, 2))
+        self.lsensor_offset, self.rsensor_offset, self.forward_offset = \
+            sensor_offset_array(PHYSARUM_PARAM["sensor_arm_length"]).transpose(1, 0, 2)
+
+        halo = strip_halo()
+        self.__slab = slice(max(0, self.x0 - halo), min(self.width, self.x1 + halo))
+        self.__inner = slice(self.x0 - self.__slab.start, self.x1 - self.__slab.start)
+        stage = shared["stage"]
+        self.stage_region = stage[0]
+        self.diffusion = create_diffusion(
+            diffusion, stage[0, self.__slab], stage[1, self.__slab], stage[2, self.__slab], False)
+
+        self.x = np.zeros(0, dtype=np.int64)
+        self.y = np.zeros(0, dtype=np.int64)
+        self.dir_id = np.zeros(0, dtype=np.int64)
+        self.motion_counter = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def chenu_map(self):
+        return self.shared["maps"][0, self.current]
+
+    @property
+    def trail_map(self):
+        return self.shared["maps"][1, self.current]
+
+    def set_agents(self, x, y, dir_id, motion_counter):
+        self.x, self.y = x.copy(), y.copy()
+        self.dir_id, self.motion_counter = dir_id.copy(), motion_counter.copy()
+
+    def get_state(self):
+        return {
+            "x": self.x.copy(),
+            "y": self.y.copy(),
+            "dir_id": self.dir_id.copy(),
+            "motion_counter": self.motion_counter.copy(),
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def __shifted(self, offset):
+        sx = self.x + offset[self.dir_id, 0]
+        sy = self.y + offset[self.dir_id, 1]
+        in_bounds = (0 <= sx) & (sx < self.width) & (0 <= sy) & (sy < self.height)
+        return np.where(in_bounds, sx, 0), np.where(in_bounds, sy, 0), in_bounds
+
+    def __get_weighted_value(self, offset):
+        sx, sy, in_bounds = self.__shifted(offset)
+        weighted_value = self.trail_map[sx, sy] * PHYSARUM_PARAM["WT"] \
+            + self.chenu_map[sx, sy] * PHYSARUM_PARAM["WN"]
+        return np.where(in_bounds, weighted_value, NINF), in_bounds
+
+    def sense(self):
+        Lweighted_value, Lvalid = self.__get_weighted_value(self.lsensor_offset)
+        Rweighted_value, Rvalid = self.__get_weighted_value(self.rsensor_offset)
+        self.dir_id = turned_dir_id(self.dir_id, Lweighted_value, Rweighted_value, Lvalid, Rvalid)
+
+        fx, fy, in_bounds = self.__shifted(self.forward_offset)
+        self.__forward = fx, fy
+        self.__can_move = in_bounds & (self.stage_region[fx, fy] != 0)
+
+    def __resolve_moves(self, rank, fx, fy, can_move):
+        """
+        VectorizedPhysarum と同じ解決を、ストリップ内の移動についてのみ行う（セル番号はストリップ内の番号）
+        """
+        return resolve_moves(
+            rank, (fx - self.x0) * self.height + fy, (self.x - self.x0) * self.height + self.y,
+            self.shared["occupied"][self.x0:self.x1].ravel(), can_move,
+            self.motion_counter + 1 > PHYSARUM_PARAM["RT"])
+
+    def move(self):
+        n = len(self)
+        rank = np.empty(n, dtype=np.int64)
+        rank[self.rng.permutation(n)] = np.arange(n)
+        fx, fy = self.__forward
+        is_inside = (self.x0 <= fx) & (fx < self.x1)
+        moved = self.__resolve_moves(rank, fx, fy, self.__can_move & is_inside)
+
+        # 隣のストリップへの移動は順位の順に依頼する
+        crossing = np.nonzero(self.__can_move & ~is_inside)[0]
+        crossing = crossing[np.argsort(rank[crossing], kind="stable")]
+        self.__crossing = []
+        for side, is_side in ((LEFT, fx[crossing] < self.x0), (RIGHT, fx[crossing] >= self.x1)):
+            agents = crossing[is_side]
+            self.shared["requests"][self.index, side, :len(agents)] = np.stack([
+                fx[agents], fy[agents], self.dir_id[agents], self.motion_counter[agents] + 1], axis=1)
+            self.shared["request_counts"][self.index, side] = len(agents)
+            self.__crossing.append(agents)
+
+        # ストリップ内の移動を確定する
+        self.__source = self.x, self.y
+        trail_map, occupied = self.trail_map, self.shared["occupied"]
+        trail_map[self.x[moved], self.y[moved]] += PHYSARUM_PARAM["depT"]
+        # 増殖するエージェントの元のセルは settle で分身を置くため空けない（accept で隣から入れないようにする）
+        leaver = moved & ~(self.motion_counter + 1 > PHYSARUM_PARAM["RT"])
+        occupied[self.x[leaver], self.y[leaver]] = False
+        self.x = np.where(moved, fx, self.x)
+        self.y = np.where(moved, fy, self.y)
+        occupied[self.x[moved], self.y[moved]] = True
+        self.__moved = moved
+
+    def accept(self):
+        """
+        左右のストリップからの移動の依頼を処理する
+        """
+        occupied = self.shared["occupied"]
+        immigrants = []
+        for neighbour, side in ((self.index - 1, RIGHT), (self.index + 1, LEFT)):
+            if not 0 <= neighbour < self.tiles:
+                continue
+            count = self.shared["request_counts"][neighbour, side]
+            requests = self.shared["requests"][neighbour, side, :count]
+            is_accepted = np.zeros(count, dtype=bool)
+            is_free = np.nonzero(~occupied[requests[:, 0], requests[:, 1]])[0]
+            # 同じセルへの依頼は、先に書かれた（順位が小さい）ものを受け入れる
+            _, first = np.unique(requests[is_free, 0] * self.height + requests[is_free, 1], return_index=True)
+            is_accepted[is_free[np.sort(first)]] = True
+            self.shared["accepted"][neighbour, side, :count] = is_accepted
+            accepted = requests[is_accepted]
+            occupied[accepted[:, 0], accepted[:, 1]] = True
+            immigrants.append(accepted)
+        self.__immigrants = np.concatenate(immigrants) if immigrants \
+            else np.zeros((0, REQUEST_FIELDS), dtype=np.int64)
+
+    def settle(self):
+        moved = self.__moved
+        is_emigrant = np.zeros(len(self), dtype=bool)
+        for side, agents in zip((LEFT, RIGHT), self.__crossing):
+            accepted = agents[self.shared["accepted"][self.index, side, :len(agents)]]
+            is_emigrant[accepted] = True
+        moved |= is_emigrant
+
+        # 隣のストリップへ移動したエージェントの元の位置にtrailを付着させ、セルを空ける
+        trail_map, occupied = self.trail_map, self.shared["occupied"]
+        trail_map[self.x[is_emigrant], self.y[is_emigrant]] += PHYSARUM_PARAM["depT"]
+        occupied[self.x[is_emigrant], self.y[is_emigrant]] = False
+        source_x, source_y = self.__source
+        reproduction_x, reproduction_y = source_x[moved], source_y[moved]
+
+        self.motion_counter += np.where(moved, 1, -1)
+        failed = ~moved
+        self.dir_id[failed] = self.rng.integers(0, 8, size=np.count_nonzero(failed))
+
+        is_reproducted = moved & (self.motion_counter > PHYSARUM_PARAM["RT"])
+        is_alive = self.motion_counter >= PHYSARUM_PARAM["ET"]
+        occupied[self.x[~is_alive], self.y[~is_alive]] = False
+        is_kept = is_alive & ~is_emigrant
+        self.x, self.y = self.x[is_kept], self.y[is_kept]
+        self.dir_id, self.motion_counter = self.dir_id[is_kept], self.motion_counter[is_kept]
+
+        is_reproducted = is_reproducted[moved]
+        n_chrone = np.count_nonzero(is_reproducted)
+        reproduction_x, reproduction_y = reproduction_x[is_reproducted], reproduction_y[is_reproducted]
+        immigrants = self.__immigrants
+        self.x = np.concatenate([self.x, reproduction_x, immigrants[:, 0]])
+        self.y = np.concatenate([self.y, reproduction_y, immigrants[:, 1]])
+        self.dir_id = np.concatenate([self.dir_id, self.rng.integers(0, 8, size=n_chrone), immigrants[:, 2]])
+        self.motion_counter = np.concatenate([
+            self.motion_counter, np.zeros(n_chrone, dtype=np.int64), immigrants[:, 3]])
+        occupied[reproduction_x, reproduction_y] = True
+
+    def lattice(self):
+        maps, slab, inner = self.shared["maps"], self.__slab, self.__inner
+        chenu_map, trail_map = self.diffusion.update(maps[0, self.current, slab], maps[1, self.current, slab])
+        maps[0, 1 - self.current, self.x0:self.x1] = chenu_map[inner]
+        maps[1, 1 - self.current, self.x0:self.x1] = trail_map[inner]
+
+    def end_step(self):
+        self.current = 1 - self.current
+
+
+PHASES = ("sense", "move", "accept", "settle", "lattice")
+
+
+def _worker(index, bounds, spec, params, rng_state, agents, diffusion, conn, barrier):
+    """
+    ストリップ index を担当するワーカープロセス
+
+    親プロセスから (命令, 引数) を受け取り、結果を返す
+        ("step", k)  -> k ステップ進め、エージェント数を返す
+        ("state", _) -> StripPhysarum.get_state() を返す
+        ("close", _) -> 終了する
+    例外が起きた場合は他のワーカーが同期で止まらないようbarrierを壊し、("error", トレースバック) を返す
+    """
+    for setting, values in zip((MODEL_PARAM, PHYSARUM_PARAM, LATTICECELL_PARAM), params):
+        setting.update(values)
+    shared = SharedArrays(spec)
+    strip = None
+    try:
+        rng = np.random.default_rng()
+        rng.bit_generator.state = rng_state
+        strip = StripPhysarum(index, bounds, shared, rng, diffusion)
+        strip.set_agents(*agents)
+        conn.send(("ok", len(strip)))
+        while True:
+            command, argument = conn.recv()
+            if command == "step":
+                for _ in range(argument):
+                    for phase in PHASES:
+                        getattr(strip, phase)()
+                        barrier.wait()
+                    strip.end_step()
+                conn.send(("ok", len(strip)))
+            elif command == "state":
+                conn.send(("ok", strip.get_state()))
+            elif command == "close":
+                break
+    except Exception:
+        barrier.abort()
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        # 共有メモリを閉じる前に、そのビューを持つオブジェクトを解放する
+        strip = None
+        shared.close()
+
+
+class WuPhysarumTiled:
+    """
+    グリッドをx方向のストリップに分け、ストリップごとのワーカープロセスで並列に実行するモデル
+
+    chenu_map, trail_map, エージェントの占有マップ, ステージは共有メモリに置き、
+    各ワーカーは自分のストリップのエージェントと格子セルを StripPhysarum で処理する。
+    ストリップの幅は strip_halo()（フィルタの半径とセンサーの距離の大きい方）以上とし、
+    ワーカーが読み書きするのは隣のストリップまでに限る。
+
+    エージェントの処理は WuPhysarum(engine="vector") と同じだが、
+    - 乱数はワーカーごとに独立した生成器（シード値とストリップ数から作る）から引く
+    - 隣のストリップへの移動は、ストリップ内の移動を解決した後に移動先のワーカーが受け入れる
+    ため、結果はシード値とストリップ数が同じなら常に一致する（ワーカーの実行順にはよらない）。
+    ストリップ数が1の場合は WuPhysarum(engine="vector", diffusion=同じもの) と一致する。
+
+    # 使用例
+    MODEL_PARAM.update(width=4000, height=4000)
+    with WuPhysarumTiled(datapoint_filename="demo.json", seed=1, tiles=os.cpu_count()) as model:
+        for _ in range(10):
+            model.run(100)
+            print(model.steps, model.agent_count)
+    """
+    def __init__(self, datapoint_filename, seed, tiles=None, diffusion="box"):
+        """
+        Args:
+            datapoint_filename: データポイントを表したファイル
+            seed: 乱数のシード値
+            tiles: ストリップ（ワーカープロセス）の数（省略時はCPU数）
+            diffusion: 格子セルの拡散処理のバックエンド（WuPhysarum と同じ）
+        """
+        width, height = MODEL_PARAM["width"], MODEL_PARAM["height"]
+        tiles = tiles or os.cpu_count()
+        if width // tiles < strip_halo():
+            raise ValueError("too many tiles for width {}: each strip needs at least {} rows".format(
+                width, strip_halo()))
+        self.seed = seed
+        self.tiles = tiles
+        self.bounds = strip_bounds(width, tiles)
+        self.datapoint_filename = datapoint_filename
+        self.diffusion_backend = diffusion
+        self.steps = 0
+        self.torus = False
+
+        # read datapoint position and create stage
+        self.__datapoint_pos = read_datapoints(datapoint_filename)
+        stage = create_stage(self.__datapoint_pos)
+        self.create_physarum_region = stage["create_physarum_region"]
+        self.__chenu_adding_region = stage["chenu_adding_region"]
+
+        self.shared = SharedArrays({
+            "maps": (None, (2, 2, width, height), np.float64),          # [chenu, trail] × 2面
+            "stage": (None, (3, width, height), np.float64),            # ステージ, データポイント, chenuの強度
+            "occupied": (None, (width, height), np.bool_),
+            "requests": (None, (tiles, 2, height, REQUEST_FIELDS), np.int64),
+            "request_counts": (None, (tiles, 2), np.int64),
+            "accepted": (None, (tiles, 2, height), np.bool_),
+        }, create=True)
+        self.shared["stage"][0] = stage["stage_region"]
+        self.shared["stage"][1] = stage["chenu_adding_region"]
+        self.shared["stage"][2] = stage["chenu_adding_intensity"]
+
+        # create physarum agents (VectorizedPhysarum.seed_agents と同じ配置)
+        rng = np.random.default_rng(seed)
+        is_created = (np.asarray(self.create_physarum_region) != 0) & (rng.random((width, height)) < MODEL_PARAM["density"])
+        x, y = np.nonzero(is_created)
+        dir_id = rng.integers(0, 8, size=len(x))
+        self.shared["occupied"][x, y] = True
+        if tiles == 1:
+            rng_states = [rng.bit_generator.state]
+        else:
+            rng_states = [np.random.default_rng(child).bit_generator.state
+                          for child in np.random.SeedSequence(seed).spawn(tiles)]
+
+        # start workers
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(tiles)
+        params = (dict(MODEL_PARAM), dict(PHYSARUM_PARAM), dict(LATTICECELL_PARAM))
+        self.__connections, self.__workers = [], []
+        for index, (x0, x1) in enumerate(self.bounds):
+            is_inside = (x0 <= x) & (x < x1)
+            agents = (x[is_inside], y[is_inside], dir_id[is_inside], np.zeros(np.count_nonzero(is_inside), dtype=np.int64))
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(
+                target=_worker,
+                args=(index, self.bounds, self.shared.spec, params, rng_states[index], agents, diffusion,
+                      child_conn, barrier),
+                daemon=True,
+            )
+            worker.start()
+            self.__connections.append(parent_conn)
+            self.__workers.append(worker)
+        self.__counts = self.__receive()
+
+        print("初期配置エージェント数: {}".format(self.agent_count))
+        self.running = True
+
+    def __receive(self):
+        results, errors = [], []
+        for conn in self.__connections:
+            status, result = conn.recv()
+            (results if status == "ok" else errors).append(result)
+        if errors:
+            self.close()
+            raise RuntimeError("worker failed:\n{}".format(errors[0]))
+        return results
+
+    def __send(self, command, argument=None):
+        for conn in self.__connections:
+            conn.send((command, argument))
+        return self.__receive()
+
+    def run(self, steps):
+        """
+        stepsステップ進める（ワーカーとの通信は1回で済む）
+        """
+        self.__counts = self.__send("step", steps)
+        self.steps += steps
+
+    def step(self):
+        self.run(1)
+
+    @property
+    def chenu_map(self):
+        return self.shared["maps"][0, self.steps % 2]
+
+    @property
+    def trail_map(self):
+        return self.shared["maps"][1, self.steps % 2]
+
+    @property
+    def datapoint_region(self):
+        return self.__chenu_adding_region
+
+    @property
+    def agent_count(self):
+        return int(sum(self.__counts))
+
+    @property
+    def occupancy_map(self):
+        """
+        モジホコリエージェントが存在するセルをTrueとする二次元配列を返す（WuPhysarum と同じく読み取り専用のビュー）
+        """
+        view = self.shared["occupied"].view()
+        view.flags.writeable = False
+        return view
+
+    def agent_state(self):
+        """
+        全エージェントの状態を配列の組 (x, y, dir_id, motion_counter) として返す（ストリップの順に並べる）
+        """
+        states = self.__send("state")
+        return tuple(np.concatenate([state[key] for state in states])
+                     for key in ("x", "y", "dir_id", "motion_counter"))
+
+    def close(self):
+        if self.shared is None:
+            return
+        for conn, worker in zip(self.__connections, self.__workers):
+            if worker.is_alive():
+                try:
+                    conn.send(("close", None))
+                except OSError:
+                    pass
+        for worker in self.__workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.shared.close(unlink=True)
+        self.shared = None
+        self.running = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, "shared", None) is not None:
+            self.close()
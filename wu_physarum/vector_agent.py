@@ -0,0 +1,441 @@
+import numpy as np
+
+from .agent import NINF
+
+
+# 空きセルの奪い合いを解決する最大ラウンド数
+MAX_MOVE_ROUNDS = 8
+
+
+def turned_dir_id(dir_id, Lweighted_value, Rweighted_value, Lvalid, Rvalid):
+    """
+    左右のセンサーの値から旋回後のdir_idを求める（Physarum.__get_new_dir_id と同じ規則）
+    """
+    turn = np.where(
+        Lweighted_value < Rweighted_value, 1,                      # 右に曲がる
+        np.where(Lweighted_value > Rweighted_value, -1, 0)         # 左に曲がる / 直進する
+    )
+    turn = np.where(~Lvalid & ~Rvalid, 4, turn)                     # 真後ろを向く
+    return (dir_id + turn) % 8
+
+
+def resolve_moves(rank, target, source, occupied, can_move, will_reproduct):
+    """
+    移動先の衝突を乱数順位で解決し、移動に成功したエージェントのマスクを返す
+    （VectorizedPhysarum, EnsemblePhysarum, tiled.StripPhysarum で共通）
+
+    Args:
+        rank: 各エージェントの順位（小さいほど優先する）
+        target, source: 各エージェントの移動先・現在位置のセル番号（occupied の添字）
+        occupied: セル番号で引ける占有マスク（平坦化したもの）
+        can_move: 移動先がステージ内のエージェント（それ以外の target は参照しない）
+        will_reproduct: 移動すると増殖するエージェント（元の位置をクローンで埋めるので空かない）
+    """
+    n = len(rank)
+    target = np.where(can_move, target, 0)
+    # 立ち退いたセルの立ち退いたエージェントの順位 (立ち退いていなければn)
+    vacated_rank = np.full(len(occupied), n, dtype=np.int64)
+    claimed = np.zeros(len(occupied), dtype=bool)
+    moved = np.zeros(n, dtype=bool)
+    for _ in range(MAX_MOVE_ROUNDS):
+        # 空きセル、もしくは自分より先に立ち退いたセルへの移動を候補とする
+        is_free = ~occupied[target] | (vacated_rank[target] < rank)
+        candidate = np.nonzero(can_move & ~moved & is_free & ~claimed[target])[0]
+        if len(candidate) == 0:
+            break
+        # 同じセルを狙うエージェントのうち順位が最小のものが移動する
+        order = np.lexsort((rank[candidate], target[candidate]))
+        candidate = candidate[order]
+        is_first = np.ones(len(candidate), dtype=bool)
+        is_first[1:] = target[candidate][1:] != target[candidate][:-1]
+        winner = candidate[is_first]
+
+        moved[winner] = True
+        claimed[target[winner]] = True
+        leaver = winner[~will_reproduct[winner]]
+        vacated_rank[source[leaver]] = rank[leaver]
+    return moved
+
+
+class VectorizedPhysarum:
+    """
+    モジホコリエージェント群をNumPy配列で一括処理するエンジン
+
+    agent.py の Physarum をエージェントごとに呼び出す代わりに、
+    全エージェントの位置・dir_id・motion_counterを配列として保持し、
+    センシング・旋回・移動・trailの付着・増殖・消滅をまとめて計算する。
+
+    RandomActivationの逐次処理とは異なり全エージェントが同時に判断するため、
+    同じセルへの移動が衝突した場合は毎ステップ割り当てる乱数順位の
+    小さいエージェントのみが移動できる（1セルに1エージェントの制約は維持する）。
+    また、順位が先のエージェントが立ち退いたセルには、
+    順位が後のエージェントが同じステップ内で移動できる。
+    """
+    def __init__(self, model, seed):
+        self.model = model
+        self.rng = np.random.default_rng(seed)
+        self.width, self.height = model.params.model["width"], model.params.model["height"]
+        # センサー・移動先の位置のずれをdir_idで引ける配列 (shape: (8, 2))
+        self.lsensor_offset, self.rsensor_offset, self.forward_offset = \
+            model.params.offset_array.transpose(1, 0, 2)
+
+        self.x = np.zeros(0, dtype=np.int64)
+        self.y = np.zeros(0, dtype=np.int64)
+        self.dir_id = np.zeros(0, dtype=np.int64)
+        self.motion_counter = np.zeros(0, dtype=np.int64)
+        self.occupied = np.zeros((self.width, self.height), dtype=bool)
+
+    def seed_agents(self, create_region, density):
+        """
+        create_regionのうち確率densityでエージェントを配置する
+        """
+        is_created = (np.asarray(create_region) != 0) \
+            & (self.rng.random((self.width, self.height)) < density)
+        x, y = np.nonzero(is_created)
+        self.__append(x, y, self.rng.integers(0, 8, size=len(x)), np.zeros(len(x), dtype=np.int64))
+
+    def __append(self, x, y, dir_id, motion_counter):
+        self.x = np.concatenate([self.x, x])
+        self.y = np.concatenate([self.y, y])
+        self.dir_id = np.concatenate([self.dir_id, dir_id])
+        self.motion_counter = np.concatenate([self.motion_counter, motion_counter])
+        self.occupied[x, y] = True
+
+    def __len__(self):
+        return len(self.x)
+
+    def get_state(self):
+        return {
+            "x": self.x.copy(),
+            "y": self.y.copy(),
+            "dir_id": self.dir_id.copy(),
+            "motion_counter": self.motion_counter.copy(),
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def set_state(self, state):
+        self.x, self.y = state["x"].copy(), state["y"].copy()
+        self.dir_id, self.motion_counter = state["dir_id"].copy(), state["motion_counter"].copy()
+        self.rng.bit_generator.state = state["rng"]
+        self.occupied[...] = False
+        self.occupied[self.x, self.y] = True
+
+    @property
+    def positions(self):
+        return np.stack([self.x, self.y], axis=1)
+
+    def __shifted(self, offset):
+        """
+        各エージェントの位置をoffset (shape: (8, 2)) だけずらした座標と、
+        その座標がグリッド内かどうかを返す
+        """
+        sx = self.x + offset[self.dir_id, 0]
+        sy = self.y + offset[self.dir_id, 1]
+        if self.model.torus is True:
+            sx %= self.width
+            sy %= self.height
+        in_bounds = (0 <= sx) & (sx < self.width) & (0 <= sy) & (sy < self.height)
+        # 範囲外の座標は後段で参照されないよう0に寄せておく
+        return np.where(in_bounds, sx, 0), np.where(in_bounds, sy, 0), in_bounds
+
+    def __get_weighted_value(self, offset):
+        sx, sy, in_bounds = self.__shifted(offset)
+        physarum_param = self.model.params.physarum
+        weighted_value = self.model.trail_map[sx, sy] * physarum_param["WT"] \
+            + self.model.chenu_map[sx, sy] * physarum_param["WN"]
+        return np.where(in_bounds, weighted_value, NINF), in_bounds
+
+    def __resolve_moves(self, fx, fy, can_move):
+        """
+        移動先の衝突を乱数順位で解決し、移動に成功したエージェントのマスクを返す
+        """
+        n = len(self)
+        rank = np.empty(n, dtype=np.int64)
+        rank[self.rng.permutation(n)] = np.arange(n)
+        return resolve_moves(
+            rank, fx * self.height + fy, self.x * self.height + self.y, self.occupied.ravel(), can_move,
+            self.motion_counter + 1 > self.model.params.physarum["RT"])
+
+    def step(self):
+        if len(self) == 0:
+            return
+        profiler = self.model.profiler
+        now = profiler.now if profiler is not None else None
+        trail_map, stage_region = self.model.trail_map, self.model.stage_region
+        physarum_param = self.model.params.physarum
+
+        """ Sensing Step """
+        if profiler is not None:
+            t_start = now()
+        Lweighted_value, Lvalid = self.__get_weighted_value(self.lsensor_offset)
+        Rweighted_value, Rvalid = self.__get_weighted_value(self.rsensor_offset)
+
+        """ Turning Step """
+        if profiler is not None:
+            t_sensed = now()
+        self.dir_id = turned_dir_id(self.dir_id, Lweighted_value, Rweighted_value, Lvalid, Rvalid)
+
+        """ Moving Step """
+        if profiler is not None:
+            t_turned = now()
+        fx, fy, in_bounds = self.__shifted(self.forward_offset)
+        can_move = in_bounds & (stage_region[fx, fy] != 0)
+        moved = self.__resolve_moves(fx, fy, can_move)
+
+        reproduction_x, reproduction_y = self.x[moved], self.y[moved]
+        # 1. deposit trail on now position (各セルには高々1エージェントなので重複しない)
+        trail_map[reproduction_x, reproduction_y] += physarum_param["depT"]
+        # 2. agent moves forward
+        self.occupied[reproduction_x, reproduction_y] = False
+        self.x = np.where(moved, fx, self.x)
+        self.y = np.where(moved, fy, self.y)
+        self.occupied[self.x[moved], self.y[moved]] = True
+        self.motion_counter += np.where(moved, 1, -1)
+        # 移動に失敗したエージェントはランダムな方向を向く
+        failed = ~moved
+        self.dir_id[failed] = self.rng.integers(0, 8, size=np.count_nonzero(failed))
+
+        """ Reproduct/Elimination Step"""
+        if profiler is not None:
+            t_moved = now()
+        # Reproduct
+        is_reproducted = moved & (self.motion_counter > physarum_param["RT"])
+        # Elimination
+        is_alive = self.motion_counter >= physarum_param["ET"]
+        self.occupied[self.x[~is_alive], self.y[~is_alive]] = False
+        self.x, self.y = self.x[is_alive], self.y[is_alive]
+        self.dir_id, self.motion_counter = self.dir_id[is_alive], self.motion_counter[is_alive]
+
+        is_reproducted = is_reproducted[moved]
+        n_chrone = np.count_nonzero(is_reproducted)
+        self.__append(
+            reproduction_x[is_reproducted],
+            reproduction_y[is_reproducted],
+            self.rng.integers(0, 8, size=n_chrone),
+            np.zeros(n_chrone, dtype=np.int64),
+        )
+
+        if profiler is not None:
+            t_end = now()
+            profiler.add_time("sense", t_sensed - t_start)
+            profiler.add_time("turn", t_turned - t_sensed)
+            profiler.add_time("move", t_moved - t_turned)
+            profiler.add_time("reproduce", t_end - t_moved)
+            n_moved = np.count_nonzero(moved)
+            profiler.count("moves", n_moved)
+            profiler.count("failed_moves", len(moved) - n_moved)
+            profiler.count("births", n_chrone)
+            profiler.count("deaths", np.count_nonzero(~is_alive))
+
+
+class EnsemblePhysarum:
+    """
+    複数のレプリカ（シード値だけが異なるモデル）のエージェント群をまとめて処理するエンジン
+
+    全レプリカのエージェントを、所属レプリカの番号 replica とともに1組の配列として保持する。
+    配列はレプリカ番号の順に並べ、各レプリカ内の並びは VectorizedPhysarum と同じに保つ。
+    乱数はレプリカごとに独立した生成器から VectorizedPhysarum と同じ順に引くため、
+    各レプリカの結果は同じシード値の VectorizedPhysarum と一致する。
+    """
+    def __init__(self, model, seeds):
+        self.model = model
+        self.rngs = [np.random.default_rng(seed) for seed in seeds]
+        self.replicas = len(self.rngs)
+        self.width, self.height = model.params.model["width"], model.params.model["height"]
+        self.lsensor_offset, self.rsensor_offset, self.forward_offset = \
+            model.params.offset_array.transpose(1, 0, 2)
+
+        self.replica = np.zeros(0, dtype=np.int64)
+        self.x = np.zeros(0, dtype=np.int64)
+        self.y = np.zeros(0, dtype=np.int64)
+        self.dir_id = np.zeros(0, dtype=np.int64)
+        self.motion_counter = np.zeros(0, dtype=np.int64)
+        self.occupied = np.zeros((self.replicas, self.width, self.height), dtype=bool)
+
+    def seed_agents(self, create_region, density):
+        """
+        各レプリカについて、create_regionのうち確率densityでエージェントを配置する
+        """
+        replica, x, y, dir_id = [], [], [], []
+        for b, rng in enumerate(self.rngs):
+            is_created = (np.asarray(create_region) != 0) \
+                & (rng.random((self.width, self.height)) < density)
+            bx, by = np.nonzero(is_created)
+            replica.append(np.full(len(bx), b, dtype=np.int64))
+            x.append(bx)
+            y.append(by)
+            dir_id.append(rng.integers(0, 8, size=len(bx)))
+        replica = np.concatenate(replica)
+        self.__append(replica, np.concatenate(x), np.concatenate(y), np.concatenate(dir_id),
+                      np.zeros(len(replica), dtype=np.int64))
+
+    def __append(self, replica, x, y, dir_id, motion_counter):
+        """
+        エージェントを各レプリカの末尾に追加する（replicaは昇順に並んでいること）
+        全体を並べ替えずに挿入するため、配列はレプリカ番号の順に保たれる
+        """
+        position = np.cumsum(self.counts)[replica]
+        self.replica = np.insert(self.replica, position, replica)
+        self.x = np.insert(self.x, position, x)
+        self.y = np.insert(self.y, position, y)
+        self.dir_id = np.insert(self.dir_id, position, dir_id)
+        self.motion_counter = np.insert(self.motion_counter, position, motion_counter)
+        self.occupied[replica, x, y] = True
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def counts(self):
+        """
+        レプリカごとのエージェント数
+        """
+        return np.bincount(self.replica, minlength=self.replicas)
+
+    def __blocks(self):
+        """
+        各レプリカのエージェントが並ぶ範囲 (レプリカ番号, slice) を返す
+        """
+        stops = np.cumsum(self.counts)
+        starts = stops - self.counts
+        return [(b, slice(start, stop)) for b, (start, stop) in enumerate(zip(starts, stops))]
+
+    def select(self, b):
+        """
+        レプリカbのエージェントの状態を配列の組 (x, y, dir_id, motion_counter) として返す
+        """
+        block = self.__blocks()[b][1]
+        return self.x[block].copy(), self.y[block].copy(), \
+            self.dir_id[block].copy(), self.motion_counter[block].copy()
+
+    def get_state(self):
+        return {
+            "replica": self.replica.copy(),
+            "x": self.x.copy(),
+            "y": self.y.copy(),
+            "dir_id": self.dir_id.copy(),
+            "motion_counter": self.motion_counter.copy(),
+            "rngs": [rng.bit_generator.state for rng in self.rngs],
+        }
+
+    def set_state(self, state):
+        self.replica = state["replica"].copy()
+        self.x, self.y = state["x"].copy(), state["y"].copy()
+        self.dir_id, self.motion_counter = state["dir_id"].copy(), state["motion_counter"].copy()
+        for rng, rng_state in zip(self.rngs, state["rngs"]):
+            rng.bit_generator.state = rng_state
+        self.occupied[...] = False
+        self.occupied[self.replica, self.x, self.y] = True
+
+    def __shifted(self, offset):
+        sx = self.x + offset[self.dir_id, 0]
+        sy = self.y + offset[self.dir_id, 1]
+        if self.model.torus is True:
+            sx %= self.width
+            sy %= self.height
+        in_bounds = (0 <= sx) & (sx < self.width) & (0 <= sy) & (sy < self.height)
+        return np.where(in_bounds, sx, 0), np.where(in_bounds, sy, 0), in_bounds
+
+    def __get_weighted_value(self, weighted_map, cell_base, offset):
+        """
+        weighted_map（trail, chenuの重み付き和を平坦化したもの）からセンサー位置の値を取り出す
+        """
+        sx, sy, in_bounds = self.__shifted(offset)
+        weighted_value = weighted_map[cell_base + sx * self.height + sy]
+        return np.where(in_bounds, weighted_value, NINF), in_bounds
+
+    def __resolve_moves(self, blocks, cell_base, fx, fy, can_move):
+        """
+        移動先の衝突をレプリカごとの乱数順位で解決し、移動に成功したエージェントのマスクを返す
+        （セル番号にレプリカ番号を含めるため、異なるレプリカのエージェントは衝突しない）
+        """
+        rank = np.empty(len(self), dtype=np.int64)
+        for b, block in blocks:
+            n_block = block.stop - block.start
+            rank[block][self.rngs[b].permutation(n_block)] = np.arange(n_block)
+        return resolve_moves(
+            rank, cell_base + fx * self.height + fy, cell_base + self.x * self.height + self.y,
+            self.occupied.ravel(), can_move, self.motion_counter + 1 > self.model.params.physarum["RT"])
+
+    def step(self):
+        if len(self) == 0:
+            return
+        profiler = self.model.profiler
+        now = profiler.now if profiler is not None else None
+        trail_map, stage_region = self.model.trail_map, self.model.stage_region
+        physarum_param = self.model.params.physarum
+        blocks = self.__blocks()
+
+        """ Sensing Step """
+        if profiler is not None:
+            t_start = now()
+        # 全セルの重み付き和を先に求め、エージェントごとの参照を1回にする
+        weighted_map = (self.model.trail_map * physarum_param["WT"]
+                        + self.model.chenu_map * physarum_param["WN"]).ravel()
+        cell_base = self.replica * (self.width * self.height)
+        Lweighted_value, Lvalid = self.__get_weighted_value(weighted_map, cell_base, self.lsensor_offset)
+        Rweighted_value, Rvalid = self.__get_weighted_value(weighted_map, cell_base, self.rsensor_offset)
+
+        """ Turning Step """
+        if profiler is not None:
+            t_sensed = now()
+        self.dir_id = turned_dir_id(self.dir_id, Lweighted_value, Rweighted_value, Lvalid, Rvalid)
+
+        """ Moving Step """
+        if profiler is not None:
+            t_turned = now()
+        fx, fy, in_bounds = self.__shifted(self.forward_offset)
+        can_move = in_bounds & (stage_region[fx, fy] != 0)
+        moved = self.__resolve_moves(blocks, cell_base, fx, fy, can_move)
+
+        reproduction_replica = self.replica[moved]
+        reproduction_x, reproduction_y = self.x[moved], self.y[moved]
+        # 1. deposit trail on now position
+        trail_map[reproduction_replica, reproduction_x, reproduction_y] += physarum_param["depT"]
+        # 2. agent moves forward
+        self.occupied[reproduction_replica, reproduction_x, reproduction_y] = False
+        self.x = np.where(moved, fx, self.x)
+        self.y = np.where(moved, fy, self.y)
+        self.occupied[reproduction_replica, self.x[moved], self.y[moved]] = True
+        self.motion_counter += np.where(moved, 1, -1)
+        # 移動に失敗したエージェントはランダムな方向を向く
+        failed = ~moved
+        for b, block in blocks:
+            dir_id, block_failed = self.dir_id[block], failed[block]
+            dir_id[block_failed] = self.rngs[b].integers(0, 8, size=np.count_nonzero(block_failed))
+
+        """ Reproduct/Elimination Step"""
+        if profiler is not None:
+            t_moved = now()
+        # Reproduct
+        is_reproducted = moved & (self.motion_counter > physarum_param["RT"])
+        # Elimination
+        is_alive = self.motion_counter >= physarum_param["ET"]
+        self.occupied[self.replica[~is_alive], self.x[~is_alive], self.y[~is_alive]] = False
+        self.replica, self.x, self.y = self.replica[is_alive], self.x[is_alive], self.y[is_alive]
+        self.dir_id, self.motion_counter = self.dir_id[is_alive], self.motion_counter[is_alive]
+
+        is_reproducted = is_reproducted[moved]
+        chrone_replica = reproduction_replica[is_reproducted]
+        chrone_counts = np.bincount(chrone_replica, minlength=self.replicas)
+        chrone_dir_id = np.concatenate(
+            [rng.integers(0, 8, size=count) for rng, count in zip(self.rngs, chrone_counts)])
+        self.__append(
+            chrone_replica,
+            reproduction_x[is_reproducted],
+            reproduction_y[is_reproducted],
+            chrone_dir_id,
+            np.zeros(len(chrone_replica), dtype=np.int64),
+        )
+
+        if profiler is not None:
+            t_end = now()
+            profiler.add_time("sense", t_sensed - t_start)
+            profiler.add_time("turn", t_turned - t_sensed)
+            profiler.add_time("move", t_moved - t_turned)
+            profiler.add_time("reproduce", t_end - t_moved)
+            n_moved = np.count_nonzero(moved)
+            profiler.count("moves", n_moved)
+            profiler.count("failed_moves", len(moved) - n_moved)
+            profiler.count("births", len(chrone_replica))
+            profiler.count("deaths", np.count_nonzero(~is_alive))